@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare staging deletions one path at a time with deprecate.git_rm.
+
+Usage: python benchmarks/git_rm.py [-n COUNT]
+
+A throwaway git repo of COUNT pkginfo files (and as many installers) is
+created in a temporary directory. Its files are deleted, as deprecate
+does before staging, and the deletions are staged with one git rm per
+path and then with the batched git_rm.
+"""
+
+
+import argparse
+import os
+import shutil
+from subprocess import check_call
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+# pylint: disable=wrong-import-position
+from spruce_tools.context import RepoContext
+from spruce_tools.deprecate import git_rm, git_rm_path
+
+
+def git(repo_path, *args):
+    """Run a git command in repo_path, discarding its output."""
+    with open(os.devnull, "w") as devnull:
+        check_call(("git", "-C", repo_path) + args, stdout=devnull)
+
+
+def make_repo(count):
+    """Return a context for a new git repo of 'count' items."""
+    context = RepoContext(tempfile.mkdtemp())
+    paths = []
+    for folder in (context.pkgsinfo_path, context.pkgs_path):
+        os.makedirs(os.path.join(folder, "apps"))
+        for index in xrange(count):
+            path = os.path.join(folder, "apps", "Product-{}".format(index))
+            with open(path, "w") as ofile:
+                ofile.write(path)
+            paths.append(path)
+    git(context.repo_path, "init", "-q")
+    git(context.repo_path, "add", "-A")
+    git(context.repo_path, "-c", "user.name=Spruce", "-c",
+        "user.email=spruce@example.com", "commit", "-q", "-m", "Items")
+    return context, paths
+
+
+def time_staging(context, paths, stage):
+    """Delete paths, then return the time taken by stage(paths)."""
+    git(context.repo_path, "reset", "-q", "--hard")
+    for path in paths:
+        os.remove(path)
+    start = time.time()
+    stage(paths)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--count", type=int, default=1000,
+                        help="Number of pkginfos (default 1000).")
+    args = parser.parse_args()
+
+    context, paths = make_repo(args.count)
+    try:
+        per_path = time_staging(context, paths, lambda paths: [
+            git_rm_path(path, context.repo_path) for path in paths])
+        batched = time_staging(
+            context, paths, lambda paths: git_rm(paths, context))
+    finally:
+        shutil.rmtree(context.repo_path)
+
+    print "Staged {:,} deletions".format(len(paths))
+    print "{:<10} {:>10.3f} s".format("per path", per_path)
+    print "{:<10} {:>10.3f} s".format("batched", batched)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare FoundationPlist backends (and plistlib) on pkginfo-like data.
+
+Usage: python benchmarks/plist_backends.py [-n COUNT] [-r REPEAT] [PLIST]
+
+Without a PLIST argument, a synthetic catalog of COUNT pkginfos (with
+installs arrays and embedded scripts) is generated. Each backend is also
+timed reading only the pkginfo keys the report command uses.
+"""
+
+
+import argparse
+import os
+import plistlib
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from spruce_tools import FoundationPlist  # pylint: disable=wrong-import-position
+from spruce_tools.report import REPORT_FIELDS  # pylint: disable=wrong-import-position
+
+
+def make_pkginfo(index):
+    """Return a synthetic pkginfo shaped like a large real one."""
+    return {
+        "name": "Product{}".format(index % 500),
+        "version": "{}.{}.{}".format(index % 20, index % 7, index),
+        "display_name": "Product & Friends <{}>".format(index),
+        "catalogs": ["production", "testing"],
+        "category": "Productivity",
+        "installer_item_location": "apps/Product-{}.dmg".format(index),
+        "installer_item_size": 123456 + index,
+        "minimum_os_version": "10.9.0",
+        "unattended_install": bool(index % 2),
+        "requires": ["Dependency{}".format(index % 5)],
+        "receipts": [{"packageid": "com.example.pkg{}".format(item),
+                      "version": "1.0.{}".format(item),
+                      "installed_size": item * 100}
+                     for item in xrange(10)],
+        "installs": [{"CFBundleShortVersionString": "1.{}".format(item),
+                      "path": "/Applications/Product{}.app".format(item),
+                      "type": "application",
+                      "md5checksum": "d41d8cd98f00b204e9800998ecf8427e"}
+                     for item in xrange(20)],
+        "postinstall_script": "#!/bin/sh\n" + "echo 'step'\n" * 200}
+
+
+def time_call(func, repeat):
+    """Return the best wall time over 'repeat' calls of func."""
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("plist", nargs="?", help="Existing plist to read.")
+    parser.add_argument("-n", "--count", type=int, default=2000,
+                        help="Number of synthetic pkginfos (default 2000).")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Repetitions per measurement (default 3).")
+    args = parser.parse_args()
+
+    if args.plist:
+        with open(args.plist, "rb") as ifile:
+            data = ifile.read()
+    else:
+        FoundationPlist.set_backend("expat")
+        data = FoundationPlist.writePlistToString(
+            [make_pkginfo(index) for index in xrange(args.count)])
+    print "Input: {:,.1f} MB of XML".format(len(data) / 1000.0 ** 2)
+
+    candidates = [(name, name) for name in
+                  FoundationPlist.get_available_backends()]
+    candidates.append(("plistlib", None))
+    print "{:<12} {:>10} {:>10} {:>14}".format(
+        "backend", "read (s)", "write (s)", "projected (s)")
+    for label, backend in candidates:
+        if backend:
+            FoundationPlist.set_backend(backend)
+            read = FoundationPlist.readPlistFromString
+            write = FoundationPlist.writePlistToString
+        else:
+            read = plistlib.readPlistFromString
+            write = plistlib.writePlistToString
+        root = read(data)
+        read_time = time_call(lambda: read(data), args.repeat)
+        write_time = time_call(lambda: write(root), args.repeat)
+        if backend:
+            projected = "{:>14.3f}".format(time_call(
+                lambda: read(data, REPORT_FIELDS), args.repeat))
+        else:
+            projected = "{:>14}".format("-")
+        print "{:<12} {:>10.3f} {:>10.3f} {}".format(
+            label, read_time, write_time, projected)
+
+
+if __name__ == "__main__":
+    main()
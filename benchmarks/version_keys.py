@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare version_key against LooseVersion for sorting and comparing.
+
+Usage: python benchmarks/version_keys.py [-n COUNT] [-r REPEAT]
+"""
+
+
+import argparse
+from distutils.version import LooseVersion
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from spruce_tools import version_keys  # pylint: disable=wrong-import-position
+
+
+def make_versions(count):
+    """Return 'count' version strings shaped like those in a repo."""
+    rnd = random.Random(0)
+    templates = ("{}.{}.{}", "{}.{}", "{}.{}.{}.{}", "{}.{}b{}", "{}.{}.{}rc{}")
+    versions = []
+    for _ in xrange(count):
+        template = rnd.choice(templates)
+        versions.append(template.format(
+            *(rnd.randint(0, 60) for _ in xrange(template.count("{}")))))
+    return versions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--count", type=int, default=50000,
+                        help="Number of version strings (default 50000).")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Repetitions per measurement (default 3).")
+    args = parser.parse_args()
+
+    versions = make_versions(args.count)
+    pairs = zip(versions, reversed(versions))
+
+    def loose_sort():
+        sorted(versions, key=LooseVersion)
+
+    def key_sort():
+        sorted(versions, key=version_keys.version_key)
+
+    def loose_compare():
+        for first, second in pairs:
+            LooseVersion(first) < LooseVersion(second)
+
+    def key_compare():
+        for first, second in pairs:
+            version_keys.version_key(first) < version_keys.version_key(second)
+
+    def cold(func):
+        def run():
+            version_keys.clear_cache()
+            func()
+        return run
+
+    print "{:,} versions".format(args.count)
+    print "{:<28} {:>10}".format("operation", "best (s)")
+    for label, func in (("sort, LooseVersion", loose_sort),
+                        ("sort, version_key (cold)", cold(key_sort)),
+                        ("sort, version_key (warm)", key_sort),
+                        ("compare, LooseVersion", loose_compare),
+                        ("compare, version_key (cold)", cold(key_compare)),
+                        ("compare, version_key (warm)", key_compare)):
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print "{:<28} {:>10.3f}".format(label, best)
+
+
+if __name__ == "__main__":
+    main()
@@ -39,17 +39,32 @@ dictionary).
 
 To work with plist data in strings, you can use readPlistFromString()
 and writePlistToString().
+
+Spruce adds a pure-Python backend (see expat_plist.py) for platforms
+without PyObjC. Foundation is used when it can be imported; set the
+SPRUCE_PLIST_BACKEND environment variable to "foundation" or "expat", or
+call set_backend(), to choose explicitly. iterPlist(filepath) yields the
+items of an array plist one at a time; the expat backend parses the
+file incrementally to do so.
 """
 
+import os
+import tempfile
+
 # PyLint cannot properly find names inside Cocoa libraries, so issues bogus
 # No name 'Foo' in module 'Bar' warnings. Disable them.
 # pylint: disable=E0611
-from Foundation import NSData
-from Foundation import NSPropertyListSerialization
-from Foundation import NSPropertyListMutableContainers
-from Foundation import NSPropertyListXMLFormat_v1_0
+try:
+    from Foundation import NSData
+    from Foundation import NSPropertyListSerialization
+    from Foundation import NSPropertyListMutableContainers
+    from Foundation import NSPropertyListXMLFormat_v1_0
+except ImportError:
+    NSPropertyListSerialization = None
 # pylint: enable=E0611
 
+import expat_plist
+
 # Disable PyLint complaining about 'invalid' camelCase names
 # pylint: disable=C0103
 
@@ -66,10 +81,11 @@ class NSPropertyListWriteException(FoundationPlistException):
     """Write error for plists"""
     pass
 
-def readPlist(filepath):
+def _foundation_readPlist(filepath, keys=None):
     """
     Read a .plist file from filepath.  Return the unpacked root object
-    (which is usually a dictionary).
+    (which is usually a dictionary). If keys is given, only those keys
+    of each record are kept (see expat_plist.read_string).
     """
     plistData = NSData.dataWithContentsOfFile_(filepath)
     dataObject, dummy_plistFormat, error = (
@@ -84,10 +100,10 @@ def readPlist(filepath):
         errmsg = "%s in file %s" % (error, filepath)
         raise NSPropertyListSerializationException(errmsg)
     else:
-        return dataObject
+        return _project(dataObject, keys)
 
 
-def readPlistFromString(data):
+def _foundation_readPlistFromString(data, keys=None):
     '''Read a plist data from a string. Return the root object.'''
     try:
         plistData = buffer(data)
@@ -104,10 +120,10 @@ def readPlistFromString(data):
             error = "Unknown error"
         raise NSPropertyListSerializationException(error)
     else:
-        return dataObject
+        return _project(dataObject, keys)
 
 
-def writePlist(dataObject, filepath):
+def _foundation_writePlist(dataObject, filepath):
     '''
     Write 'rootObject' as a plist to filepath.
     '''
@@ -129,7 +145,7 @@ def writePlist(dataObject, filepath):
                 "Failed to write plist data to %s" % filepath)
 
 
-def writePlistToString(rootObject):
+def _foundation_writePlistToString(rootObject):
     '''Return 'rootObject' as a plist-formatted string.'''
     plistData, error = (
         NSPropertyListSerialization.
@@ -145,3 +161,151 @@ def writePlistToString(rootObject):
         return str(plistData)
 
 
+def _foundation_iterPlist(filepath, keys=None):
+    """
+    Yield each item of the array plist at filepath. Foundation cannot
+    parse incrementally, so the whole plist is read first.
+    """
+    root = _foundation_readPlist(filepath, keys)
+    if hasattr(root, "keys") or not hasattr(root, "__iter__"):
+        raise NSPropertyListSerializationException(
+            "The plist root is not an array in file %s" % filepath)
+    for item in root:
+        yield item
+
+
+def is_array(value):
+    """Return whether value is a plist array, from either backend.
+
+    Foundation returns NSArrays, which are not Python lists.
+    """
+    return (isinstance(value, (list, tuple)) or
+            hasattr(value, "objectAtIndex_"))
+
+
+def _project(root, keys):
+    """Drop all but keys from the record(s) in a Foundation plist.
+
+    Foundation always builds the whole plist, so this only trims what
+    is retained afterwards.
+    """
+    if keys is None:
+        return root
+    if hasattr(root, "keys"):
+        return {key: root[key] for key in keys if key in root}
+    if is_array(root):
+        return [_project(item, keys) if hasattr(item, "keys") else item
+                for item in root]
+    return root
+
+
+def _expat_readPlist(filepath, keys=None):
+    """
+    Read a .plist file from filepath.  Return the unpacked root object
+    (which is usually a dictionary). If keys is given, values of other
+    keys are skipped while parsing rather than built.
+    """
+    try:
+        with open(filepath, "rb") as ifile:
+            data = ifile.read()
+    except (IOError, OSError) as err:
+        raise NSPropertyListSerializationException(
+            "%s in file %s" % (err.strerror, filepath))
+    try:
+        return expat_plist.read_string(data, keys)
+    except expat_plist.PlistError as err:
+        raise NSPropertyListSerializationException(
+            "%s in file %s" % (err, filepath))
+
+
+def _expat_iterPlist(filepath, keys=None):
+    """
+    Yield each item of the array plist at filepath, parsing the file
+    incrementally so that it is never held in memory as a whole.
+    """
+    try:
+        for item in expat_plist.iter_file(filepath, keys):
+            yield item
+    except (IOError, OSError) as err:
+        raise NSPropertyListSerializationException(
+            "%s in file %s" % (err.strerror, filepath))
+    except expat_plist.PlistError as err:
+        raise NSPropertyListSerializationException(
+            "%s in file %s" % (err, filepath))
+
+
+def _expat_readPlistFromString(data, keys=None):
+    '''Read a plist data from a string. Return the root object.'''
+    try:
+        return expat_plist.read_string(data, keys)
+    except (expat_plist.PlistError, AttributeError) as err:
+        raise NSPropertyListSerializationException(str(err))
+
+
+def _expat_writePlist(dataObject, filepath):
+    '''
+    Write 'rootObject' as a plist to filepath.
+    '''
+    plistData = _expat_writePlistToString(dataObject)
+    # Write atomically, as Foundation does, keeping the original mode.
+    try:
+        mode = os.stat(filepath).st_mode & 0o7777
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    temp_path = None
+    try:
+        handle, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(filepath)))
+        with os.fdopen(handle, "wb") as ofile:
+            ofile.write(plistData)
+        os.chmod(temp_path, mode)
+        os.rename(temp_path, filepath)
+    except (IOError, OSError):
+        if temp_path:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+        raise NSPropertyListWriteException(
+            "Failed to write plist data to %s" % filepath)
+
+
+def _expat_writePlistToString(rootObject):
+    '''Return 'rootObject' as a plist-formatted string.'''
+    try:
+        return expat_plist.write_string(rootObject)
+    except expat_plist.PlistError as err:
+        raise NSPropertyListSerializationException(str(err))
+
+
+BACKENDS = ("foundation", "expat")
+
+
+def set_backend(name):
+    """Bind the public read/write functions to backend 'name'."""
+    if name not in BACKENDS:
+        raise ValueError("Unknown plist backend '%s'" % name)
+    if name == "foundation" and NSPropertyListSerialization is None:
+        raise ValueError("The Foundation plist backend requires PyObjC")
+    global BACKEND, readPlist, readPlistFromString, iterPlist, writePlist
+    global writePlistToString
+    BACKEND = name
+    prefix = "_%s_" % name
+    namespace = globals()
+    readPlist = namespace[prefix + "readPlist"]
+    readPlistFromString = namespace[prefix + "readPlistFromString"]
+    iterPlist = namespace[prefix + "iterPlist"]
+    writePlist = namespace[prefix + "writePlist"]
+    writePlistToString = namespace[prefix + "writePlistToString"]
+
+
+def get_available_backends():
+    """Return the names of the backends usable on this machine."""
+    return tuple(name for name in BACKENDS if name != "foundation" or
+                 NSPropertyListSerialization is not None)
+
+
+set_backend(os.environ.get(
+    "SPRUCE_PLIST_BACKEND", get_available_backends()[0]))
@@ -1,15 +1,19 @@
 #!/usr/bin/python
 
 
-# TODO: just import this from munkilib
 import FoundationPlist
 
+from bulk_edit import run_set
+from cache import CacheMode
 from categories import run_categories, prepare_categories, update_categories
+from context import RepoContext
 from cruftmoji import SPRUCE
 from deprecate import deprecate
 from docs import handle_docs
 from icons import handle_icons
 from names import run_names
-from report import run_reports
+from repo import SizeMode
+from report import run_reports, REPORT_KEYS
+from report_writers import OUTPUT_FORMATS
 from robo_print import robo_print, LogLevel
 from tools import *
\ No newline at end of file
@@ -0,0 +1,346 @@
+#!/usr/bin/python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parallel, journaled moves and deletions of repo files.
+
+Operations run on a bounded thread pool. A move is a rename when the
+source and destination share a filesystem; otherwise the file (or
+bundle package) is streamed to a partial copy beside the destination,
+verified against the source's checksum, renamed into place, and only
+then is the source removed.
+
+Planned operations are written to a journal before any are run, and
+each is recorded there as it finishes. If a run is interrupted, or
+some operations fail, the operations the journal still lists as
+unfinished (e.g. the installers of items whose pkginfos were already
+archived) can be resumed by a later run that asks for them, without
+redoing those that completed. The journal is removed once every
+operation has succeeded.
+"""
+
+
+from collections import namedtuple
+import errno
+import hashlib
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import shutil
+
+import cache
+import tools
+
+
+MOVE = "move"
+REMOVE = "remove"
+# Moves wait on disks and file servers rather than the CPU, but too
+# many concurrent copies to one volume just thrash it.
+MOVE_WORKERS = 4
+COPY_BUFFER = 1024 * 1024
+# Suffix for a cross-filesystem copy that has not yet been verified.
+PARTIAL_SUFFIX = ".spruce-partial"
+
+Operation = namedtuple("Operation", ("action", "source", "destination"))
+
+
+class Journal(object):
+    """Append-only record of planned and finished operations.
+
+    The file holds one JSON object per line: {"plan": operation} for
+    each operation of a run, followed by {"done": operation} as each
+    one finishes. A torn final line (from a crash mid-write) is
+    ignored.
+
+    Attributes:
+        path: String path to the journal file.
+        planned: List of Operations planned by the journaled run.
+        finished: Set of Operations that run completed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.planned = []
+        self.finished = set()
+        self._file = None
+
+    def load(self):
+        """Read a previous run's journal, if there is one."""
+        try:
+            with open(self.path) as ifile:
+                lines = ifile.readlines()
+        except (IOError, OSError):
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "plan" in record:
+                self.planned.append(to_operation(record["plan"]))
+            elif "done" in record:
+                self.finished.add(to_operation(record["done"]))
+
+    def get_unfinished(self):
+        """Return the planned operations that did not finish."""
+        return [operation for operation in self.planned
+                if operation not in self.finished]
+
+    def start(self, operations):
+        """Replace the journal with a plan of operations."""
+        journal_dir = os.path.dirname(self.path)
+        if not os.path.isdir(journal_dir):
+            os.makedirs(journal_dir)
+        self.planned = list(operations)
+        self.finished = set()
+        self._file = open(self.path, "w")
+        for operation in operations:
+            self._write({"plan": operation})
+        self._sync()
+
+    def record(self, operation):
+        """Durably record that an operation finished."""
+        self.finished.add(operation)
+        self._write({"done": operation})
+        self._sync()
+
+    def close(self):
+        """Close the journal, removing it if the plan was completed."""
+        if self._file:
+            self._file.close()
+            self._file = None
+        if not self.get_unfinished() and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+def run_operations(operations, journal_path, workers=None):
+    """Run moves and removals in parallel, journaling them.
+
+    Unfinished operations of an earlier run that can still succeed,
+    and are not run now, are kept in the journal for a later run to
+    resume (see get_resumable); they are not run.
+
+    Args:
+        operations: List of Operations.
+        journal_path: String path to the journal for this repo.
+        workers: Int number of threads. Defaults to the global
+            ParseMode setting, or MOVE_WORKERS.
+
+    Returns:
+        List of the Operations that failed. They remain in the journal,
+        so a later run can resume them.
+    """
+    # Each path is handled once, as workers would otherwise race; the
+    # last operation for a path wins.
+    pending = []
+    sources = set()
+    for operation in reversed(operations):
+        if operation.source not in sources:
+            sources.add(operation.source)
+            pending.append(operation)
+    pending.reverse()
+    if not pending:
+        return []
+
+    kept = [operation for operation in get_resumable(journal_path)
+            if operation.source not in sources]
+    journal = Journal(journal_path)
+    journal.start(pending + kept)
+    failures = []
+    workers = workers or tools.ParseMode.workers or MOVE_WORKERS
+    pool = ThreadPool(min(workers, len(pending)))
+    try:
+        results = pool.imap_unordered(perform, pending)
+        for _ in pending:
+            operation, message, succeeded = results.next(tools.POOL_TIMEOUT)
+            print message
+            if succeeded:
+                journal.record(operation)
+            else:
+                failures.append(operation)
+        pool.close()
+    except BaseException:
+        # Including KeyboardInterrupt; the journal is left for a rerun.
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        journal.close()
+
+    return failures
+
+
+def get_resumable(journal_path):
+    """Return the unfinished operations of an earlier run.
+
+    Operations whose source is gone are dropped: they either finished
+    without being recorded (e.g. a removal, or a move whose
+    destination exists) or can never succeed.
+    """
+    journal = Journal(journal_path)
+    journal.load()
+    return [operation for operation in journal.get_unfinished()
+            if os.path.lexists(operation.source)]
+
+
+def describe(operation):
+    """Return a line describing an operation, for confirmation."""
+    if operation.action == MOVE:
+        return "Archive '{}' to '{}'".format(operation.source,
+                                             operation.destination)
+    return "Remove '{}'".format(operation.source)
+
+
+def perform(operation):
+    """Run one operation.
+
+    Returns:
+        Tuple of (operation, message to print, bool success).
+    """
+    action, source, destination = operation
+    if action == MOVE:
+        if not os.path.lexists(source) and os.path.lexists(destination):
+            return (operation, "Already archived '{}' to '{}'.".format(
+                source, destination), True)
+        try:
+            make_folders(os.path.dirname(destination))
+            move_path(source, destination)
+        except (IOError, OSError) as error:
+            return (operation, "Failed to remove item '{}' with error "
+                    "'{}'.".format(source, error.strerror), False)
+        return (operation, "Archived '{}' to '{}'.".format(
+            source, destination), True)
+
+    if not os.path.lexists(source):
+        return (operation, "Skipping '{}' as it does not seem to "
+                "exist.".format(source), True)
+    try:
+        remove_path(source)
+    except (IOError, OSError) as error:
+        return (operation, "Unable to remove {} with error: {}".format(
+            source, error.strerror), False)
+    return (operation, "Removed '{}'.".format(source), True)
+
+
+def move_path(source, destination):
+    """Move a file or directory, copying across filesystems."""
+    try:
+        os.rename(source, destination)
+        return
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+    copy_verified(source, destination)
+    remove_path(source)
+
+
+def copy_verified(source, destination):
+    """Copy a file or directory, replacing destination once verified."""
+    partial = destination + PARTIAL_SUFFIX
+    if os.path.lexists(partial):
+        remove_path(partial)
+    if os.path.isdir(source) and not os.path.islink(source):
+        copy_tree_verified(source, partial)
+    else:
+        copy_file_verified(source, partial)
+    if os.path.isdir(destination) and not os.path.islink(destination):
+        shutil.rmtree(destination)
+    os.rename(partial, destination)
+
+
+def copy_tree_verified(source, destination):
+    """Copy a directory tree, verifying each file."""
+    os.mkdir(destination)
+    for dirpath, dirnames, filenames in os.walk(source):
+        target = os.path.join(destination, os.path.relpath(dirpath, source))
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            copy = os.path.join(target, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), copy)
+            elif os.path.isdir(path):
+                os.mkdir(copy)
+            else:
+                copy_file_verified(path, copy)
+        shutil.copystat(dirpath, target)
+
+
+def copy_file_verified(source, destination):
+    """Stream a file to destination, then check it against the source.
+
+    Raises:
+        IOError if the copy's checksum does not match the source's.
+    """
+    digest = hashlib.sha1()
+    with open(source, "rb") as ifile, open(destination, "wb") as ofile:
+        for chunk in iter(lambda: ifile.read(COPY_BUFFER), ""):
+            digest.update(chunk)
+            ofile.write(chunk)
+        ofile.flush()
+        os.fsync(ofile.fileno())
+    shutil.copystat(source, destination)
+    if get_digest(destination) != digest.hexdigest():
+        raise IOError(errno.EIO, "Copy failed verification", destination)
+
+
+def get_digest(path):
+    """Return the SHA-1 hex digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as ifile:
+        for chunk in iter(lambda: ifile.read(COPY_BUFFER), ""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def remove_path(path):
+    """Remove a file, symlink, or directory tree."""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def make_folders(folder):
+    """Make all folders in path that are missing.
+
+    Other workers may be creating the same folders, so one appearing
+    after the check is not an error.
+    """
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+
+
+def to_operation(value):
+    """Return an Operation from its JSON form, with UTF-8 str paths."""
+    return Operation(*(item.encode("utf-8") if isinstance(item, unicode)
+                       else item for item in value))
+
+
+def get_journal_path(repo):
+    """Return the journal file path for the repo at path 'repo'."""
+    digest = hashlib.md5(os.path.abspath(repo)).hexdigest()
+    return os.path.join(cache.CACHE_DIR, "journal-{}.json".format(digest))
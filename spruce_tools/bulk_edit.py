@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Set, unset, or append to keys of the pkginfos matching filters.
+
+Pkginfos are selected, and the changes they need are worked out, from
+the (cached) pkginfo scan. Only the pkginfos that need changes are
+then reread, rechecked, and atomically rewritten, concurrently.
+"""
+
+
+import functools
+import re
+import sys
+
+from categories import NO_CATEGORY
+import FoundationPlist
+import tools
+
+
+SET = "set"
+UNSET = "unset"
+APPEND = "append"
+INTEGER = re.compile(r"^-?\d+$")
+
+
+def run_set(args, context=None):
+    """Apply the edits in args to the pkginfos its filters select."""
+    context = context or tools.RepoContext.from_prefs()
+    filters = get_filters(args)
+    if not filters and not args.all:
+        sys.exit("Please select pkginfos with at least one filter, or --all.")
+    edits = get_edits(args)
+    if not edits:
+        sys.exit("Nothing to do! Please provide --set, --unset, or --append.")
+
+    cache = tools.build_pkginfo_cache(context.repo_path)
+    selected = [path for path, pkginfo in cache.items()
+                if matches(pkginfo, filters)]
+    paths = sorted(path for path in selected
+                   if apply_edits(dict(cache[path]), edits))
+
+    if args.dry_run:
+        for path in paths:
+            for change in apply_edits(dict(cache[path]), edits):
+                print "Pkginfo {}: {}.".format(path, change)
+        print "{} of {} selected pkginfo(s) would be changed.".format(
+            len(paths), len(selected))
+        return
+
+    edit = functools.partial(edit_pkginfo, filters=filters, edits=edits)
+    if tools.rewrite_pkginfos(paths, edit, len(selected)):
+        print "Please run 'makecatalogs' to rebuild catalogs."
+
+
+def get_filters(args):
+    """Return a list of predicates a pkginfo must satisfy to be edited."""
+    filters = []
+    if args.name:
+        names = {decode(name) for name in args.name}
+        filters.append(lambda pkginfo: pkginfo.get("name") in names)
+    if args.category:
+        categories = {decode(category) for category in args.category}
+        filters.append(lambda pkginfo: (
+            pkginfo.get("category") or NO_CATEGORY) in categories)
+    if args.catalog:
+        catalogs = {decode(catalog) for catalog in args.catalog}
+        filters.append(lambda pkginfo: any(
+            catalog in catalogs for catalog in pkginfo.get("catalogs", [])))
+    if args.testing is not None:
+        filters.append(tools.in_testing if args.testing else
+                       tools.in_production)
+    if args.unattended is not None:
+        filters.append(tools.is_unattended_install if args.unattended else
+                       tools.is_not_unattended_install)
+    return filters
+
+
+def get_edits(args):
+    """Return a list of (action, key, value) tuples.
+
+    Sets are applied first, then unsets, then appends. Values are
+    parsed with parse_value; unset has a value of None.
+    """
+    edits = [(SET, key, parse_value(value)) for key, value in args.set or ()]
+    edits.extend((UNSET, key, None) for key in args.unset or ())
+    edits.extend((APPEND, key, parse_value(value))
+                 for key, value in args.append or ())
+    return [(action, decode(key), value) for action, key, value in edits]
+
+
+def parse_value(value):
+    """Return a command line value as a bool, int, or string.
+
+    "true" and "false" (in any case) are booleans, and whole numbers are
+    integers; anything else, including version numbers like "10.12",
+    is a string.
+    """
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    if INTEGER.match(value):
+        return int(value)
+    return decode(value)
+
+
+def decode(value):
+    """Return a command line argument as unicode, to match pkginfos."""
+    return value.decode("utf-8") if isinstance(value, str) else value
+
+
+def matches(pkginfo, filters):
+    """Return whether pkginfo satisfies every filter."""
+    return all(test(pkginfo) for test in filters)
+
+
+def apply_edits(pkginfo, edits):
+    """Apply edits to pkginfo.
+
+    Keys are set, unset, or replaced with a longer array, so a shallow
+    copy of a pkginfo can be edited without changing the original.
+    Appending to a key that is not an array is skipped.
+
+    Returns:
+        List of strings describing each change made. Edits that would
+        not change the pkginfo (e.g. setting a key to its current
+        value) are skipped.
+    """
+    changes = []
+    for action, key, value in edits:
+        present = key in pkginfo
+        current = pkginfo.get(key)
+        if action == SET:
+            if present and is_same(current, value):
+                continue
+            pkginfo[key] = value
+            changes.append("set {} to {} (was {})".format(
+                key, format_value(value),
+                format_value(current) if present else "unset"))
+        elif action == UNSET:
+            if not present:
+                continue
+            del pkginfo[key]
+            changes.append("unset {} (was {})".format(
+                key, format_value(current)))
+        elif action == APPEND:
+            if current is None:
+                current = []
+            elif not FoundationPlist.is_array(current):
+                continue
+            if any(is_same(item, value) for item in current):
+                continue
+            pkginfo[key] = list(current) + [value]
+            changes.append("appended {} to {}".format(
+                format_value(value), key))
+    return changes
+
+
+def is_same(current, value):
+    """Return whether two plist values are equal, and both bools or not.
+
+    (True == 1 in Python, but not in a plist.)
+    """
+    return (current == value and
+            isinstance(current, bool) == isinstance(value, bool))
+
+
+def format_value(value):
+    """Return a plist value for display."""
+    if isinstance(value, basestring):
+        return "'{}'".format(value.encode("utf-8") if
+                             isinstance(value, unicode) else value)
+    return str(value)
+
+
+def edit_pkginfo(path, pkginfo, filters, edits):
+    """Edit one pkginfo; an edit for tools.rewrite_pkginfos.
+
+    The freshly read pkginfo is checked against the filters again, so
+    a file changed since the scan is not edited by mistake.
+    """
+    if not matches(pkginfo, filters):
+        return (False, [])
+    changes = apply_edits(pkginfo, edits)
+    return (bool(changes), ["Pkginfo {}: {}.".format(path, change)
+                            for change in changes])
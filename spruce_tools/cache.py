@@ -0,0 +1,211 @@
+#!/usr/bin/python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent on-disk caches of parsed pkginfos, manifests, and icons.
+
+Each entry records the size, mtime, and inode of a file (or folder) at
+the time it was read, along with either what was read from it or the
+error. Entries are only trusted while all three still match the file
+on disk, so edits, additions, and removals are picked up on the next
+scan without rereading the rest of the repo.
+
+Pkginfos parsed with only a subset of their keys are kept in a separate
+cache file per key set, so a projected read never returns a pkginfo
+missing keys the caller asked for, and never evicts full entries.
+"""
+
+
+import cPickle
+import datetime
+import hashlib
+import os
+import tempfile
+
+from robo_print import robo_print, LogLevel
+
+
+CACHE_VERSION = 2
+CACHE_DIR = os.path.expanduser("~/Library/Caches/com.sheagcraig.spruce")
+
+
+class CacheMode(object):
+    """Manage global cache state with a singleton."""
+    enabled = True  # Use --no-cache command-line argument to bypass.
+    rebuild = False  # Use --rebuild-cache to discard and rebuild.
+
+    @classmethod
+    def set_enabled(cls, value):
+        """Set the class variable for enabled."""
+        if isinstance(value, bool):
+            cls.enabled = value
+        else:
+            raise ValueError
+
+    @classmethod
+    def set_rebuild(cls, value):
+        """Set the class variable for rebuild."""
+        if isinstance(value, bool):
+            cls.rebuild = value
+        else:
+            raise ValueError
+
+
+class StatCache(object):
+    """Stat-validated store of values read from the files under a folder.
+
+    Subclasses name what they cache with 'kind', which keeps each kind
+    in its own cache file; see get_cache_path.
+
+    Attributes:
+        root: String path to the folder whose files are cached.
+        path: String path to the cache file.
+        fields: Sorted tuple of the plist keys kept in each entry,
+            or None for complete values.
+        entries: Dictionary with:
+            key: path to file.
+            val: Tuple of (size, mtime, inode, value, error).
+    """
+    kind = None
+
+    def __init__(self, root, path=None, fields=None):
+        self.root = root
+        self.fields = tuple(sorted(fields)) if fields is not None else None
+        self.path = path or get_cache_path(root, self.fields, self.kind)
+        self.entries = {}
+        self._dirty = False
+
+    def load(self):
+        """Read cache entries from disk, ignoring unusable files."""
+        try:
+            with open(self.path, "rb") as ifile:
+                data = cPickle.load(ifile)
+        except (IOError, OSError, EOFError, cPickle.UnpicklingError,
+                AttributeError, ValueError):
+            return
+
+        if (isinstance(data, dict) and
+                data.get("version") == CACHE_VERSION and
+                data.get("root") == self.root and
+                data.get("fields") == self.fields):
+            self.entries = data["entries"]
+
+    def save(self):
+        """Atomically write cache entries to disk if anything changed."""
+        if not self._dirty:
+            return
+        data = {"version": CACHE_VERSION, "root": self.root,
+                "fields": self.fields, "entries": self.entries}
+        cache_dir = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            handle, temp_path = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(handle, "wb") as ofile:
+                cPickle.dump(data, ofile, cPickle.HIGHEST_PROTOCOL)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError, cPickle.PicklingError) as error:
+            robo_print("Unable to save {} cache to '{}': {}".format(
+                self.kind, self.path, error), LogLevel.WARNING)
+            return
+        self._dirty = False
+
+    def get(self, path, stat):
+        """Return (value, error) for path, or None if stale/missing."""
+        entry = self.entries.get(path)
+        if entry and entry[:3] == get_signature(stat):
+            return entry[3:]
+        return None
+
+    def set(self, path, stat, value, error):
+        """Record a freshly read value (or its error)."""
+        self.entries[path] = get_signature(stat) + (value, error)
+        self._dirty = True
+
+    def prune(self, seen):
+        """Drop entries for files that have disappeared."""
+        for path in set(self.entries) - seen:
+            del self.entries[path]
+            self._dirty = True
+
+
+class PkginfoCache(StatCache):
+    """Parsed pkginfos (or the keys in fields) for one repo."""
+    kind = "pkginfo"
+
+
+class ManifestCache(StatCache):
+    """Manifest summaries (see manifest_index.summarize) for one repo."""
+    kind = "manifest"
+
+
+class IconListingCache(StatCache):
+    """Directory listings (see icons.list_folder) of an icons folder."""
+    kind = "icons"
+
+
+def get_cache_path(root, fields=None, kind="pkginfo"):
+    """Return the cache file path for the folder at path 'root'.
+
+    Args:
+        root: String path to the folder whose files are cached, e.g.
+            the base of a Munki repo.
+        fields: Optional sorted tuple of the plist keys cached.
+        kind: String naming what is cached, e.g. "pkginfo",
+            "manifest", or "icons".
+    """
+    key = os.path.abspath(root)
+    if fields is not None:
+        key += "\0" + "\0".join(fields)
+    digest = hashlib.md5(key).hexdigest()
+    return os.path.join(CACHE_DIR, "{}-{}.cache".format(kind, digest))
+
+
+def get_signature(stat):
+    """Return the (size, mtime, inode) tuple used to validate entries."""
+    return (stat.st_size, stat.st_mtime, stat.st_ino)
+
+
+def to_native(obj):
+    """Convert a parsed plist object into picklable Python types.
+
+    FoundationPlist returns PyObjC containers which cannot be pickled,
+    so they are rebuilt as dicts, lists, and plain scalars.
+    """
+    if isinstance(obj, bool):
+        return obj
+    elif isinstance(obj, unicode):
+        return unicode(obj)
+    elif isinstance(obj, str):
+        return str(obj)
+    elif isinstance(obj, (int, long)):
+        return int(obj)
+    elif isinstance(obj, float):
+        return float(obj)
+    elif isinstance(obj, datetime.datetime):
+        return obj
+    elif hasattr(obj, "keys"):
+        return {to_native(key): to_native(obj[key]) for key in obj.keys()}
+    elif hasattr(obj, "timeIntervalSince1970"):
+        # NSDate
+        return datetime.datetime.utcfromtimestamp(
+            obj.timeIntervalSince1970())
+    elif hasattr(obj, "bytes") and hasattr(obj, "length"):
+        # NSData
+        return buffer(obj.bytes(), 0, obj.length())[:]
+    elif hasattr(obj, "__iter__"):
+        return [to_native(item) for item in obj]
+    return obj
@@ -22,30 +22,36 @@ on a Munki repository.
 
 import argparse
 from collections import Counter, defaultdict
+import functools
 import os
 from xml.sax.saxutils import escape
 
 from spruce_tools import FoundationPlist
+from spruce_tools.robo_print import robo_print, LogLevel
 import spruce_tools as tools
 
 
 NO_CATEGORY = "*NO CATEGORY*"
 
 
-def run_categories(args):
+def run_categories(args, context=None):
     """Output all present categories and counts of their use."""
-    all_catalog = tools.get_all_catalog()
+    context = context or tools.RepoContext.from_prefs()
     if args.prepare:
-        prepare_categories(args)
-    elif not args.category:
+        prepare_categories(args, context)
+        return
+
+    all_catalog = tools.iter_all_catalog(
+        context.repo_path, keys=("name", "category"))
+    if not args.category:
         get_categories_and_counts(all_catalog)
     else:
-        get_categories_and_files(all_catalog, args.category)
+        get_categories_and_files(all_catalog, args.category, context)
 
 
 def get_categories_and_counts(all_catalog):
-    all_categories = tools.get_categories(all_catalog)
-    categories = Counter(all_categories)
+    categories = Counter(
+        pkginfo.get("category", NO_CATEGORY) for pkginfo in all_catalog)
     if "" in categories:
         if NO_CATEGORY not in categories:
             categories[NO_CATEGORY] = 0
@@ -55,8 +61,9 @@ def get_categories_and_counts(all_catalog):
         print "{}: {}".format(category.encode("utf-8"), categories[category])
 
 
-def get_categories_and_files(all_catalog, categories):
-    cache = tools.build_pkginfo_cache(tools.get_repo_path())
+def get_categories_and_files(all_catalog, categories, context=None):
+    context = context or tools.RepoContext.from_prefs()
+    cache = tools.build_pkginfo_cache(context.repo_path)
     output = defaultdict(list)
     if "*NO CATEGORY*" in categories:
         categories.append("")
@@ -74,12 +81,16 @@ def get_categories_and_files(all_catalog, categories):
             print "\t{}, {}".format(*entry)
 
 
-def prepare_categories(_):
-    """Build a plist of categories and their products."""
-    # TODO: There should be a warning or bold the name or something when a
-    # product is in multiple categories.
-    all_catalog = tools.get_all_catalog()
-    names = tools.get_unique_names(all_catalog)
+def prepare_categories(_, context=None):
+    """Build a plist of categories and their products.
+
+    Products whose pkginfos are split across categories are listed
+    under their most frequent category, and a warning is printed (to
+    stderr, so as not to mix with the plist) naming the others.
+    """
+    context = context or tools.RepoContext.from_prefs()
+    categories_by_name = get_categories_by_name(tools.iter_all_catalog(
+        context.repo_path, keys=("name", "category")))
     names_by_category = defaultdict(list)
 
     output = {}
@@ -89,56 +100,134 @@ def prepare_categories(_):
         help_text = escape(ifile.read())
     output["Comment"] = help_text
 
-    for name in names:
-        name_filter = lambda n: n["name"] == name  # pylint: disable=cell-var-from-loop
-        categories = tools.get_categories(all_catalog, name_filter)
-        most_frequent_category = Counter(categories).most_common(1)[0][0]
+    for name, categories in categories_by_name.items():
+        most_frequent_category = categories.most_common(1)[0][0]
         if most_frequent_category == "":
             most_frequent_category = NO_CATEGORY
         names_by_category[most_frequent_category].append(name)
+        merged = merge_empty(categories)
+        if len(merged) > 1:
+            robo_print("Product '{}' is split across categories ({}); it is "
+                       "listed under '{}'.".format(
+                           name.encode("utf-8"), format_counts(merged),
+                           most_frequent_category.encode("utf-8")),
+                       LogLevel.WARNING)
 
     output.update(names_by_category)
     print FoundationPlist.writePlistToString(output)
 
 
-def update_categories(args):
-    """Update product pkginfo files to reflect specified categories."""
+def get_categories_by_name(all_catalog):
+    """Count each product's categories in one pass over the catalog.
+
+    Returns:
+        Dictionary of product name to a Counter of its categories.
+    """
+    categories_by_name = defaultdict(Counter)
+    for pkginfo in all_catalog:
+        name = pkginfo.get("name", "*NO NAME*")
+        categories_by_name[name][pkginfo.get("category", NO_CATEGORY)] += 1
+    return categories_by_name
+
+
+def merge_empty(categories):
+    """Return a Counter of categories with empty counted as missing."""
+    merged = Counter()
+    for category, count in categories.items():
+        merged[category or NO_CATEGORY] += count
+    return merged
+
+
+def format_counts(categories):
+    """Return a Counter of categories as "category: count" pairs."""
+    return ", ".join("{}: {}".format(category.encode("utf-8"), count)
+                     for category, count in sorted(categories.items()))
+
+
+def update_categories(args, context=None):
+    """Update product pkginfo files to reflect specified categories.
+
+    Pkginfos needing a change are found from the pkginfo cache, and
+    are then reread, edited, and atomically rewritten concurrently.
+    With args.dry_run, the changes are printed but not made.
+    """
+    context = context or tools.RepoContext.from_prefs()
     changes = FoundationPlist.readPlist(os.path.expanduser(args.plist))
 
     # Remove the comment that we insert into the output of prepare.
     if "Comment" in changes:
         del changes["Comment"]
 
-    products = {product for change_group in changes.values() for product in
-                change_group}
+    categories = get_categories_for_names(changes)
+    cache = tools.build_pkginfo_cache(
+        context.repo_path, keys=("name", "category"))
 
-    cache = tools.build_pkginfo_cache(tools.get_repo_path())
-
-    changed = False
     # Update only those pkginfos which need changes applied.
-    for path, plist in cache.items():
-        name = plist.get("name")
-        if name in products:
-            new_category = get_category_for_name(name, changes)
-            if new_category == NO_CATEGORY:
-                new_category = ""
-            category = plist.get("category")
-
-            if new_category != category:
-                plist["category"] = new_category
-                FoundationPlist.writePlist(plist, path)
-                changed = True
-                print "Pkginfo {} category set to {}.".format(
-                     path, new_category if new_category else "''")
-
+    paths = sorted(path for path, plist in cache.items()
+                   if needs_category(plist, categories))
+    if getattr(args, "dry_run", False):
+        for path in paths:
+            plist = cache[path]
+            print "Pkginfo {} category: {} -> {}.".format(
+                path, format_category(plist.get("category")),
+                format_category(get_new_category(plist["name"], categories)))
+        print "{} pkginfo(s) would be changed.".format(len(paths))
+        return
+
+    changed = tools.rewrite_pkginfos(
+        paths, functools.partial(set_category, categories=categories),
+        len(cache))
     if changed:
         print "Please run 'makecatalogs' to rebuild catalogs."
 
 
-def get_category_for_name(name, changes):
-    """Get the desired category for product 'name'."""
-    for category in changes:
-        if name in changes[category]:
-            return category
-
-
+def get_categories_for_names(changes):
+    """Return a dictionary of product name to its desired category.
+
+    A product listed under more than one category is assigned to the
+    first of them, in sorted order, with a warning.
+    """
+    categories = {}
+    for category in sorted(changes):
+        for name in changes[category]:
+            if name in categories:
+                robo_print("Product '{}' is listed under both '{}' and '{}'; "
+                           "using '{}'.".format(
+                               name.encode("utf-8"),
+                               categories[name].encode("utf-8"),
+                               category.encode("utf-8"),
+                               categories[name].encode("utf-8")),
+                           LogLevel.WARNING)
+            else:
+                categories[name] = category
+    return categories
+
+
+def get_new_category(name, categories):
+    """Return the category to set for product 'name', or None."""
+    category = categories.get(name)
+    return "" if category == NO_CATEGORY else category
+
+
+def needs_category(plist, categories):
+    """Return whether a pkginfo's category needs to change."""
+    name = plist.get("name")
+    return (name in categories and
+            get_new_category(name, categories) != plist.get("category"))
+
+
+def set_category(path, plist, categories):
+    """Set a pkginfo's category; an edit for tools.rewrite_plists."""
+    if not needs_category(plist, categories):
+        return (False, [])
+    new_category = get_new_category(plist["name"], categories)
+    plist["category"] = new_category
+    return (True, ["Pkginfo {} category set to {}.".format(
+        path, new_category if new_category else "''")])
+
+
+def format_category(category):
+    """Return a category for display, quoting empty ones."""
+    if category is None:
+        return "(none)"
+    return category.encode("utf-8") if category else "''"
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Resolved preferences and paths for a Munki repo."""
+
+
+import os
+
+import tools
+
+
+# Range of OS versions, inclusive, for which used items are computed.
+# Override with the 'supported_os_range' preference (an array of the
+# minimum and maximum version strings) or a command's --os-range option.
+SUPPORTED_OS_RANGE = ("10.8.0", "10.12.9")
+
+
+class RepoContext(object):
+    """Preferences and paths for one Munki repo, resolved once.
+
+    Commands receive a RepoContext rather than calling
+    tools.get_repo_path() and friends, each of which rereads the
+    preferences from disk.
+
+    Attributes:
+        prefs: Dictionary of Spruce preferences.
+        repo_path: String path to the base of the Munki repo.
+        pkgs_path: String path to the repo's pkgs directory.
+        pkgsinfo_path: String path to the repo's pkgsinfo directory.
+        manifests_path: String path to the repo's manifests directory.
+        catalogs_path: String path to the repo's catalogs directory.
+        all_catalog_path: String path to the repo's 'all' catalog.
+        icons_path: String path to the repo's icons.
+        os_range: Tuple of (minimum, maximum) supported OS version
+            strings.
+    """
+
+    def __init__(self, repo_path, prefs=None, munkiimport_prefs=None):
+        """Build a context for the repo at repo_path.
+
+        Args:
+            repo_path: String path to the base of a Munki repo.
+            prefs: Optional dictionary of Spruce preferences.
+            munkiimport_prefs: Optional dictionary of munkiimport
+                preferences. If omitted, they are read the first time
+                icons_path is needed.
+        """
+        self.prefs = prefs if prefs is not None else {}
+        self.repo_path = os.path.expanduser(repo_path)
+        self.pkgs_path = os.path.join(self.repo_path, "pkgs")
+        self.pkgsinfo_path = os.path.join(self.repo_path, "pkgsinfo")
+        self.manifests_path = os.path.join(self.repo_path, "manifests")
+        self.catalogs_path = os.path.join(self.repo_path, "catalogs")
+        self.all_catalog_path = os.path.join(self.catalogs_path, "all")
+        self.os_range = tuple(
+            self.prefs.get("supported_os_range", SUPPORTED_OS_RANGE))
+        self._munkiimport_prefs = munkiimport_prefs
+        self._icons_path = None
+
+    @classmethod
+    def from_prefs(cls):
+        """Return a context built from the user's Spruce preferences."""
+        prefs = tools.get_prefs()
+        return cls(prefs.get("repo_path"), prefs)
+
+    @property
+    def icons_path(self):
+        if self._icons_path is None:
+            if self._munkiimport_prefs is None:
+                self._munkiimport_prefs = tools.get_munkiimport_prefs()
+            # TODO: This is brittle. Fix it.
+            default = os.path.join(
+                self._munkiimport_prefs.get("repo_path", self.repo_path),
+                "icons")
+            self._icons_path = self._munkiimport_prefs.get("IconURL", default)
+        return self._icons_path
+
+    def __repr__(self):
+        return "RepoContext({!r})".format(self.repo_path)
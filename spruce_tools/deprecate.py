@@ -19,19 +19,30 @@
 to a deprecated repository."""
 
 
+from functools import partial
 import glob
 import os
-import shutil
 from subprocess import call, Popen, CalledProcessError, PIPE
 import sys
 
+from spruce_tools import archiver
 from spruce_tools import FoundationPlist
-from spruce_tools.repo import Repo, ApplicationVersion
-from spruce_tools import report
+from spruce_tools.context import RepoContext
+from spruce_tools.manifest_index import ManifestIndex
+from spruce_tools.repo import Repo, ApplicationVersion, human_readable_size
+from spruce_tools.robo_print import robo_print, LogLevel
 from spruce_tools import tools
 
 
 NO_CATEGORY = "*NO CATEGORY*"
+# Per-argument argv cost beyond its length: a NUL and a pointer.
+ARG_OVERHEAD = 9
+# Bytes of paths passed to each git rm. Half of ARG_MAX leaves room for
+# the environment and git's own arguments.
+try:
+    GIT_ARGS_LIMIT = os.sysconf("SC_ARG_MAX") // 2
+except (AttributeError, ValueError, OSError):
+    GIT_ARGS_LIMIT = 128 * 1024
 
 
 def main():
@@ -39,24 +50,34 @@ def main():
     pass
 
 
-def deprecate(args):
+def deprecate(args, context=None):
     """Handle arguments and execute commands."""
     if args.git and call(["which", "git"]) == 1:
         sys.exit("ERROR: git not found in path.")
 
-    cache = tools.build_pkginfo_cache(tools.get_repo_path())
-    repo = Repo(cache)
+    context = context or RepoContext.from_prefs()
+    if args.os_range:
+        context.os_range = tuple(args.os_range)
+    cache = tools.build_pkginfo_cache(context.repo_path)
+    repo = Repo(cache, context)
+
+    if args.preview:
+        print_retention_preview(repo, args.preview)
+        return
 
     removals = get_files_to_remove(args, repo)
-    if not removals:
+    resumed = get_resumed_operations(args, context)
+    if not removals and not resumed:
         sys.exit("Nothing to do! Exiting.")
 
     names = get_names_to_remove(removals, cache)
 
     removal_type = "archived" if args.archive else "removed"
-    print_removals(removals, removal_type)
-    print_manifest_removals(names)
-    warn_about_multiple_refs(removals, repo)
+    if removals:
+        print_removals(removals, removal_type)
+        print_manifest_removals(names)
+        warn_about_multiple_refs(removals, repo)
+    print_resumed_operations(resumed)
 
     if not args.force:
         response = raw_input("Are you sure you want to continue? (Y|N): ")
@@ -64,14 +85,19 @@ def deprecate(args):
             sys.exit()
 
     if args.archive:
-        move_to_archive(removals, args.archive)
+        failed = move_to_archive(removals, args.archive, context, resumed)
     else:
-        remove(removals)
+        failed = remove(removals, context, resumed)
 
     if args.git:
-        git_rm(removals)
+        git_rm(removals, context, resumed)
 
-    remove_names_from_manifests(names)
+    # Products whose pkginfos are still in the repo stay in manifests.
+    for name in get_names_not_removed(removals, failed, cache) & names:
+        print ("Leaving '{}' in manifests, as not all of its pkginfos were "
+               "removed.".format(name))
+        names.discard(name)
+    remove_names_from_manifests(names, context)
 
 
 def get_files_to_remove(args, repo):
@@ -94,23 +120,53 @@ def get_files_to_remove(args, repo):
 
 
 def get_removals_from_auto(level, repo):
-    munki_repo = tools.get_repo_path()
+    """Get used production items beyond the newest 'level' versions."""
+    ranks = get_production_ranks(repo)
+    return {item for item, rank in ranks.items() if rank > level}
 
-    manifest_items = report.get_manifest_items(
-        tools.get_manifests())
-    used_items = repo.get_used_items(
-        manifest_items, sys.maxint, ("production",))
-    current_items = repo.get_used_items(manifest_items, level, ("production",))
 
-    removals = used_items - current_items
+def get_production_ranks(repo):
+    """Return the retention ranks of items used in production."""
+    index = ManifestIndex(repo.context.repo_path).build()
+    return repo.get_retention_ranks(index.get_all_items(), ("production",))
 
-    return removals
+
+def get_retention_table(ranks, max_level):
+    """Summarize what --auto would remove at each level.
+
+    Args:
+        ranks: Dict of ApplicationVersion to retention rank, as
+            returned by Repo.get_retention_ranks.
+        max_level: Int highest number of versions to keep.
+
+    Returns:
+        List of (level, number of items, bytes) tuples for each level
+        from 1 to max_level. Installers shared by several items are
+        only counted once.
+    """
+    table = []
+    for level in xrange(1, max_level + 1):
+        removals = [item for item, rank in ranks.items() if rank > level]
+        sizes = {item.pkg_path: item.size for item in removals if
+                 item.pkg_path}
+        table.append((level, len(removals), sum(sizes.values())))
+    return table
+
+
+def print_retention_preview(repo, max_level):
+    """Print what --auto would remove for levels 1 to max_level."""
+    table = get_retention_table(get_production_ranks(repo), max_level)
+    print "Items --auto would remove, by number of versions kept:"
+    print "{:>6} {:>8} {:>12}".format("Keep", "Items", "Disk")
+    for level, count, size in table:
+        print "{:>6} {:>8} {:>12}".format(
+            level, count, human_readable_size(size))
 
 
 def get_removals_for_categories(categories, repo):
     """Get all pkginfo and pkg files to remove by category."""
     return {item for app in repo for item in repo[app] if
-            item.pkginfo.get("category") in categories}
+            item.category in categories}
 
 
 def get_removals_for_names(names, repo):
@@ -127,7 +183,7 @@ def get_removals_from_plist(path, repo):
 
     plist_removals = data.get("removals", [])
 
-    pkgsinfo_prefix = tools.get_pkgsinfo_path()
+    pkgsinfo_prefix = repo.context.pkgsinfo_path
 
     removals = set()
     for removal in plist_removals:
@@ -174,6 +230,25 @@ def get_names_to_remove(removals, cache):
     return names_to_remove
 
 
+def get_names_not_removed(removals, failed, cache):
+    """Return the names of removals whose pkginfo could not be removed.
+
+    Args:
+        removals: Set of ApplicationVersions and string paths.
+        failed: Set of string paths that could not be removed.
+        cache: Dictionary of pkginfo path to pkginfo.
+    """
+    names = set()
+    for removal in removals:
+        if isinstance(removal, ApplicationVersion):
+            path, name = removal.pkginfo_path, removal.name
+        else:
+            path, name = removal, cache.get(removal, {}).get("name")
+        if name and encode_path(path) in failed:
+            names.add(name)
+    return names
+
+
 def print_removals(removals, removal_type):
     """Pretty print the files to remove."""
     bar = 75 * "-"
@@ -217,43 +292,44 @@ def warn_about_multiple_refs(removals, repo):
     pkg_removals = {item.pkg_path for item in removals if item.pkg_path}
     for app in repo:
         for item in repo[app]:
-            if (item not in removals and
-                    item.pkginfo.get("installer_item_location") in
-                    pkg_removals):
+            if item not in removals and item.pkg_path in pkg_removals:
                 print ("WARNING: Package '{}' is targeted for removal, but has "
                    "references in pkginfo '{}' which is not targeted for "
-                   "removal.".format(
-                       item.pkginfo.get("installer_item_location"), item.pkginfo_path))
+                   "removal.".format(item.pkg_path, item.pkginfo_path))
+
+
+def move_to_archive(removals, archive_path, context=None, resumed=()):
+    """Move a list of files to an archive folder.
 
+    Files are moved concurrently and journaled, so an interrupted
+    archive can be resumed with --resume.
 
-def move_to_archive(removals, archive_path):
-    """Move a list of files to an archive folder."""
+    Args:
+        removals: List of ApplicationVersions to archive.
+        archive_path: String path to the archive repo.
+        context: RepoContext of the repo.
+        resumed: List of archiver Operations of an earlier run to
+            finish as well; see get_resumed_operations.
+
+    Returns:
+        Set of the paths that could not be archived.
+    """
+    context = context or RepoContext.from_prefs()
     pkgs_folder = os.path.join(archive_path, "pkgs")
     pkgsinfo_folder = os.path.join(archive_path, "pkgsinfo")
     for folder in (pkgs_folder, pkgsinfo_folder):
         make_folders(folder)
 
-    repo_prefix = tools.get_repo_path()
+    operations = []
     for item in removals:
-        if isinstance(item, ApplicationVersion):
-            removal_paths = [item.pkginfo_path]
-            if item.pkg_path:
-                removal_paths.append(os.path.join(tools.get_pkg_path(),
-                                                  item.pkg_path))
-        else:
-            removal_paths = [item]
-
-        for path in removal_paths:
-            archive_item = path.replace(
-                repo_prefix, "", 1)
-            archive_item = os.path.join(archive_path, archive_item)
-            make_folders(os.path.dirname(archive_item))
-            try:
-                shutil.move(path, archive_item)
-                print "Archived '{}' to '{}'.".format(path, archive_item)
-            except (IOError, OSError) as err:
-                print "Failed to remove item '{}' with error '{}'.".format(
-                    path, err.strerror)
+        for path in get_removal_paths(item, context):
+            archive_item = os.path.join(
+                archive_path, os.path.relpath(path, context.repo_path))
+            operations.append(archiver.Operation(
+                archiver.MOVE, encode_path(path), encode_path(archive_item)))
+    return get_failed_sources(archiver.run_operations(
+        list(resumed) + operations,
+        archiver.get_journal_path(context.repo_path)))
 
 
 def make_folders(folder):
@@ -267,136 +343,299 @@ def make_folders(folder):
             sys.exit(1)
 
 
-def remove(removals):
-    """Delete a list of files."""
-    for item in removals:
-        if isinstance(item, ApplicationVersion):
-            removal_paths = [item.pkginfo_path]
-            if item.pkg_path:
-                removal_paths.append(os.path.join(tools.get_pkg_path(),
-                                                  item.pkg_path))
-        else:
-            removal_paths = [item]
-
-        for path in removal_paths:
-            if os.path.isfile(path):
-                try:
-                    os.remove(path)
-                    print "Removed '{}'.".format(path)
-                except (IOError, OSError) as error:
-                    print ("Unable to remove {} with error: {}".format(
-                        path, error.strerror))
-            elif os.path.isdir(path):
-                try:
-                    shutil.rmtree(path)
-                    print "Removed '{}'.".format(path)
-                except (IOError, OSError) as error:
-                    print ("Unable to remove {} with error: {}".format(
-                        path, error.strerror))
-            else:
-                print "Skipping '{}' as it does not seem to exist.".format(
-                    path)
+def remove(removals, context=None, resumed=()):
+    """Delete a list of files, concurrently and journaled.
 
+    Args:
+        removals: List of ApplicationVersions to remove.
+        context: RepoContext of the repo.
+        resumed: List of archiver Operations of an earlier run to
+            finish as well; see get_resumed_operations.
 
-def git_rm(removals):
-    """Use git to stage deletions."""
-    for item in removals:
-        if isinstance(item, ApplicationVersion):
-            removal_paths = [item.pkginfo_path]
-            if item.pkg_path:
-                removal_paths.append(os.path.join(tools.get_pkg_path(),
-                                                  item.pkg_path))
-        else:
-            removal_paths = [item]
+    Returns:
+        Set of the paths that could not be removed.
+    """
+    context = context or RepoContext.from_prefs()
+    operations = [
+        archiver.Operation(archiver.REMOVE, encode_path(path), None)
+        for item in removals for path in get_removal_paths(item, context)]
+    return get_failed_sources(archiver.run_operations(
+        list(resumed) + operations,
+        archiver.get_journal_path(context.repo_path)))
 
-        for path in removal_paths:
-            proc = Popen(["git", "-C", tools.get_repo_path(),
-                            "rm", "-r", path], stdout=PIPE, stderr=PIPE)
-            stdout, stderr = proc.communicate()
 
-            if proc.returncode != 0:
-                if "did not match any files" in stderr:
-                    print ("File '{}' is not under version control. "
-                            "Skipping.".format(path))
-                else:
-                    print "git rm failed for {} with error: {}".format(
-                        path, stderr)
+def get_resumed_operations(args, context):
+    """Return the unfinished operations of an earlier run to resume.
 
+    They are only resumed with --resume; otherwise they are left in
+    the journal, and a note says so. When archiving, resumed moves are
+    retargeted to this run's archive.
 
-def remove_names_from_manifests(names):
-    """Remove names from all manifests."""
-    if not names:
+    Returns:
+        List of archiver Operations.
+    """
+    resumable = archiver.get_resumable(
+        archiver.get_journal_path(context.repo_path))
+    if not getattr(args, "resume", False):
+        if resumable:
+            robo_print("{} unfinished operation(s) from an earlier run "
+                       "remain; use --resume to finish them.".format(
+                           len(resumable)), LogLevel.WARNING)
+        return []
+    if not args.archive:
+        return resumable
+    repo_path = encode_path(context.repo_path)
+    archive_path = encode_path(args.archive)
+    resumed = []
+    for operation in resumable:
+        if operation.action == archiver.MOVE:
+            operation = operation._replace(destination=os.path.join(
+                archive_path, os.path.relpath(operation.source, repo_path)))
+        resumed.append(operation)
+    return resumed
+
+
+def print_resumed_operations(resumed):
+    """Print the operations of an earlier run that will be resumed."""
+    if resumed:
+        print "Unfinished operations from an earlier run to resume:"
+        for operation in resumed:
+            print "\t{}".format(archiver.describe(operation))
+        print
+
+
+def get_failed_sources(failures):
+    """Return the set of source paths of failed archiver Operations."""
+    return {operation.source for operation in failures}
+
+
+def git_rm(removals, context=None, resumed=()):
+    """Use git to stage deletions.
+
+    The sources of resumed archiver Operations are staged too. Paths
+    are staged in as few git invocations as the argument length
+    limit allows, rather than one per path. If a batch fails, its paths
+    are retried one at a time so that each error is reported against
+    the path that caused it.
+    """
+    context = context or RepoContext.from_prefs()
+    paths = [encode_path(path) for item in removals
+             for path in get_removal_paths(item, context)]
+    paths.extend(operation.source for operation in resumed)
+    proc = Popen(["git", "-C", context.repo_path, "rev-parse",
+                  "--show-toplevel"], stdout=PIPE, stderr=PIPE)
+    stdout, stderr = proc.communicate()
+    if proc.returncode != 0:
+        print "git rm failed with error: {}".format(stderr)
+        return
+    toplevel = stdout.strip()
+
+    for batch in batch_arguments(paths, GIT_ARGS_LIMIT):
+        git_rm_batch(batch, context.repo_path, toplevel)
+
+
+def git_rm_batch(paths, repo_path, toplevel):
+    """Stage the deletion of a list of paths with one git rm."""
+    proc = Popen(["git", "--literal-pathspecs", "-C", repo_path, "rm", "-r",
+                  "--ignore-unmatch", "--"] + paths, stdout=PIPE, stderr=PIPE)
+    stdout, _ = proc.communicate()
+    if proc.returncode != 0:
+        # git rm checks every path before removing any, so nothing in
+        # this batch was staged.
+        for path in paths:
+            git_rm_path(path, repo_path)
         return
 
-    # Build a new cache post-removal. We haven't run makecatalogs, so
-    # we can't use the catalogs for this task.
-    repo_path = tools.get_repo_path()
+    # git reports each file it stages, relative to the top of the work
+    # tree. A path with no staged files under it is not tracked.
+    staged = set()
+    for line in stdout.splitlines():
+        if line.startswith("rm '") and line.endswith("'"):
+            staged.update(get_ancestors(line[4:-1]))
+    toplevel = os.path.realpath(toplevel)
+    for path in paths:
+        if os.path.relpath(os.path.realpath(path), toplevel) not in staged:
+            print ("File '{}' is not under version control. "
+                   "Skipping.".format(path))
+
+
+def git_rm_path(path, repo_path):
+    """Stage the deletion of a single path, reporting any failure."""
+    proc = Popen(["git", "--literal-pathspecs", "-C", repo_path, "rm", "-r",
+                  "--", path], stdout=PIPE, stderr=PIPE)
+    _, stderr = proc.communicate()
+
+    if proc.returncode != 0:
+        if "did not match any files" in stderr:
+            print ("File '{}' is not under version control. "
+                   "Skipping.".format(path))
+        else:
+            print "git rm failed for {} with error: {}".format(
+                path, stderr)
+
 
-    cache = tools.build_pkginfo_cache(repo_path)
-    remaining_names = {pkginfo.get("name") for pkginfo in cache.values()}
-    # Use set arithmetic to remove names that are still active in the
-    # repo from our removals set.
-    names_to_remove = names - remaining_names
+def batch_arguments(arguments, limit):
+    """Split a list of arguments into lists within an argv size limit.
+
+    Args:
+        arguments: List of string arguments.
+        limit: Int maximum bytes of arguments per batch, counting each
+            argument's terminating NUL and argv pointer.
+
+    Yields:
+        Non-empty lists of arguments, in order.
+    """
+    batch = []
+    size = 0
+    for argument in arguments:
+        argument_size = len(argument) + ARG_OVERHEAD
+        if batch and size + argument_size > limit:
+            yield batch
+            batch = []
+            size = 0
+        batch.append(argument)
+        size += argument_size
+    if batch:
+        yield batch
+
+
+def get_ancestors(path):
+    """Return a list of a relative path and each of its parent paths."""
+    ancestors = []
+    while path:
+        ancestors.append(path)
+        path = os.path.dirname(path)
+    return ancestors
+
+
+def get_removal_paths(item, context):
+    """Return the paths to remove for a removal.
+
+    Args:
+        item: ApplicationVersion, whose pkginfo and installer are
+            removed, or a string path.
+        context: RepoContext for the repo holding the item.
+    """
+    if isinstance(item, ApplicationVersion):
+        removal_paths = [item.pkginfo_path]
+        if item.pkg_path:
+            removal_paths.append(os.path.join(context.pkgs_path,
+                                              item.pkg_path))
+    else:
+        removal_paths = [item]
+    return removal_paths
 
-    manifests = tools.get_manifests()
-    for manifest_path, manifest in manifests.items():
-        remove_names_from_manifest(manifest_path, manifest, names_to_remove)
 
+def encode_path(path):
+    """Return path as a UTF-8 str, as needed for subprocess arguments."""
+    if isinstance(path, unicode):
+        return path.encode("utf-8")
+    return path
 
-def remove_names_from_manifest(manifest_path, manifest, removals):
+
+def remove_names_from_manifests(names, context=None):
+    """Remove names from the manifests that list them.
+
+    Only manifests that the manifest index says list a name (or an item
+    that looks like a versioned form of one) are read and rewritten.
+    They are rewritten concurrently, each atomically.
+    """
+    if not names:
+        return
+
+    context = context or RepoContext.from_prefs()
+    index = ManifestIndex(context.repo_path).build()
+    names = frozenset(names)
+    # Items such as 'Firefox-50' may refer to a removed product, but
+    # are left for the user to check rather than removed.
+    prefixes = tuple(names)
+    suspects = frozenset(
+        item for item in index.references if item not in names and
+        item.startswith(prefixes) and not item.endswith(prefixes))
+
+    affected = set()
+    for item in names | suspects:
+        affected.update(index.get_referencing_manifests(item))
+    paths = [index.get_path(name) for name in sorted(affected)]
+    edit = partial(remove_names_from_manifest, removals=names,
+                   suspects=suspects)
+    for path, messages, error in tools.rewrite_plists(paths, edit):
+        for message in messages:
+            print message
+        if error:
+            print "Failed to update manifest '{}' with error '{}'.".format(
+                path, error)
+
+
+def remove_names_from_manifest(manifest_path, manifest, removals,
+                               suspects=frozenset()):
+    """Remove names from one manifest's item arrays.
+
+    Args:
+        manifest_path: String path to the manifest.
+        manifest: Manifest dictionary, modified in place.
+        removals: Set of names to remove.
+        suspects: Set of items to warn about but leave in place.
+
+    Returns:
+        Tuple of (bool whether the manifest changed, list of messages).
+    """
     keys = ("managed_installs",
             "optional_installs",
             "managed_updates",
             "managed_uninstalls")
-    sections = {key: manifest[key] for key in keys if key in manifest}
-    if "conditional_items" in manifest:
-        sections.update(
-            {"conditional_items/{}/{}".format(
-                condition["condition"], key): condition[key]
-             for condition in manifest["conditional_items"]
-             for key in keys if key in condition})
+    # List of (section label, dictionary holding the array, key).
+    sections = [(key, manifest, key) for key in keys if key in manifest]
+    for condition in manifest.get("conditional_items", []):
+        sections.extend(
+            ("conditional_items/{}/{}".format(condition.get("condition"),
+                                              key), condition, key)
+            for key in keys if key in condition)
 
     changed = False
-
-    for section, array in sections.items():
-        changes = handle_name_removal(array, removals)
-        if changes:
+    messages = []
+    for section, container, key in sections:
+        kept, removed, flagged = handle_name_removal(
+            container[key], removals, suspects)
+        if removed:
+            container[key] = kept
             changed = True
-            for change in changes:
-                print ("\tRemoved '{}' from section '{}' of manifest"
-                       "'{}'").format(change, section, manifest_path)
+            messages.extend(
+                "\tRemoved '{}' from section '{}' of manifest '{}'".format(
+                    item, section, manifest_path) for item in removed)
+        messages.extend(
+            "\tDeprecator found item '{}' from section '{}' of manifest '{}' "
+            "that may match a name to remove, but the length is wrong. "
+            "Please remove manually if required!".format(
+                item, section, manifest_path) for item in flagged)
 
-    if changed:
-        FoundationPlist.writePlist(manifest, manifest_path)
+    return (changed, messages)
 
 
-def handle_name_removal(array, names_to_remove):
-    """Remove names from a manifest.
+def handle_name_removal(array, names_to_remove, suspects=frozenset()):
+    """Split a manifest array on names to remove, in one pass.
 
     Args:
         array (list): The actual manifest array of names.
-        names_to_remove (list of str): Names of items to remove if
-        found.
+        names_to_remove (set of str): Names of items to remove if
+            found.
+        suspects (set of str): Items to flag, but keep.
 
     Returns:
-        List of removed names.
+        Tuple of lists: the items to keep, in order; the removed
+        items; and the kept items that are suspects.
     """
-    removals = []
-    changes = []
-
+    kept = []
+    removed = []
+    flagged = []
     for item in array:
         if item in names_to_remove:
-            removals.append(item)
-        elif (item.startswith(tuple(names_to_remove)) and not
-              item.endswith(tuple(names_to_remove))):
-            print ("\tDeprecator found item '{}' from section '{}' that may "
-                   "match a name to remove, but the length is wrong. "
-                   "Please remove manually if required!").format(item, section)
-    for item in removals:
-        array.remove(item)
-        changes.append(item)
-
-    return changes
+            removed.append(item)
+        else:
+            kept.append(item)
+            if item in suspects:
+                flagged.append(item)
+    return (kept, removed, flagged)
 
 
 if __name__ == "__main__":
@@ -20,7 +20,6 @@
 
 import codecs
 from collections import defaultdict
-from distutils.version import LooseVersion
 import os
 import sys
 from urllib import quote
@@ -33,7 +32,9 @@ except ImportError:
            "`pip install markdown` or `easy_install markdown`.")
     markdown = None
 
+from context import RepoContext
 import tools
+from version_keys import version_key
 
 
 class Markdown(object):
@@ -189,21 +190,22 @@ class Table(Markdown):
         return u"| {} |".format(" | ".join(row))
 
 
-def handle_docs(args):
+def handle_docs(args, context=None):
     # TODO: See @homebysix for awesome mockups of future docs.
     if not os.path.isdir(args.outputdir):
         sys.exit("outputdir '{}' does not exist. Exiting.".format(
             args.outputdir))
-    repo = tools.get_repo_path()
-    pkgsinfo = tools.build_pkginfo_cache(repo)
+    context = context or RepoContext.from_prefs()
+    pkgsinfo = tools.build_pkginfo_cache(context.repo_path)
     output = Markdown("# Items in Munki Repo")
     table_head = ("Name", "Display Name", "Versions Present", "Notes")
 
     rows = {}
     for name, item in get_item_info(pkgsinfo).items():
         versions = ", ".join("[{}]({})".format(
-            ver[0].__str__(), quote(ver[1])) for
-            ver in sorted(item["versions"]))
+            ver[0], quote(ver[1])) for ver in sorted(
+                item["versions"], key=lambda ver: (version_key(ver[0]),
+                                                   ver[1])))
         row = (name, item["display_name"], versions,
                item["notes"].replace("\n", " "))
         rows[name] = row
@@ -230,10 +232,12 @@ def get_item_info(pkgsinfo):
         item = items[pkginfo.get("name")]
         if "versions" not in item:
             item["versions"] = []
-        version = LooseVersion(pkginfo.get("version", "0.0"))
+        version = pkginfo.get("version", "0.0")
         item["versions"].append((version, path))
         # Update output item with highest version of each product.
-        if version == max(ver[0] for ver in item["versions"]):
+        sort_key = version_key(version)
+        if sort_key >= item.get("newest_key", sort_key):
+            item["newest_key"] = sort_key
             keys = ("notes", "display_name")
             for key in keys:
                 item[key] = pkginfo.get(key, "")
@@ -0,0 +1,356 @@
+#!/usr/bin/python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pure-Python XML property list reading and writing.
+
+This is the FoundationPlist backend used where PyObjC is unavailable
+(e.g. a Linux server hosting the Munki repo). It drives expat directly
+rather than going through plistlib's generic dispatch, which matters
+for large pkginfo files and catalogs.
+
+Errors are raised as PlistError; FoundationPlist translates them into
+its own exception classes.
+
+Large array plists (the 'all' catalog) can be streamed with iter_file,
+which yields each item as soon as it has been parsed.
+"""
+
+
+import base64
+import datetime
+import mmap
+from plistlib import Data
+from xml.parsers import expat
+
+
+PLIST_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" '
+    '"http://www.apple.com/DTDs/PropertyList-1.0.dtd">\n'
+    '<plist version="1.0">\n')
+PLIST_FOOTER = "</plist>\n"
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# Bytes handed to expat at a time when streaming a file.
+CHUNK_SIZE = 256 * 1024
+
+
+class PlistError(Exception):
+    """Raised for unparseable or unwritable property lists."""
+    pass
+
+
+def _parse_date(text):
+    return datetime.datetime.strptime(text, DATE_FORMAT)
+
+
+def _parse_data(text):
+    return Data(base64.b64decode(text))
+
+
+# Converters for the text content of each scalar element.
+SCALARS = {
+    "string": lambda text: text,
+    "integer": int,
+    "real": float,
+    "true": lambda _: True,
+    "false": lambda _: False,
+    "date": _parse_date,
+    "data": _parse_data}
+
+
+class PlistParser(object):
+    """Build a property list from expat events.
+
+    A single pending key suffices for dicts: a <key> is always followed
+    directly by its value, and containers are attached to their parent
+    as soon as they open.
+
+    When streaming (see iter_parse), items of the root array are not
+    appended to it, but collected in 'records' as each one closes.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.records = None
+        self._stack = []
+        self._key = None
+        self._text = []
+
+    def parse(self, data):
+        """Parse a string of XML plist data and return the root object."""
+        parser = self._make_parser()
+        parser.Parse(data, True)
+        return self.root
+
+    def iter_parse(self, chunks):
+        """Yield each item of the root array as soon as it is complete.
+
+        Args:
+            chunks: Iterable of strings of XML plist data, which are
+                parsed in order.
+        """
+        self.records = []
+        parser = self._make_parser()
+        for chunk in chunks:
+            parser.Parse(chunk, False)
+            for record in self._drain():
+                yield record
+        parser.Parse("", True)
+        for record in self._drain():
+            yield record
+        if not isinstance(self.root, list):
+            raise PlistError("The plist root is not an array")
+
+    def _drain(self):
+        if self.root is not None and not isinstance(self.root, list):
+            raise PlistError("The plist root is not an array")
+        records = self.records
+        self.records = []
+        return records
+
+    def _make_parser(self):
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self._text_append
+        return parser
+
+    def _text_append(self, text):
+        self._text.append(text)
+
+    def _start(self, tag, _):
+        if tag == "dict":
+            container = {}
+        elif tag == "array":
+            container = []
+        else:
+            self._text = []
+            return
+        self._add(container)
+        self._stack.append(container)
+
+    def _end(self, tag):
+        if tag in ("dict", "array"):
+            value = self._stack.pop()
+            if self.records is not None and len(self._stack) == 1:
+                self.records.append(value)
+        elif tag == "key":
+            self._key = "".join(self._text)
+        elif tag in SCALARS:
+            self._add(SCALARS[tag]("".join(self._text)))
+        elif tag != "plist":
+            raise PlistError("Unknown element '{}'".format(tag))
+
+    def _add(self, value):
+        if not self._stack:
+            self.root = value
+            return
+        container = self._stack[-1]
+        if isinstance(container, dict):
+            if self._key is None:
+                raise PlistError("Dictionary value without a key")
+            container[self._key] = value
+            self._key = None
+        elif self.records is not None and len(self._stack) == 1:
+            # Containers are recorded once they close.
+            if not isinstance(value, (dict, list)):
+                self.records.append(value)
+        else:
+            container.append(value)
+
+
+class ProjectingPlistParser(PlistParser):
+    """Build a property list keeping only some keys of each record.
+
+    A record is the root dict, or a dict directly inside a root array
+    (as in a catalog). Values of record keys not in 'keys' are skipped
+    while expat parses them: no objects are built for them, however
+    deeply nested, and their text is never passed back to Python.
+    """
+
+    def __init__(self, keys):
+        super(ProjectingPlistParser, self).__init__()
+        self.keys = frozenset(keys)
+        self._parser = None
+        # Depth of open elements inside the value being skipped.
+        self._skip = 0
+
+    def _make_parser(self):
+        self._parser = super(ProjectingPlistParser, self)._make_parser()
+        return self._parser
+
+    def _end(self, tag):
+        if tag == "key" and self._in_record():
+            key = "".join(self._text)
+            if key in self.keys:
+                self._key = key
+            else:
+                self._start_skipping()
+        else:
+            super(ProjectingPlistParser, self)._end(tag)
+
+    def _start_skipping(self):
+        # Swap in handlers that only track depth, and drop text
+        # entirely, until the next value has been closed.
+        parser = self._parser
+        parser.StartElementHandler = self._skip_start
+        parser.EndElementHandler = self._skip_end
+        parser.CharacterDataHandler = None
+
+    def _skip_start(self, *_):
+        self._skip += 1
+
+    def _skip_end(self, _):
+        if not self._skip:
+            raise PlistError("Dictionary key without a value")
+        self._skip -= 1
+        if not self._skip:
+            parser = self._parser
+            parser.StartElementHandler = self._start
+            parser.EndElementHandler = self._end
+            parser.CharacterDataHandler = self._text_append
+
+    def _in_record(self):
+        stack = self._stack
+        if len(stack) == 1:
+            return isinstance(stack[0], dict)
+        return (len(stack) == 2 and isinstance(stack[0], list) and
+                isinstance(stack[1], dict))
+
+
+def read_string(data, keys=None):
+    """Return the root object of the XML plist in string 'data'.
+
+    Args:
+        data: String of XML plist data.
+        keys: Optional collection of keys to keep in each record (the
+            root dict, or each dict in a root array). Other values are
+            skipped without being built. Defaults to keeping everything.
+    """
+    if data.startswith("bplist"):
+        raise PlistError("Binary property lists are not supported")
+    parser = PlistParser() if keys is None else ProjectingPlistParser(keys)
+    try:
+        return parser.parse(data)
+    except (expat.ExpatError, ValueError, TypeError) as error:
+        raise PlistError(str(error))
+
+
+def iter_file(path, keys=None, chunk_size=CHUNK_SIZE):
+    """Yield each item of the root array of the XML plist at path.
+
+    The file is memory mapped and parsed incrementally, so only the
+    items not yet consumed are held in memory, rather than the whole
+    file and every parsed item.
+
+    Args:
+        path: String path to an XML plist whose root is an array.
+        keys: Optional collection of keys to keep in each item, as per
+            read_string.
+        chunk_size: Int number of bytes to parse at a time.
+
+    Raises:
+        IOError or OSError if the file cannot be opened, and PlistError
+        if it cannot be parsed.
+    """
+    with open(path, "rb") as ifile:
+        try:
+            data = mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise PlistError("Empty property list")
+    try:
+        if data[:6] == "bplist":
+            raise PlistError("Binary property lists are not supported")
+        parser = PlistParser() if keys is None else ProjectingPlistParser(keys)
+        chunks = (data[offset:offset + chunk_size]
+                  for offset in xrange(0, len(data), chunk_size))
+        try:
+            for record in parser.iter_parse(chunks):
+                yield record
+        except (expat.ExpatError, ValueError, TypeError) as error:
+            raise PlistError(str(error))
+    finally:
+        data.close()
+
+
+def write_string(root):
+    """Return root object 'root' as a UTF-8 encoded XML plist string."""
+    output = [PLIST_HEADER]
+    _write_value(root, output, 0)
+    output.append(PLIST_FOOTER)
+    return "".join(output)
+
+
+def write_fragment(value, depth=0):
+    """Return 'value' as plist XML without the plist header or footer.
+
+    Used to write a large plist incrementally. The XML is indented for
+    nesting 'depth' levels below the root.
+    """
+    output = []
+    _write_value(value, output, depth)
+    return "".join(output)
+
+
+def _escape(text):
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(
+        ">", "&gt;")
+
+
+def _write_value(value, output, depth):
+    indent = "\t" * depth
+    if isinstance(value, basestring):
+        output.append("{}<string>{}</string>\n".format(indent, _escape(value)))
+    elif isinstance(value, bool):
+        output.append("{}<{}/>\n".format(indent, "true" if value else "false"))
+    elif isinstance(value, (int, long)):
+        output.append("{}<integer>{}</integer>\n".format(indent, value))
+    elif isinstance(value, float):
+        output.append("{}<real>{!r}</real>\n".format(indent, value))
+    elif hasattr(value, "keys"):
+        if not value:
+            output.append(indent + "<dict/>\n")
+            return
+        output.append(indent + "<dict>\n")
+        key_indent = indent + "\t"
+        for key in sorted(value.keys()):
+            if not isinstance(key, basestring):
+                raise PlistError("Dictionary keys must be strings")
+            output.append("{}<key>{}</key>\n".format(key_indent, _escape(key)))
+            _write_value(value[key], output, depth + 1)
+        output.append(indent + "</dict>\n")
+    elif isinstance(value, (list, tuple)):
+        if not value:
+            output.append(indent + "<array/>\n")
+            return
+        output.append(indent + "<array>\n")
+        for item in value:
+            _write_value(item, output, depth + 1)
+        output.append(indent + "</array>\n")
+    elif isinstance(value, datetime.datetime):
+        output.append("{}<date>{}</date>\n".format(
+            indent, value.strftime(DATE_FORMAT)))
+    elif isinstance(value, Data):
+        output.append("{}<data>{}</data>\n".format(
+            indent, base64.b64encode(value.data)))
+    elif value is None:
+        raise PlistError("None is not a valid plist value")
+    else:
+        raise PlistError("Unsupported type '{}'".format(type(value)))
@@ -18,28 +18,41 @@
 """Report on and optionally remove unused icons."""
 
 
-from collections import Counter, defaultdict
+from collections import defaultdict
 from functools import partial
-import glob
+from multiprocessing.pool import ThreadPool
 import os
+import posixpath
 import shutil
+import stat
 import sys
-from xml.sax.saxutils import escape
+import time
 
+from cache import CacheMode, IconListingCache
+from context import RepoContext
+from robo_print import robo_print, LogLevel
 import tools
+from tools import scandir
 
 
 NO_CATEGORY = "*NO CATEGORY*"
+ICON_EXTENSION = ".png"
+# Files Munki's makecatalogs keeps among the icons.
+IGNORED_ICONS = ("_icon_hashes.plist",)
+# Seconds a directory must have been unchanged to cache its listing.
+RACY_SECONDS = 2
 
 
 def main():
     pass
 
 
-def handle_icons(args):
+def handle_icons(args, context=None):
     """Build list of unused icons, and optionally remove/archive."""
-    cache = tools.build_pkginfo_cache(tools.get_repo_path())
-    unused_icons = get_unused_icons(tools.get_icons_path(), cache)
+    context = context or RepoContext.from_prefs()
+    cache = tools.build_pkginfo_cache(
+        context.repo_path, keys=("name", "icon_name"))
+    unused_icons = get_unused_icons(context.icons_path, cache)
     if not unused_icons:
         print "No unused icons found."
         sys.exit()
@@ -50,7 +63,8 @@ def handle_icons(args):
 
     if args.archive:
         method = "archive to {}".format(args.archive)
-        remove_icons = partial(move_to_archive, (args.archive))
+        remove_icons = partial(move_to_archive, args.archive,
+                               context=context)
     else:
         method = "delete"
         remove_icons = remove
@@ -65,34 +79,209 @@ def handle_icons(args):
     remove_icons(unused_icons)
 
 
+class IconInventory(object):
+    """Icon files under an icons directory.
+
+    Each directory level is listed concurrently, with scandir where it
+    is available. A directory's listing is cached, validated by the
+    directory's own stat, so a run only relists directories whose
+    entries have changed.
+
+    Attributes:
+        icons_path: String path to the icons directory.
+        icons: Set of paths of icon files, relative to icons_path and
+            '/' separated, as in an icon_name.
+        keys: Dict of icon key (see get_icon_key) to the set of icon
+            paths with that key.
+    """
+
+    def __init__(self, icons_path):
+        self.icons_path = icons_path
+        self.icons = set()
+        self.keys = defaultdict(set)
+
+    def build(self, use_cache=None, workers=None):
+        """Walk the icons directory.
+
+        Args:
+            use_cache: Bool whether to use the persistent cache.
+                Defaults to the global CacheMode setting.
+            workers: Int number of threads. Defaults to the global
+                ParseMode setting, or tools.STAT_WORKERS.
+
+        Returns:
+            The inventory, for chaining.
+        """
+        if use_cache is None:
+            use_cache = CacheMode.enabled
+        disk_cache = None
+        if use_cache:
+            disk_cache = IconListingCache(self.icons_path)
+            if not CacheMode.rebuild:
+                disk_cache.load()
+
+        workers = workers or tools.ParseMode.workers or tools.STAT_WORKERS
+        pool = ThreadPool(workers) if workers > 1 else None
+        task = partial(list_folder, self.icons_path, disk_cache=disk_cache)
+        seen = set()
+        # List of (relative directory, its icon key) to list next.
+        level = [("", "")]
+        try:
+            while level:
+                folders = [rel_dir for rel_dir, _ in level]
+                if pool and len(folders) > 1:
+                    results = pool.map_async(task, folders).get(
+                        tools.POOL_TIMEOUT)
+                else:
+                    results = [task(rel_dir) for rel_dir in folders]
+                listed, level = level, []
+                for (rel_dir, dir_key), (folder_stat, entries, cacheable) in (
+                        zip(listed, results)):
+                    path = os.path.join(self.icons_path, rel_dir)
+                    if disk_cache and folder_stat:
+                        seen.add(path)
+                        if cacheable:
+                            disk_cache.set(path, folder_stat, entries, None)
+                    for name, is_dir, key in entries:
+                        rel_path = posixpath.join(rel_dir, name)
+                        key = posixpath.join(dir_key, key)
+                        if is_dir:
+                            level.append((rel_path, key))
+                        elif rel_path not in IGNORED_ICONS:
+                            self.icons.add(rel_path)
+                            self.keys[key].add(rel_path)
+            if pool:
+                pool.close()
+        except KeyboardInterrupt:
+            if pool:
+                pool.terminate()
+            raise
+        finally:
+            if pool:
+                pool.join()
+
+        if disk_cache:
+            disk_cache.prune(seen)
+            disk_cache.save()
+        return self
+
+    def get_unused(self, used):
+        """Return the set of icon paths not matched by any used name.
+
+        Args:
+            used: Iterable of icon names, as from get_used_icons.
+        """
+        unused = set(self.icons)
+        for icon in used:
+            unused -= self.keys.get(get_icon_key(icon), set())
+        return unused
+
+
+def list_folder(icons_path, rel_dir, disk_cache=None):
+    """List one directory of an icons tree, using the cache if valid.
+
+    Returns:
+        Tuple of (stat of the directory, or None if it could not be
+        read; tuple of (name, bool is a directory, tools.fold_name(name))
+        for each entry; bool whether the listing may be cached).
+    """
+    path = os.path.join(icons_path, rel_dir)
+    try:
+        folder_stat = os.stat(path)
+    except OSError as error:
+        robo_print("Unable to read '{}': {}".format(path, error.strerror),
+                   LogLevel.WARNING)
+        return (None, (), False)
+    if disk_cache:
+        cached = disk_cache.get(path, folder_stat)
+        if cached:
+            return (folder_stat, cached[0], False)
+
+    entries = tuple((name, is_dir, tools.fold_name(name))
+                    for name, is_dir in scan(path))
+    # A listing taken in the same second as a change to the directory
+    # could miss a later change that leaves its mtime the same.
+    cacheable = time.time() - folder_stat.st_mtime > RACY_SECONDS
+    return (folder_stat, entries, cacheable)
+
+
+def scan(path):
+    """Yield (name, bool is a directory) for the entries of path.
+
+    Hidden files are skipped. Symlinks to files are listed as files;
+    symlinks to directories are not followed, as with os.walk.
+    """
+    try:
+        if scandir:
+            entries = [(entry.name, entry.is_dir(follow_symlinks=False),
+                        entry.is_file()) for entry in scandir(path)]
+        else:
+            entries = [(name,) + get_type(os.path.join(path, name))
+                       for name in os.listdir(path)]
+    except OSError as error:
+        robo_print("Unable to read '{}': {}".format(path, error.strerror),
+                   LogLevel.WARNING)
+        return
+    for name, is_dir, is_file in entries:
+        if name.startswith(".") or name in tools.IGNORED_FILES:
+            continue
+        if is_dir or is_file:
+            yield (name, is_dir)
+
+
+def get_type(path):
+    """Return (bool is a directory, bool is a file) as scandir would.
+
+    One lstat suffices, unless path is a symlink.
+    """
+    try:
+        mode = os.lstat(path).st_mode
+        if stat.S_ISLNK(mode):
+            return (False, os.path.isfile(path))
+    except OSError:
+        return (False, False)
+    return (stat.S_ISDIR(mode), stat.S_ISREG(mode))
+
+
 def get_used_icons(pkginfos):
-    icons = []
+    """Return the set of icon names the pkginfos refer to."""
+    icons = set()
     for pkginfo in pkginfos.values():
-        icon = pkginfo.get("icon_name")
+        icon = get_icon_name(pkginfo)
         if icon:
-            if not os.path.splitext(icon)[1]:
-                icon += ".png"
-            icons.append(icon)
-        else:
-            icons.append("{}.png".format(pkginfo["name"]))
+            icons.add(icon)
+    return icons
 
-    return set(icons)
 
+def get_icon_name(pkginfo):
+    """Return the icon name Munki looks up for a pkginfo.
+
+    As in Munki, this is the icon_name, or else the item's name, with
+    ".png" added if it has no extension.
+    """
+    icon = pkginfo.get("icon_name") or pkginfo.get("name")
+    if icon and not os.path.splitext(icon)[1]:
+        icon += ICON_EXTENSION
+    return icon
 
-def get_unused_icons(icon_path, pkginfos):
-    """Return a list of paths for unused icons."""
-    used_icons = {os.path.join(icon_path, path) for path in
-                  get_used_icons(pkginfos)}
-    icons = set(get_sub_paths(icon_path))
-    return icons - used_icons
 
+def get_icon_key(icon):
+    """Return the key an icon file and icon_name are matched by.
 
-def get_sub_paths(icon_path):
-    """Return a list of relative paths to all file in icon_path."""
-    for dirpath, dirnames, filenames in os.walk(icon_path):
-        relative_paths = [os.path.join(dirpath, fname) for fname in filenames]
+    Paths are '/' separated, Unicode NFC normalized (HFS+ stores file
+    names decomposed), and case folded. Repos are usually served from
+    case-insensitive volumes, and an icon that differs only in case
+    from a used name is safer kept than removed.
+    """
+    icon = posixpath.normpath(icon.replace(os.sep, "/")).lstrip("/")
+    return tools.fold_name(icon)
 
-    return relative_paths
+
+def get_unused_icons(icon_path, pkginfos):
+    """Return a set of paths for unused icons."""
+    inventory = IconInventory(icon_path).build()
+    return {os.path.join(icon_path, *icon.split("/"))
+            for icon in inventory.get_unused(get_used_icons(pkginfos))}
 
 
 def report_list(items, header="Items:", footer=None):
@@ -105,12 +294,13 @@ def report_list(items, header="Items:", footer=None):
     print
 
 
-def move_to_archive(archive_path, removals):
+def move_to_archive(archive_path, removals, context=None):
     """Move a list of files to an archive folder."""
     icons_folder = os.path.join(archive_path, "icons")
     make_folders(icons_folder)
 
-    repo_prefix = tools.get_repo_path()
+    context = context or RepoContext.from_prefs()
+    repo_prefix = context.repo_path
     for item in removals:
         archive_item = item.replace(repo_prefix, archive_path, 1)
         print "Archiving icon to: {}".format(archive_item)
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A single-walk inventory of a Munki repo's pkgs directory."""
+
+
+import os
+import stat
+
+from robo_print import robo_print, LogLevel
+from tools import fold_name, scandir
+
+
+BUNDLE_EXTENSIONS = (".pkg", ".mpkg")
+
+
+class PkgsInventory(object):
+    """Paths and sizes of everything under a pkgs directory.
+
+    The tree is walked once, when the inventory is built. Lookups for
+    existence, size, and path-case problems are then answered from
+    memory, so checking every pkginfo's installer does not cost a
+    filesystem round trip per item (or per path component).
+
+    Paths are relative to pkgs_path, '/' separated, and UTF-8 encoded,
+    as in an `installer_item_location`.
+
+    Attributes:
+        pkgs_path: UTF-8 encoded string path to the pkgs directory.
+            A unicode path is encoded, so that the names read from it
+            are byte strings like the paths they are looked up by.
+        entries: Dict of relative directory path ("" for pkgs_path
+            itself) to the set of names it contains.
+        sizes: Dict of relative path to size in bytes for every file
+            and directory. Bundle packages (non-flat .pkg and .mpkg
+            directories) are sized by their total contents; other
+            directories have a size of 0.
+        bundles: Set of relative paths of bundle packages.
+        installers: Set of relative paths that can be an installer
+            item: files outside of bundle packages, and the bundle
+            packages themselves.
+        folded: Dict of relative path, folded with tools.fold_name,
+            to relative path.
+    """
+
+    def __init__(self, pkgs_path):
+        self.pkgs_path = encode(pkgs_path)
+        self.entries = {}
+        self.sizes = {}
+        self.bundles = set()
+        self.installers = set()
+        self.folded = {}
+        self._walk()
+
+    def _walk(self):
+        # Stack of (relative directory, enclosing bundle or None).
+        stack = [("", None)]
+        while stack:
+            rel_dir, bundle = stack.pop()
+            names = self.entries[rel_dir] = set()
+            for name, is_dir, size in scan(
+                    os.path.join(self.pkgs_path, rel_dir)):
+                names.add(name)
+                rel_path = os.path.join(rel_dir, name)
+                if bundle is None:
+                    if (is_dir and os.path.splitext(name)[1].lower() in
+                            BUNDLE_EXTENSIONS):
+                        self.bundles.add(rel_path)
+                        self.installers.add(rel_path)
+                        self._add(rel_path, 0)
+                        stack.append((rel_path, rel_path))
+                        continue
+                    elif not is_dir:
+                        # Broken links are listed, but do not exist.
+                        self.installers.add(rel_path)
+
+                if is_dir:
+                    self._add(rel_path, 0)
+                    stack.append((rel_path, bundle))
+                elif size is not None:
+                    self._add(rel_path, size)
+                    if bundle is not None:
+                        self.sizes[bundle] += size
+
+    def _add(self, rel_path, size):
+        self.sizes[rel_path] = size
+        self.folded[fold_name(rel_path)] = rel_path
+
+    def resolve(self, installer):
+        """Return the inventory path installer refers to, or None.
+
+        An exact match is preferred. Otherwise, as on the
+        case-insensitive, normalization-insensitive volumes Munki repos
+        are usually served from, a path differing only in case or
+        Unicode normalization matches. (PathIssuesReport reports such
+        paths, which break on case-sensitive servers.)
+        """
+        path = normalize(installer)
+        if path in self.sizes:
+            return path
+        return self.folded.get(fold_name(path))
+
+    def exists(self, installer):
+        """Return whether installer exists, as os.path.exists would."""
+        return self.resolve(installer) is not None
+
+    def get_size(self, installer):
+        """Return the size of installer in bytes, or None if missing."""
+        return self.sizes.get(self.resolve(installer))
+
+    def get_bad_path(self, installer):
+        """Return the first component of installer that does not exist.
+
+        Components are matched case-sensitively. None is returned if
+        the whole path exists.
+        """
+        rel_dir = ""
+        for component in normalize(installer).split("/"):
+            if component not in self.entries.get(rel_dir, ()):
+                return component
+            rel_dir = os.path.join(rel_dir, component)
+        return None
+
+    def get_full_path(self, installer):
+        """Return the path of installer, as given, under pkgs_path."""
+        return os.path.join(self.pkgs_path, encode(installer))
+
+    def get_orphans(self, used):
+        """Return a sorted list of installers not in 'used'.
+
+        Args:
+            used: Iterable of `installer_item_location` values.
+        """
+        used = {self.resolve(installer) for installer in used}
+        return sorted(self.installers - used)
+
+
+def normalize(installer):
+    """Return an installer_item_location as an inventory path."""
+    return os.path.normpath(encode(installer)).lstrip("/")
+
+
+def encode(path):
+    """Return path as a UTF-8 encoded string."""
+    if isinstance(path, unicode):
+        return path.encode("utf-8")
+    return path
+
+
+def scan(path):
+    """Yield (name, is_dir, size) for each entry in a directory.
+
+    Directories are not followed through symlinks. Files are stat'ed
+    through symlinks, and broken links have a size of None. A
+    directory that cannot be read is reported and treated as empty.
+    """
+    try:
+        if scandir:
+            for entry in scandir(path):
+                if entry.is_dir(follow_symlinks=False):
+                    yield entry.name, True, 0
+                else:
+                    yield entry.name, False, get_size(entry.path, entry)
+        else:
+            for name in os.listdir(path):
+                entry_path = os.path.join(path, name)
+                if stat.S_ISDIR(os.lstat(entry_path).st_mode):
+                    yield name, True, 0
+                else:
+                    yield name, False, get_size(entry_path)
+    except OSError as error:
+        robo_print("Unable to read '{}': {}".format(path, error.strerror),
+                   LogLevel.WARNING)
+
+
+def get_size(path, entry=None):
+    """Return the size of the file at path, or None if it is missing."""
+    try:
+        return entry.stat().st_size if entry else os.stat(path).st_size
+    except OSError:
+        return None
@@ -0,0 +1,263 @@
+#!/usr/bin/python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent index of the items and includes of a repo's manifests.
+
+Each manifest is summarized as the set of item names it lists and
+the manifests it includes. Summaries are kept in a stat-validated cache
+(as for pkginfos), so a run reparses only the manifests that changed.
+
+The summaries are indexed both ways: which manifests list an item, and
+which manifests include a manifest. A manifest's effective items, those
+of the manifests it includes, recursively, are resolved once over the
+include graph and memoized.
+"""
+
+
+from collections import defaultdict
+import os
+
+import FoundationPlist
+from cache import CacheMode, ManifestCache, to_native
+from robo_print import robo_print, LogLevel
+import tools
+
+
+# Manifest arrays naming items to install, remove, update, or offer.
+ITEM_KEYS = ("managed_installs", "managed_uninstalls", "optional_installs",
+             "managed_updates")
+# Shared copies of item and manifest names; see get_name.
+_NAMES = {}
+
+
+class ManifestIndex(object):
+    """Items and includes of every manifest in a repo.
+
+    Manifests are named by their path relative to the manifests
+    directory, as in included_manifests.
+
+    Attributes:
+        repo_path: String path to the base of the Munki repo.
+        manifests_path: String path to the repo's manifests directory.
+        items: Dictionary of manifest name to a frozenset of the items
+            it lists, including in conditional_items.
+        includes: Dictionary of manifest name to a tuple of the names
+            of the manifests it includes.
+        references: Dictionary of item to the set of names of the
+            manifests that list it.
+        included_by: Dictionary of manifest name to the set of names of
+            the manifests that include it.
+        errors: Dictionary of manifest name to a list of problems:
+            unparseable files, missing includes, and include cycles.
+    """
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self.manifests_path = os.path.join(repo_path, "manifests")
+        self.items = {}
+        self.includes = {}
+        self.references = defaultdict(set)
+        self.included_by = defaultdict(set)
+        self.errors = defaultdict(list)
+        self._effective = {}
+
+    def build(self, use_cache=None):
+        """Read the manifests, reparsing only those that have changed.
+
+        Args:
+            use_cache: Bool whether to use the persistent cache.
+                Defaults to the global CacheMode setting.
+
+        Returns:
+            The index, for chaining.
+        """
+        if use_cache is None:
+            use_cache = CacheMode.enabled
+        disk_cache = None
+        if use_cache:
+            disk_cache = ManifestCache(self.repo_path)
+            if not CacheMode.rebuild:
+                disk_cache.load()
+
+        seen = set()
+        # List of (path, stat) for manifests that need to be parsed.
+        pending = []
+        for path in get_manifest_paths(self.manifests_path):
+            if not disk_cache:
+                pending.append((path, None))
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            seen.add(path)
+            cached = disk_cache.get(path, stat)
+            if cached:
+                self._add(path, *cached)
+            else:
+                pending.append((path, stat))
+
+        # Manifests are mostly item arrays, so they are parsed whole;
+        # skipping their few other keys saves less than it costs.
+        results = tools.parse_plists([item[0] for item in pending])
+        for (path, stat), (manifest, error) in zip(pending, results):
+            summary = summarize(manifest) if manifest is not None else None
+            if disk_cache:
+                disk_cache.set(path, stat, summary, error)
+            self._add(path, summary, error)
+
+        if disk_cache:
+            disk_cache.prune(seen)
+            disk_cache.save()
+
+        for name, includes in self.includes.items():
+            for included in includes:
+                if included not in self.items:
+                    self.errors[name].append(
+                        "Included manifest '{}' does not exist".format(
+                            included))
+        return self
+
+    def _add(self, path, summary, error):
+        name = os.path.relpath(path, self.manifests_path).replace(os.sep, "/")
+        if error is not None:
+            robo_print("Failed to open manifest '{}' with error "
+                       "'{}'.".format(path, error), LogLevel.WARNING)
+            self.errors[name].append(error)
+            return
+        items, includes = summary
+        self.items[name] = items
+        self.includes[name] = includes
+        for item in items:
+            self.references[item].add(name)
+        for included in includes:
+            self.included_by[included].add(name)
+
+    def get_path(self, name):
+        """Return the path to the manifest called name."""
+        return os.path.join(self.manifests_path, *name.split("/"))
+
+    def get_all_items(self):
+        """Return the set of items listed in any manifest."""
+        return set(self.references)
+
+    def get_referencing_manifests(self, item):
+        """Return the set of names of manifests that list item."""
+        return self.references.get(item, set())
+
+    def get_including_manifests(self, name):
+        """Return the names of manifests including name, at any depth."""
+        including = set()
+        pending = [name]
+        while pending:
+            for parent in self.included_by.get(pending.pop(), ()):
+                if parent not in including:
+                    including.add(parent)
+                    pending.append(parent)
+        including.discard(name)
+        return including
+
+    def get_effective_items(self, name):
+        """Return the items of a manifest and everything it includes.
+
+        The include graph is walked depth first without recursion, and
+        each manifest's result is memoized, so every manifest is
+        resolved once however many manifests include it. An include
+        that would close a cycle is reported in errors and ignored.
+        Missing manifests have no items.
+        """
+        if name in self._effective:
+            return self._effective[name]
+        if name not in self.items:
+            return frozenset()
+
+        stack = [(name, iter(self.includes[name]))]
+        on_stack = {name}
+        while stack:
+            current, children = stack[-1]
+            for child in children:
+                if child in self._effective or child not in self.items:
+                    continue
+                if child in on_stack:
+                    message = ("Including manifest '{}' forms a cycle; the "
+                               "include is ignored".format(child))
+                    if message not in self.errors[current]:
+                        robo_print("Manifest '{}': {}.".format(
+                            current, message), LogLevel.WARNING)
+                        self.errors[current].append(message)
+                    continue
+                on_stack.add(child)
+                stack.append((child, iter(self.includes[child])))
+                break
+            else:
+                stack.pop()
+                on_stack.discard(current)
+                items = set(self.items[current])
+                for child in self.includes[current]:
+                    items.update(self._effective.get(child, ()))
+                self._effective[current] = frozenset(items)
+
+        return self._effective[name]
+
+
+def get_manifest_paths(manifests_path):
+    """Return the paths of the manifest files under manifests_path."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(manifests_path):
+        dirnames[:] = [dirname for dirname in dirnames
+                       if not dirname.startswith(".")]
+        for filename in filenames:
+            if (filename not in tools.IGNORED_FILES and
+                    not filename.startswith(".")):
+                paths.append(os.path.join(dirpath, filename))
+    return paths
+
+
+def summarize(manifest):
+    """Return (frozenset of items, tuple of includes) for a manifest.
+
+    Names are shared plain Python strings; see get_name.
+    """
+    items = set()
+    includes = []
+    sections = [manifest]
+    conditionals = manifest.get("conditional_items")
+    if FoundationPlist.is_array(conditionals):
+        sections.extend(conditional for conditional in conditionals
+                        if hasattr(conditional, "keys"))
+    for section in sections:
+        for key in ITEM_KEYS:
+            names = section.get(key)
+            if names:
+                items.update(get_name(name) for name in names)
+        for included in section.get("included_manifests") or ():
+            included = get_name(included)
+            if included not in includes:
+                includes.append(included)
+    return (frozenset(items), tuple(includes))
+
+
+def get_name(value):
+    """Return a shared, plain Python copy of a name string.
+
+    Thousands of manifests list the same items. Sharing one copy of
+    each name saves memory, and lets the cache pickle each name once.
+    Foundation's strings are converted so that they can be pickled.
+    """
+    if type(value) not in (str, unicode):
+        value = to_native(value)
+    return _NAMES.setdefault(value, value)
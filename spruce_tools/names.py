@@ -17,15 +17,17 @@
 
 import argparse
 from collections import defaultdict
-from distutils.version import LooseVersion
 import csv
 import os
 
 import spruce_tools as tools
+from spruce_tools.version_keys import version_key
 
 
-def run_names(args):
-    all_plist = tools.get_all_catalog()
+def run_names(args, context=None):
+    context = context or tools.RepoContext.from_prefs()
+    all_plist = tools.iter_all_catalog(
+        context.repo_path, keys=("name", "version"))
     if args.version:
         report = get_names_and_versions(all_plist)
     else:
@@ -49,7 +51,7 @@ def get_argument_parser():
 def get_names_and_versions(all_plist):
     names = defaultdict(list)
     for pkginfo in all_plist:
-        names[pkginfo["name"]].append(LooseVersion(pkginfo["version"]))
+        names[pkginfo["name"]].append(pkginfo["version"])
 
     return names
 
@@ -62,8 +64,8 @@ def print_report(report, search):
                       search in key.upper()}
         for name, versions in sorted(report.items()):
             print name
-            for version in sorted(versions):
-                print "\t" + str(version)
+            for version in sorted(versions, key=version_key):
+                print "\t" + version
     else:
         if search:
             search = search.upper()
@@ -15,11 +15,15 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from distutils.version import LooseVersion
+import heapq
+import itertools
 import os
+import sys
 
+from context import RepoContext
 from robo_print import robo_print, LogLevel
 import tools
+from version_keys import version_key
 
 
 PKGINFO_EXTENSIONS = (".pkginfo", ".plist")
@@ -29,13 +33,41 @@ IGNORED_FILES = ('.DS_Store',)
 KILOBYTE = 1000
 MEGABYTE = KILOBYTE ** 2
 GIGABYTE = KILOBYTE ** 3
+# Shared copies of repeated pkginfo strings and tuples; see intern_value.
+_INTERNED = {}
+# The pkginfo keys ApplicationVersion reads. Pkginfos parsed only to
+# build a Repo need no others.
+PKGINFO_FIELDS = frozenset((
+    "name", "version", "catalogs", "category", "installer_item_location",
+    "installer_item_size", "minimum_os_version", "maximum_os_version",
+    "requires", "update_for"))
+
+
+class SizeMode(object):
+    """Manage global installer sizing with a singleton."""
+    verify = False  # Use --verify-sizes to stat every installer.
+
+    @classmethod
+    def set_verify(cls, value):
+        """Set the class variable for verify."""
+        if isinstance(value, bool):
+            cls.verify = value
+        else:
+            raise ValueError
 
 
 class Repo(object):
 
-    def __init__(self, pkgsinfo):
+    def __init__(self, pkgsinfo, context=None, inventory=None):
+        self.context = context or RepoContext.from_prefs()
         self.applications = {}
         self.errors = set()
+        self.missing_items = set()
+        # Memos for get_os_index, get_dependency_names, and
+        # get_retention_ranks. The graph does not change once built.
+        self._os_indexes = {}
+        self._dependency_names = {}
+        self._ranks = {}
         for path, pkginfo in pkgsinfo.items():
             item = ApplicationVersion(path, pkginfo)
             name = item.name
@@ -46,102 +78,297 @@ class Repo(object):
 
         for app in self.applications.values():
             app.add_dependencies(self)
-
-    def get_used_items(self, manifest_items, num_to_save, catalogs=None):
-        used = set()
-        for manifest_item in manifest_items:
-            # TODO: Add parameter for os version support.
-            # Support 10.9-10.12
-            for major in xrange(8, 13):
-                for minor in xrange(0, 10):
-                    test_version = "10.{}.{}".format(major, minor)
-                    used = (self.get_used_items_by_os(
-                        manifest_item, self, test_version, num_to_save, used,
-                        catalogs))
-
-        return used
-
-    def get_used_items_by_os(self, full_name, repo, os_version, keep,
-                             used=None, catalogs=None):
-        if not used:
-            used = set()
-        name, version = tools.split_name_from_version(full_name)
-        if not name in repo:
-            self.errors.add(
-                "'{}' does not exist in the repo, but is specified in a "
-                "manifest.".format(full_name))
-            return used
+            # Sorted now, so reading the finished graph (e.g. from
+            # concurrent reports) never writes to it.
+            app.sort()
+
+        self.resolve_sizes(inventory)
+
+    def resolve_sizes(self, inventory=None, verify=None):
+        """Size the installers that their pkginfos do not.
+
+        By default an item's size is its `installer_item_size`. Items
+        without one, or every item when verifying, are sized from the
+        inventory if one is given, or else by stat'ing their installers
+        in one concurrent batch. Missing installers are added to errors
+        and sized as 0.
+
+        Args:
+            inventory: Optional PkgsInventory of the repo's pkgs.
+            verify: Bool whether to size every installer from disk.
+                Defaults to the global SizeMode.
+        """
+        verify = SizeMode.verify if verify is None else verify
+        pending = [item for app in self.applications.values() for item in app
+                   if item.pkg_path and (verify or item.size is None)]
+        if inventory is not None:
+            sizes = [inventory.get_size(item.pkg_path) for item in pending]
         else:
-            app = repo[name]
-
-        if version:
-            if version not in app:
+            sizes = tools.get_file_sizes(
+                [os.path.join(self.context.pkgs_path, item.pkg_path) for
+                 item in pending])
+
+        for item, size in zip(pending, sizes):
+            if size is None:
+                error = "'{}-{}' installer '{}' does not exist.".format(
+                    item.name, item.version, item.pkg_path)
+                item.errors.append(error)
+                self.errors.add(error)
+                size = 0
+            item.size = size
+
+    def get_used_items(self, manifest_items, num_to_save, catalogs=None,
+                       os_range=None):
+        """Return the set of ApplicationVersions in use.
+
+        An item is used if, for some supported OS version, it is one
+        of the 'num_to_save' newest versions of a manifest item that
+        can install there, or is reached from one through 'requires'
+        or 'update_for' (again keeping the 'num_to_save' newest
+        versions of each product reached).
+
+        Args:
+            manifest_items: Iterable of names (optionally with a
+                version suffix) from manifests.
+            num_to_save: Int number of newest versions to keep.
+            catalogs: Optional sequence of catalog names that manifest
+                items must be in. Dependencies are not filtered.
+            os_range: Optional tuple of (minimum, maximum) OS version
+                strings. Defaults to the context's os_range.
+
+        Returns:
+            Set of ApplicationVersions.
+        """
+        ranks = self.get_retention_ranks(manifest_items, catalogs, os_range)
+        return {item for item, rank in ranks.items() if rank <= num_to_save}
+
+    def get_retention_ranks(self, manifest_items, catalogs=None,
+                            os_range=None):
+        """Return the retention rank of every used ApplicationVersion.
+
+        An item's rank is the smallest number of newest versions to
+        keep for which it would be used (see get_used_items), so the
+        items used when keeping N versions are those ranked N or less.
+        Every keep count is answered by this one traversal.
+
+        Rather than sampling individual OS versions, the supported
+        range is cut into slices at every minimum_os_version and
+        maximum_os_version that falls inside it. Every OS version in a
+        slice sees the same set of installable items, so each slice
+        only needs to be walked once.
+
+        Within a slice, reaching an item through the Nth newest
+        installable version of a product needs a keep count of at
+        least N, and an item's rank is the lowest, over every path to
+        it from a manifest item, of the highest such N along the path.
+        Items are visited in rank order, as in Dijkstra's shortest path
+        algorithm with the path's maximum in place of its sum, using a
+        heap rather than recursion. An item's overall rank is its lowest
+        rank in any slice.
+
+        Ranks are memoized by manifest items, catalogs, and OS range,
+        so every later call with the same arguments (for any keep
+        count) reuses the traversal.
+
+        Args:
+            manifest_items: Iterable of names (optionally with a
+                version suffix) from manifests.
+            catalogs: Optional sequence of catalog names that manifest
+                items must be in. Dependencies are not filtered.
+            os_range: Optional tuple of (minimum, maximum) OS version
+                strings. Defaults to the context's os_range.
+
+        Returns:
+            Dict of ApplicationVersion to int rank (1 is the newest).
+        """
+        manifest_items = frozenset(manifest_items)
+        os_range = tuple(os_range or self.context.os_range)
+        key = (manifest_items, tuple(catalogs) if catalogs else None,
+               os_range)
+        if key not in self._ranks:
+            self._ranks[key] = self._rank_items(
+                manifest_items, catalogs, os_range)
+        return dict(self._ranks[key])
+
+    def _rank_items(self, manifest_items, catalogs, os_range):
+        """Do the traversal for get_retention_ranks."""
+        slices, masks = self.get_os_index(os_range)
+        roots = []
+        for manifest_item, candidates in self.get_manifest_candidates(
+                manifest_items):
+            # Application objects iterate in newest-to-oldest order.
+            roots.append((manifest_item, [
+                item for item in candidates if
+                self.meets_catalog_requirements(item, catalogs)]))
+        ranks = {}
+        found = set()
+        # Breaks ties in the heap without comparing items.
+        counter = itertools.count()
+        for index in xrange(len(slices)):
+            os_bit = 1 << index
+            heap = []
+            for manifest_item, candidates in roots:
+                position = 0
+                for item in candidates:
+                    if masks[item] & os_bit:
+                        position += 1
+                        heap.append((position, next(counter), item))
+                if position:
+                    found.add(manifest_item)
+            heapq.heapify(heap)
+
+            slice_ranks = {}
+            # Items are visited in rank order, so a product's versions
+            # get their lowest ranks the first time it is expanded.
+            expanded = set()
+            while heap:
+                rank, _, item = heapq.heappop(heap)
+                if item in slice_ranks:
+                    continue
+                slice_ranks[item] = rank
+                if rank < ranks.get(item, sys.maxint):
+                    ranks[item] = rank
+                for name in self.get_dependency_names(item):
+                    if name in expanded:
+                        continue
+                    expanded.add(name)
+                    position = 0
+                    for candidate in self[name]:
+                        if masks[candidate] & os_bit:
+                            position += 1
+                            if candidate not in slice_ranks:
+                                heapq.heappush(heap, (
+                                    max(rank, position), next(counter),
+                                    candidate))
+
+        for manifest_item, _ in roots:
+            if manifest_item not in found:
+                # TODO: Specific OS versions would be helpful, but need
+                # to handle this in a way that doesn't massively
+                # increase the number of errors.
+                self.errors.add(
+                    "Zero items were found for manifest item '{}' for a "
+                    "supported OS version.".format(manifest_item))
+
+        return ranks
+
+    def get_dependency_names(self, item):
+        """Return the product names an item depends on, memoized.
+
+        Dependencies are followed by name, even when a specific version
+        is required.
+        """
+        try:
+            return self._dependency_names[item]
+        except KeyError:
+            names = tuple(sorted(
+                {dependency.name for dependency in
+                 item.requires + item.updates}))
+            self._dependency_names[item] = names
+            return names
+
+    def get_os_index(self, os_range=None):
+        """Return the OS slices and item masks for os_range, memoized.
+
+        Returns:
+            Tuple of (slices, masks) as returned by get_os_slices and
+            get_os_masks.
+        """
+        os_range = tuple(os_range or self.context.os_range)
+        if os_range not in self._os_indexes:
+            slices = self.get_os_slices(os_range)
+            self._os_indexes[os_range] = (slices, self.get_os_masks(slices))
+        return self._os_indexes[os_range]
+
+    def get_manifest_candidates(self, manifest_items):
+        """Return the items that each manifest item could install.
+
+        Manifest items missing from the repo are added to missing_items
+        and errors, and left out.
+
+        Returns:
+            List of (manifest item, candidates) tuples. Candidates are
+            an Application (newest version first), or a tuple of the
+            one version a manifest item specifies.
+        """
+        roots = []
+        for full_name in set(manifest_items):
+            name, version = tools.split_name_from_version(full_name)
+            if not name in self:
+                self.missing_items.add(full_name)
+                self.errors.add(
+                    "'{}' does not exist in the repo, but is specified in a "
+                    "manifest.".format(full_name))
+            elif version and version not in self[name]:
+                self.missing_items.add(full_name)
                 self.errors.add(
                     "'{}-{}' does not exist in the repo, but is specified in "
                     "a manifest.".format(name, version))
-                return used
+            elif version:
+                roots.append((full_name, (self[name][version],)))
             else:
-                candidates = (app[version],)
-        else:
-            candidates = app
-
-        count = 0
-        test_version = LooseVersion(os_version)
-
-        # Application objects iterate in newest-to-oldest order.
-        for item in candidates:
-            min_version = LooseVersion(item.min_version or "10.4.0")
-            max_version = LooseVersion(item.max_version or "10.12.99")
-
-            if (test_version >= min_version and
-                    test_version <= max_version and
-                    self.meets_catalog_requirements(item, catalogs)):
-                if item in used:
-                    count += 1
-                    if count == keep:
-                        return used
-                    continue
-                else:
-                    used.add(item)
-                    count += 1
-
-                for required in item.requires:
-                    if isinstance(required, Application):
-                        used = self.get_used_items_by_os(
-                            required.name, repo, os_version, keep, used)
-                    elif required in used:
+                roots.append((full_name, self[name]))
+        return roots
+
+    def get_os_slices(self, os_range=None):
+        """Cut the supported OS range into uniformly-supported slices.
+
+        Args:
+            os_range: Optional tuple of (minimum, maximum) OS version
+                strings. Defaults to the context's os_range.
+
+        Returns:
+            Sorted list of (version key, after) tuples, one per slice.
+            Each is the lowest OS version in its slice; 'after' is True
+            when the slice starts just above that version (i.e. after
+            some item's maximum_os_version).
+        """
+        low, high = (version_key(version) for version in
+                     os_range or self.context.os_range)
+        points = {(low, False)}
+        for app in self.applications.values():
+            for item in app:
+                if item.min_version:
+                    version = version_key(item.min_version)
+                    if low < version <= high:
+                        points.add((version, False))
+                if item.max_version:
+                    version = version_key(item.max_version)
+                    if low <= version < high:
+                        points.add((version, True))
+
+        return sorted(points)
+
+    def get_os_masks(self, slices):
+        """Return a dict of ApplicationVersion to bitmask of slices.
+
+        Bit N of an item's mask is set if the item can be installed on
+        the OS versions in slices[N]. As in Munki, an item without a
+        minimum_os_version or maximum_os_version is unbounded on that
+        side.
+        """
+        masks = {}
+        for app in self.applications.values():
+            for item in app:
+                min_version = (version_key(item.min_version) if
+                               item.min_version else None)
+                max_version = (version_key(item.max_version) if
+                               item.max_version else None)
+                mask = 0
+                for index, (version, after) in enumerate(slices):
+                    if min_version is not None and version < min_version:
                         continue
-                    else:
-                        used = self.get_used_items_by_os(
-                            required.name, repo, os_version, keep, used)
-
-                for update in item.updates:
-                    if isinstance(update, Application):
-                        used = self.get_used_items_by_os(
-                            update.name, repo, os_version, keep, used)
-                    elif update in used:
+                    if max_version is not None and (
+                            version >= max_version if after else
+                            version > max_version):
                         continue
-                    else:
-                        used = self.get_used_items_by_os(
-                            update.name, repo, os_version, keep, used)
-
-            assert count <= keep
-            if count == keep:
-                return used
-
-        if len(used) == 0:
-            # TODO: Specific OS versions would be helpful, but need to
-            # handle this in a way that doesn't massively increase the
-            # number of errors.
-            self.errors.add(
-                "Zero items were found for manifest item '{}' for a "
-                "supported OS version.".format(full_name))
-        return used
+                    mask |= 1 << index
+                masks[item] = mask
+        return masks
 
     def meets_catalog_requirements(self, item, catalogs):
         if catalogs:
-            return any(
-                cat in catalogs for cat in item.pkginfo.get("catalogs", []))
+            return any(cat in catalogs for cat in item.catalogs)
         else:
             return True
 
@@ -169,15 +396,18 @@ class Application(object):
     def __init__(self, name, app_versions=None):
         self.name = name
         self._app_versions = []
+        # Version string to the first ApplicationVersion added with it.
+        self._index = {}
+        # Newest-to-oldest order, rebuilt only after an add.
+        self._sorted = []
+        self._dirty = False
         if app_versions:
             for app_version in app_versions:
                 self.add(app_version)
 
     def __iter__(self):
         """Return an iterator from newest to oldest version."""
-        self._app_versions.sort(reverse=True)
-        for app_version in self._app_versions:
-            yield app_version
+        return iter(self._get_sorted())
 
     def __len__(self):
         return len(self._app_versions)
@@ -187,55 +417,82 @@ class Application(object):
             str(item) for item in self))
 
     def __getitem__(self, version):
-        search = [item for item in self if item.version == version]
-        if len(search) == 1:
-            result = search[0]
-        elif len(search) > 1:
-            robo_print("More than one pkg with version '{}'!".format(
-                version), LogLevel.WARNING)
-            result = search[0]
-        else:
-            raise KeyError(version)
-        return result
+        return self._index[version]
 
     def __contains__(self, version):
-        return any(version == item.version for item in self)
+        return version in self._index
 
     def add(self, app_version):
         if not isinstance(app_version, ApplicationVersion):
             raise ValueError("Unsupported argument type.")
+        if app_version.version in self._index:
+            robo_print("More than one pkg with version '{}' of '{}'! Using "
+                       "'{}'.".format(
+                           app_version.version, self.name,
+                           self._index[app_version.version].pkginfo_path),
+                       LogLevel.WARNING)
+        else:
+            self._index[app_version.version] = app_version
         self._app_versions.append(app_version)
-        self._app_versions.sort()
+        self._dirty = True
 
     def add_dependencies(self, repo):
         for version in self._app_versions:
             version.add_dependencies(repo)
 
     def get_newest(self, num):
-        self._app_versions.sort(reverse=True)
-        if num > len(self._app_versions):
-            num = len(self._app_versions)
+        return self._get_sorted()[0:num]
+
+    def sort(self):
+        """Sort versions newest first, if any were added since."""
+        if self._dirty:
+            # The sort is stable, so duplicate versions stay in the
+            # order they were added.
+            self._sorted = sorted(self._app_versions, reverse=True)
+            self._dirty = False
 
-        return self._app_versions[0:num]
+    def _get_sorted(self):
+        self.sort()
+        return self._sorted
 
 
 class ApplicationVersion(object):
+    """Compact record of the pkginfo fields Spruce's graph needs.
+
+    Only the fields used to build the graph and write reports are
+    kept, with repeated strings (names, versions, catalogs, and
+    categories) shared between records; the pkginfo dictionary itself
+    is not retained.
+    """
+    __slots__ = ("pkginfo_path", "pkg_path", "name", "version",
+                 "min_version", "max_version", "catalogs", "category",
+                 "size", "requires_names", "update_for_names", "requires",
+                 "required_by", "update_for", "updates", "errors")
 
     def __init__(self, pkginfo_path, pkginfo):
         self.pkginfo_path = pkginfo_path
-        self.pkg_path = pkginfo.get("installer_item_location")
-        self.name = pkginfo.get("name")
-        self.min_version = pkginfo.get("minimum_os_version")
-        self.max_version = pkginfo.get("maximum_os_version")
-        self.version = pkginfo.get("version")
-        self.pkginfo = pkginfo
+        self.pkg_path = to_string(pkginfo.get("installer_item_location"))
+        self.name = intern_value(pkginfo.get("name"))
+        self.min_version = intern_value(pkginfo.get("minimum_os_version"))
+        self.max_version = intern_value(pkginfo.get("maximum_os_version"))
+        self.version = intern_value(pkginfo.get("version"))
+        self.catalogs = intern_value(tuple(
+            intern_value(catalog) for catalog in
+            pkginfo.get("catalogs", [])))
+        self.category = intern_value(pkginfo.get("category"))
+        self.requires_names = tuple(
+            to_string(name) for name in pkginfo.get("requires", []))
+        self.update_for_names = tuple(
+            to_string(name) for name in pkginfo.get("update_for", []))
         if self.pkg_path:
-            # TODO: For now, let it raise an exception if pkg is missing
-            size = os.stat(
-                os.path.join(tools.get_pkg_path(), self.pkg_path)).st_size
+            # Munki records installer_item_size in KiB. Items without
+            # it are left for Repo.resolve_sizes.
+            try:
+                self.size = int(pkginfo["installer_item_size"]) * 1024
+            except (KeyError, TypeError, ValueError):
+                self.size = None
         else:
-            size = 0
-        self.size = size
+            self.size = 0
         self.requires = []
         self.required_by = []
         self.update_for = []
@@ -243,13 +500,8 @@ class ApplicationVersion(object):
         self.errors = []
 
     def _human_readable_size(self):
-        if self.size >= GIGABYTE:
-            size = "{:,.2f}G".format(float(self.size) / GIGABYTE)
-        elif self.size < GIGABYTE and self.size >= MEGABYTE:
-            size = "{:,.2f}M".format(float(self.size) / MEGABYTE)
-        elif self.size < MEGABYTE:
-            size = "{:,.2f}K".format(float(self.size) / KILOBYTE)
-        return size
+        # Unresolved sizes (outside of a Repo) are shown as 0.
+        return human_readable_size(self.size or 0)
 
     def __repr__(self):
         head_fmt = "{} {} ({} - {}): {}"
@@ -271,17 +523,11 @@ class ApplicationVersion(object):
         elif self.name > other.name:
             return 1
         else:
-            version = LooseVersion(self.version)
-            other = LooseVersion(other.version)
-            if version < other:
-                return -1
-            elif version == other:
-                return 0
-            else:
-                return 1
+            return cmp(version_key(self.version),
+                       version_key(other.version))
 
     def add_dependencies(self, repo):
-        for required_name in self.pkginfo.get("requires", []):
+        for required_name in self.requires_names:
             name, version = tools.split_name_from_version(required_name)
             if name not in repo:
                 self.errors.append(
@@ -305,7 +551,7 @@ class ApplicationVersion(object):
                 for item in repo[name]:
                     item.required_by.append(self)
 
-        for update_for_name in self.pkginfo.get("update_for", []):
+        for update_for_name in self.update_for_names:
             name, version = tools.split_name_from_version(update_for_name)
             if name not in repo:
                 self.errors.append(
@@ -333,3 +579,36 @@ class ApplicationVersion(object):
         self.updates.append(update)
 
 
+def human_readable_size(item_size):
+    """Return a size in bytes as a string like '1.50M'."""
+    if item_size >= GIGABYTE:
+        size = "{:,.2f}G".format(float(item_size) / GIGABYTE)
+    elif item_size < GIGABYTE and item_size >= MEGABYTE:
+        size = "{:,.2f}M".format(float(item_size) / MEGABYTE)
+    elif item_size < MEGABYTE:
+        size = "{:,.2f}K".format(float(item_size) / KILOBYTE)
+    return size
+
+
+def to_string(value):
+    """Return value as a plain str or unicode, or None.
+
+    PyObjC strings keep their NSString alive; copying them into Python
+    strings lets the Foundation object go.
+    """
+    if value is None or type(value) in (str, unicode):
+        return value
+    return unicode(value)
+
+
+def intern_value(value):
+    """Return a shared copy of a string, or tuple of strings.
+
+    The builtin intern() only accepts str, and pkginfo strings are
+    usually unicode, so Spruce keeps its own table.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, tuple):
+        value = to_string(value)
+    return _INTERNED.setdefault(value, value)
@@ -15,21 +15,30 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from distutils.version import LooseVersion
-from operator import itemgetter
+from functools import partial
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from operator import attrgetter, itemgetter
 import os
 import sys
 import textwrap
+import time
 
+from cache import to_native
+from context import RepoContext
 import cruftmoji
-from repo import Repo
-from robo_print import robo_print, LogLevel
-import sys
+from inventory import PkgsInventory
+from manifest_index import ManifestIndex
+from repo import PKGINFO_FIELDS, Repo
+import report_writers
 import tools
-import FoundationPlist
+from version_keys import version_key
 
 
 IGNORED_FILES = ('.DS_Store',)
+# ReportData shared with report worker processes, which inherit it when
+# the pool forks rather than having it pickled.
+_SHARED_REPORT_DATA = None
 
 
 class Report(object):
@@ -37,6 +46,10 @@ class Report(object):
 
     Attributes:
         name: String name for report.
+        key: String identifier used to select the report with --only
+            and --skip.
+        requires: Tuple of the ReportData keys the report reads. Only
+            the inputs required by the selected reports are built.
         items_key: Iterable of Tuples specifying output sorting.
             key (str): Key to sort by.
             reverse (bool): Whether to reverse sort.
@@ -44,14 +57,20 @@ class Report(object):
             order.
         metadata_order: A list of metadata key names defining their print
             output order.
+        run_time: Float seconds of wall time taken to run the report, or
+            None if it was not timed.
     """
     name = "Report"
+    key = None
+    requires = ("pkgsinfo",)
     description = ""
     items_keys = []
     items_order = []
     metadata_order = []
     separator = "-" * 20
 
+    run_time = None
+
     def __init__(self, repo_data):
         self.items = []
         self.metadata = []
@@ -71,20 +90,29 @@ class Report(object):
                 width=73, initial_indent=tab, subsequent_indent=tab)
             print "\n".join(wrapper.wrap(self.description))
             print
+        if self.run_time is not None:
+            print "\tRun time: {:.2f} seconds".format(self.run_time)
+            print
         if self.items or self.metadata:
-            if self.items_keys:
-                for key, reverse in reversed(self.items_keys):
-                    if key == "version":
-                        self.items.sort(key=lambda v: LooseVersion(v[key]),
-                                        reverse=reverse)
-                    else:
-                        self.items.sort(key=itemgetter(key), reverse=reverse)
+            self.sort_items()
             self._print_section("items")
             self._print_section("metadata")
         else:
             print "\tNo items."
             print
 
+    def sort_items(self):
+        """Sort items by items_keys, breaking ties by path."""
+        # Start from path order, so that output does not depend on the
+        # order in which items were found.
+        self.items.sort(key=lambda item: item.get("path"))
+        for key, reverse in reversed(self.items_keys):
+            if key == "version":
+                self.items.sort(key=lambda v: version_key(v[key]),
+                                reverse=reverse)
+            else:
+                self.items.sort(key=itemgetter(key), reverse=reverse)
+
     def _print_section(self, property):
         section = getattr(self, property)
         if len(section) > 0:
@@ -101,11 +129,14 @@ class Report(object):
             print
 
     def as_dict(self):
+        self.sort_items()
         return {"items": self.items, "metadata": self.metadata}
 
 
 class OutOfDateReport(Report):
     name = "Out of Date Items Report"
+    key = "out-of-date"
+    requires = ("production_ranks",)
     description = ("This report collects all items which are in the "
                    "production catalog, but are not the current "
                    "release version. Items that have dependencies to "
@@ -126,11 +157,11 @@ class OutOfDateReport(Report):
         # all_applications = set(version for app in
         #                        repo_data["repo_data"].applications.values() for
         #                        version in app)
-        used_items  = repo_data["repo_data"].get_used_items(
-            repo_data["manifest_items"], sys.maxint, ("production",))
-        current_items = repo_data["repo_data"].get_used_items(
-            repo_data["manifest_items"], self.num_to_save, ("production",))
-        out_of_date = used_items - current_items
+        # Used items that would not be kept if only num_to_save
+        # versions were kept.
+        ranks = repo_data["production_ranks"]
+        out_of_date = [item for item, rank in ranks.items() if
+                       rank > self.num_to_save]
         for item in out_of_date:
             self.items.append(
                 {"name": item.name,
@@ -141,6 +172,8 @@ class OutOfDateReport(Report):
 
 class PathIssuesReport(Report):
     name = "Case-Sensitive Path Issues Report"
+    key = "path-issues"
+    requires = ("pkgsinfo", "pkgs_inventory")
     description = (
         "This report collects all items whose installer item is referenced "
         "incorrectly due to case-sensitivity errors. Current macOS default "
@@ -152,31 +185,22 @@ class PathIssuesReport(Report):
     items_order = ["name", "path"]
 
     def run_report(self, repo_data):
-        pkgs = os.path.join(repo_data["munki_repo"], "pkgs")
+        inventory = repo_data["pkgs_inventory"]
         for pkginfo, data in repo_data["pkgsinfo"].items():
             installer = data.get("installer_item_location")
             if installer:
-                bad_dirs = self.get_bad_path(installer, pkgs)
+                bad_dirs = inventory.get_bad_path(installer)
                 if bad_dirs:
                     result = {"name": data.get("name"),
                               "path": pkginfo,
                               "bad_path_component": bad_dirs}
                     self.items.append(result)
 
-    def get_bad_path(self, installer, path):
-        if "/" in installer:
-            subdir = installer.split("/")[0]
-            if subdir in os.listdir(path):
-                return self.get_bad_path(installer.split("/", 1)[1],
-                                         os.path.join(path, subdir))
-            else:
-                return subdir
-        else:
-            return installer if installer not in os.listdir(path) else None
-
 
 class MissingInstallerReport(Report):
     name = "Missing Installer Report"
+    key = "missing-installers"
+    requires = ("pkgsinfo", "pkgs_inventory")
     description = (
         "This report collects all items which refer to nonexistent "
         "installers (`installer_item_location`).")
@@ -184,20 +208,21 @@ class MissingInstallerReport(Report):
     items_order = ["name", "path"]
 
     def run_report(self, repo_data):
-        pkgs = os.path.join(repo_data["munki_repo"], "pkgs")
+        inventory = repo_data["pkgs_inventory"]
         for pkginfo, data in repo_data["pkgsinfo"].items():
             installer = data.get("installer_item_location")
-            if installer:
-                installer_path = os.path.join(pkgs, installer)
-                if not os.path.exists(installer_path):
-                    result = {"name": data.get("name"),
-                              "path": pkginfo,
-                              "missing_installer": installer_path}
-                    self.items.append(result)
+            if installer and not inventory.exists(installer):
+                result = {"name": data.get("name"),
+                          "path": pkginfo,
+                          "missing_installer": inventory.get_full_path(
+                              installer)}
+                self.items.append(result)
 
 
 class OrphanedInstallerReport(Report):
     name = "Orphaned Installer Report"
+    key = "orphaned-installers"
+    requires = ("pkgsinfo", "pkgs_inventory")
     description = ("This report collects all pkgs present in the repo which "
                    "are not referenced by any pkginfo files.")
 
@@ -206,38 +231,19 @@ class OrphanedInstallerReport(Report):
 
     def run_report(self, repo_data):
         search_key = "installer_item_location"
-        # TODO: join full path
-        used_packages = {pkginfo[search_key] for pkginfo in
+        used_packages = (pkginfo[search_key] for pkginfo in
                          repo_data["pkgsinfo"].values() if search_key in
-                         pkginfo}
-        pkgs_dir = os.path.join(repo_data["munki_repo"], "pkgs")
-        bundle_packages = set()
-        for dirpath, _, filenames in os.walk(pkgs_dir):
-            if any(bundle_pkg in dirpath for bundle_pkg in bundle_packages):
-                # Contents of a bundle.
-                continue
-            elif os.path.splitext(dirpath)[1].upper() in (".PKG", ".MPKG"):
-                # This is a non-flat package. Check for the dirname only,
-                # then move on to the next iteration.
-                if dirpath not in used_packages:
-                    self.items.append({"path": dirpath})
-                    bundle_packages.add(dirpath)
-                continue
-            rel_path = dirpath.split(pkgs_dir)[1]
-            for filename in filenames:
-                # Slice off preceding slash.
-                rel_filename = os.path.join(rel_path, filename)
-                rel_filename = (rel_filename[1:] if
-                                rel_filename.startswith("/") else rel_filename)
-                if rel_filename not in used_packages:
-                    item_path = os.path.join(dirpath, filename)
-                    # result = {"name": item_path, "path": item_path}
-                    result = {"path": item_path}
-                    self.items.append(result)
+                         pkginfo)
+        inventory = repo_data["pkgs_inventory"]
+        # Non-flat packages are reported as a whole, not by contents.
+        for rel_path in inventory.get_orphans(used_packages):
+            self.items.append({"path": inventory.get_full_path(rel_path)})
 
 
 class NoUsageReport(Report):
     name = "Unused Item Report"
+    key = "unused"
+    requires = ("repo_data", "used_items")
     description = ("This report collects all items in the catalogs which are "
                    "not used in any manifests, are not required by any items "
                    "that are in use (using the `requires` key), nor are "
@@ -249,10 +255,7 @@ class NoUsageReport(Report):
         all_applications = set(version for app in
                                repo_data["repo_data"].applications.values() for
                                version in app)
-        num_to_keep = sys.maxint
-        used_items  = repo_data["repo_data"].get_used_items(
-            repo_data["manifest_items"], num_to_keep)
-        unused = all_applications - used_items
+        unused = all_applications - repo_data["used_items"]
         for item in unused:
             # TODO: Temporary attempt at stopping plist exception
             self.items.append(
@@ -264,19 +267,22 @@ class NoUsageReport(Report):
 
 class PkgsinfoWithErrorsReport(Report):
     name = "Pkginfo Syntax Error Report"
+    key = "pkginfo-errors"
+    requires = ("errors",)
     description = ("This report collects all items which have invalid plist "
                    "syntax in their pkginfo file.")
     items_keys = (("path", False),)
     items_order = ["path"]
 
-    def run_report(self, errors):
-        for key, value in errors.items():
+    def run_report(self, repo_data):
+        for key, value in repo_data["errors"].items():
             self.items.append({"path": key, "error": value})
 
 
 # TODO: Add to other reports.
 class UnusedDiskUsageReport(Report):
     name = "Unused / Out Of Date Item Disk Usage"
+    key = "unused-disk-usage"
 
     def run_report(self, cache):
         unused_size = 0.0
@@ -293,27 +299,31 @@ class UnusedDiskUsageReport(Report):
 
 
 class SimpleConditionReport(Report):
-    """Report Subclass for simple reports."""
+    """Report Subclass for simple reports.
+
+    Reports that only test each pkginfo against their conditions are
+    run together by run_condition_reports, in one pass over the
+    pkginfos.
+    """
     items_keys = (("name", False), ("version", True))
     items_order = ["name", "path"]
     conditions = []
 
-    def run_report(self, repo_data):
-        self.items = self.get_info(self.conditions, repo_data["pkgsinfo"])
+    def __init__(self, repo_data, items=None):
+        if items is None:
+            super(SimpleConditionReport, self).__init__(repo_data)
+        else:
+            self.items = items
+            self.metadata = []
 
-    def get_info(self, conditions, cache):
-        output = []
-        for path, pkginfo in cache.items():
-            if all(condition(pkginfo) for condition in conditions):
-                item = {"name": pkginfo["name"],
-                        "version": pkginfo["version"],
-                        "path": path}
-                output.append(item)
-        return sorted(output)
+    def run_report(self, repo_data):
+        report, = run_condition_reports([type(self)], repo_data)
+        self.items = report.items
 
 
 class UnattendedTestingReport(SimpleConditionReport):
     name = "Unattended Installs in Testing Report"
+    key = "unattended-testing"
     description = ("This report collects all items in the testing catalogs "
                    "which do not require user-intervention (i.e. use "
                    "the 'unattended_install: True' setting).")
@@ -322,6 +332,7 @@ class UnattendedTestingReport(SimpleConditionReport):
 
 class UnattendedProdReport(SimpleConditionReport):
     name = "Attended Installs in Production Report"
+    key = "attended-production"
     description = ("This report collects all items in the production catalog "
                    "which require user-intervention (i.e. do not use the "
                    "'unattended_install: True' setting).")
@@ -330,6 +341,7 @@ class UnattendedProdReport(SimpleConditionReport):
 
 class ForceInstallTestingReport(SimpleConditionReport):
     name = "Testing Non-Forced Installation Report"
+    key = "unforced-testing"
     description = ("This report collects all items in the testing catalogs "
                    "which do not use the `force_install_after_date` key in "
                    "their pkginfo.")
@@ -339,6 +351,7 @@ class ForceInstallTestingReport(SimpleConditionReport):
 
 class ForceInstallProdReport(SimpleConditionReport):
     name = "Production Forced Installation Report"
+    key = "forced-production"
     description = ("This report collects all items in the production catalog "
                    "which use the `force_install_after_date` key in their "
                    "pkginfo.")
@@ -346,88 +359,275 @@ class ForceInstallProdReport(SimpleConditionReport):
                   lambda x: x.get("force_install_after_date") is not None)
 
 
-def run_reports(args):
-    expanded_cache, errors = build_expanded_cache()
-
-    # TODO: Add sorting to output or reporting.
-    report_results = []
-
-    report_results.append(PathIssuesReport(expanded_cache))
-    report_results.append(MissingInstallerReport(expanded_cache))
-    report_results.append(OrphanedInstallerReport(expanded_cache))
-    report_results.append(PkgsinfoWithErrorsReport(errors))
-    report_results.append(OutOfDateReport(expanded_cache))
-    report_results.append(NoUsageReport(expanded_cache))
-    # Add the results of the last two reports together to determine
-    # wasted disk space.
-    # expanded_cache["unused_items"] = [item for report in report_results[-2:]
-    #                                   for item in report.items]
-    # report_results.append(UnusedDiskUsageReport(expanded_cache))
-    report_results.append(UnattendedTestingReport(expanded_cache))
-    report_results.append(UnattendedProdReport(expanded_cache))
-    report_results.append(ForceInstallTestingReport(expanded_cache))
-    report_results.append(ForceInstallProdReport(expanded_cache))
-
-    if args.plist:
-        dict_reports = {report.name: report.as_dict() for report in
-                        report_results}
-        print FoundationPlist.writePlistToString(dict_reports)
-    else:
-        for report in report_results:
-            report.print_report()
+# Reports run by the report command, in output order.
+REPORTS = (PathIssuesReport, MissingInstallerReport, OrphanedInstallerReport,
+           PkgsinfoWithErrorsReport, OutOfDateReport, NoUsageReport,
+           UnattendedTestingReport, UnattendedProdReport,
+           ForceInstallTestingReport, ForceInstallProdReport)
+REPORT_KEYS = tuple(report_class.key for report_class in REPORTS)
+# The pkginfo keys read by the reports and the Repo they build. Values
+# of all other keys are skipped when pkginfos are parsed for a report.
+REPORT_FIELDS = PKGINFO_FIELDS | frozenset(
+    ("unattended_install", "force_install_after_date"))
+
+
+class ReportData(object):
+    """Report inputs for a repo, built lazily and shared by reports.
+
+    Reports read their inputs by key, as from a dict. Each input is
+    built the first time it is requested, so a run only pays for what
+    its reports require.
+
+    Keys:
+        pkgsinfo: Dict of pkginfo path to pkginfo.
+        errors: Dict of pkginfo path to parse error.
+        munki_repo: String path to the repo.
+        pkgs_inventory: PkgsInventory of the repo's pkgs.
+        manifest_index: ManifestIndex of the repo's manifests.
+        manifest_items: Set of item names used by manifests.
+        repo_data: Repo built from the pkginfos.
+        production_ranks: Dict of the retention rank of each item used
+            by manifests through the production catalog (see
+            Repo.get_retention_ranks).
+        used_items: Set of the items used by manifests, keeping every
+            version.
+    """
+    # Inputs are built in this order, so that repo_data can size items
+    # from pkgs_inventory when it is also required.
+    build_order = ("pkgsinfo", "errors", "munki_repo", "pkgs_inventory",
+                   "manifest_index", "manifest_items", "repo_data",
+                   "production_ranks", "used_items")
+
+    def __init__(self, context):
+        self.context = context
+        self._data = {"munki_repo": context.repo_path}
+
+    def __getitem__(self, key):
+        if key not in self._data:
+            if key not in self.build_order:
+                raise KeyError(key)
+            getattr(self, "_build_" + key)()
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def build(self, keys):
+        """Build the inputs named in keys that have not been built."""
+        for key in self.build_order:
+            if key in keys:
+                self[key]
+
+    def _build_pkgsinfo(self):
+        self._data["pkgsinfo"], self._data["errors"] = (
+            tools.build_pkginfo_cache_with_errors(
+                self.context.repo_path, keys=REPORT_FIELDS))
+
+    _build_errors = _build_pkgsinfo
 
+    def _build_pkgs_inventory(self):
+        self._data["pkgs_inventory"] = PkgsInventory(self.context.pkgs_path)
 
-def build_expanded_cache():
-    munki_repo = tools.get_repo_path()
+    def _build_manifest_index(self):
+        self._data["manifest_index"] = ManifestIndex(
+            self.context.repo_path).build()
+
+    def _build_manifest_items(self):
+        self._data["manifest_items"] = self["manifest_index"].get_all_items()
+
+    def _build_repo_data(self):
+        self._data["repo_data"] = Repo(
+            self["pkgsinfo"], self.context, self._data.get("pkgs_inventory"))
+
+    def _build_production_ranks(self):
+        self._data["production_ranks"] = self["repo_data"].get_retention_ranks(
+            self["manifest_items"], ("production",))
+
+    def _build_used_items(self):
+        self._data["used_items"] = self["repo_data"].get_used_items(
+            self["manifest_items"], sys.maxint)
+
+
+def run_reports(args, context=None):
+    context = context or RepoContext.from_prefs()
+    if args.os_range:
+        context.os_range = tuple(args.os_range)
 
     # Ensure repo is mounted.
-    all_path = os.path.join(munki_repo, "catalogs", "all")
-    try:
-        all_plist = FoundationPlist.readPlist(all_path)
-    except FoundationPlist.NSPropertyListSerializationException:
+    if not os.path.isfile(context.all_catalog_path):
         sys.exit("Please mount your Munki repo and try again.")
 
-    cache, errors = tools.build_pkginfo_cache_with_errors(munki_repo)
+    report_classes = select_reports(args.only, args.skip)
+    writer = report_writers.get_writer("plist" if args.plist else args.format)
+    if writer.by_name:
+        report_classes.sort(key=attrgetter("name"))
+    repo_data = ReportData(context)
+    repo_data.build({key for report_class in report_classes for key in
+                     report_class.requires})
+
+    writer.start()
+    for report in iter_reports(report_classes, repo_data, args.report_mode):
+        writer.write_report(report)
+    writer.finish()
+
+
+def select_reports(only=None, skip=None):
+    """Return the report classes to run, in output order.
+
+    Args:
+        only: Optional iterable of report keys to run.
+        skip: Optional iterable of report keys not to run.
+    """
+    return [report_class for report_class in REPORTS if
+            (not only or report_class.key in only) and
+            (not skip or report_class.key not in skip)]
+
+
+def build_reports(report_classes, repo_data, mode="serial", workers=None):
+    """Run each report class, returning the reports in the same order.
+
+    See iter_reports for the arguments.
+    """
+    return list(iter_reports(report_classes, repo_data, mode, workers))
+
+
+def iter_reports(report_classes, repo_data, mode="serial", workers=None):
+    """Run each report class, yielding the reports in the same order.
+
+    SimpleConditionReports are run together in a single pass. The
+    reports are independent of each other, so in the thread and process
+    modes they run concurrently. Every input they require is built
+    first (see ReportData.build), so the reports only read repo_data,
+    and nothing is computed lazily while they share it. Each report is
+    yielded as soon as it and the reports before it have finished, so
+    it can be written out while later reports run.
+
+    Args:
+        report_classes: List of Report subclasses.
+        repo_data: ReportData for the repo.
+        mode: One of tools.PARSE_MODES.
+        workers: Int number of pool workers. Defaults to the global
+            ParseMode setting, or the number of CPUs.
+
+    Yields:
+        Reports, each with its run_time set.
+    """
+    global _SHARED_REPORT_DATA
+    workers = workers or tools.ParseMode.workers or multiprocessing.cpu_count()
+    repo_data.build({key for report_class in report_classes for key in
+                     report_class.requires})
+    condition_classes = tuple(
+        report_class for report_class in report_classes if
+        issubclass(report_class, SimpleConditionReport))
+    # Tasks are in order of their first report, so reports can be
+    # yielded in order as tasks finish.
+    tasks = []
+    for report_class in report_classes:
+        if report_class not in condition_classes:
+            tasks.append((report_class,))
+        elif report_class is condition_classes[0]:
+            tasks.append(condition_classes)
+
+    pool = None
+    if mode == "serial" or workers < 2 or len(tasks) < 2:
+        task_results = (run_report_task(repo_data, task) for task in tasks)
+        get_next = task_results.next
+    else:
+        if mode == "thread":
+            pool = ThreadPool(min(workers, len(tasks)))
+            runner = partial(run_report_task, repo_data)
+        else:
+            _SHARED_REPORT_DATA = repo_data
+            pool = multiprocessing.Pool(min(workers, len(tasks)))
+            runner = run_shared_report_task
+        task_results = pool.imap(runner, tasks)
+        get_next = partial(task_results.next, tools.POOL_TIMEOUT)
+
+    results = {}
+    position = 0
+    try:
+        for _ in tasks:
+            results.update(
+                (report.__class__, report) for report in get_next())
+            while (position < len(report_classes) and
+                   report_classes[position] in results):
+                yield results.pop(report_classes[position])
+                position += 1
+        if pool:
+            pool.close()
+    except BaseException:
+        # Including KeyboardInterrupt, and the caller abandoning us.
+        if pool:
+            pool.terminate()
+        raise
+    finally:
+        if pool:
+            pool.join()
+        _SHARED_REPORT_DATA = None
+
+
+def run_report_task(repo_data, report_classes):
+    """Run a tuple of report classes, timing them.
+
+    A tuple of SimpleConditionReports is run in one pass, and each of
+    them is given the time of the whole pass.
+
+    Returns:
+        List of reports.
+    """
+    start = time.time()
+    if issubclass(report_classes[0], SimpleConditionReport):
+        reports = run_condition_reports(report_classes, repo_data)
+    else:
+        reports = [report_class(repo_data) for report_class in report_classes]
+    run_time = time.time() - start
+    for report in reports:
+        report.run_time = run_time
+    return reports
 
-    expanded_cache = {}
-    expanded_cache["pkgsinfo"] = cache
-    expanded_cache["munki_repo"] = munki_repo
-    expanded_cache["manifest_items"] = get_manifest_items(
-        tools.get_manifests())
-    expanded_cache["repo_data"] = Repo(expanded_cache["pkgsinfo"])
 
-    return (expanded_cache, errors)
+def run_shared_report_task(report_classes):
+    """Run report classes in a worker process against the shared data.
 
+    Report items are converted to plain Python types so they can be
+    pickled back to the parent.
+    """
+    reports = run_report_task(_SHARED_REPORT_DATA, report_classes)
+    for report in reports:
+        report.items = to_native(report.items)
+        report.metadata = to_native(report.metadata)
+    return reports
 
-def get_manifest_items(manifests):
-    """Determine all used items.
 
-    First, gets the names of all managed_[un]install, optional_install,
-    and managed_update items, including in conditional sections.
+def run_condition_reports(report_classes, repo_data):
+    """Run SimpleConditionReports in one pass over the pkginfos.
 
-    Then looks through those items' pkginfos for 'requires' entries, and
-    adds them to the list.
+    Each condition is evaluated at most once per pkginfo, even when
+    several reports share it.
 
-    Finally, it looks through all pkginfos looking for 'update_for'
-    items in the used list; if found, that pkginfo's 'name' is added
-    to the list.
+    Returns:
+        List of reports, in the same order as report_classes.
     """
-    collections = ("managed_installs", "managed_uninstalls",
-                   "optional_installs", "managed_updates")
-    used_items = set()
-    for manifest in manifests:
-        for collection in collections:
-            items = manifests[manifest].get(collection)
-            if items:
-                used_items.update(items)
-        conditionals = manifests[manifest].get("conditional_items", [])
-        for conditional in conditionals:
-            for collection in collections:
-                items = conditional.get(collection)
-                if items:
-                    used_items.update(items)
-
-    return used_items
+    items = [[] for _ in report_classes]
+    if report_classes:
+        for path, pkginfo in repo_data["pkgsinfo"].items():
+            results = {}
+            for report_items, report_class in zip(items, report_classes):
+                for condition in report_class.conditions:
+                    if condition not in results:
+                        results[condition] = condition(pkginfo)
+                    if not results[condition]:
+                        break
+                else:
+                    report_items.append({"name": pkginfo["name"],
+                                         "version": pkginfo["version"],
+                                         "path": path})
+
+    return [report_class(repo_data, sorted(report_items)) for
+            report_class, report_items in zip(report_classes, items)]
 
 
 def main():
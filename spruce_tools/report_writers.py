@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming writers for report output.
+
+Each report is written, one item at a time, as soon as it is produced,
+so nothing the size of the whole output is ever built in memory, and
+consumers can start reading before the last report has run. A report's
+own items are still collected before it is written, since they are
+sorted to keep the output the same from run to run.
+"""
+
+
+import csv
+import json
+import sys
+from xml.sax.saxutils import escape
+
+import expat_plist
+
+
+OUTPUT_FORMATS = ("text", "plist", "ndjson", "csv")
+# CSV columns. Item keys without a column of their own are written to
+# "details" as key=value pairs.
+CSV_FIELDS = ("report", "section", "name", "version", "path", "size",
+              "details")
+SECTIONS = ("items", "metadata")
+
+
+class ReportWriter(object):
+    """Write reports to a stream as they are produced.
+
+    Attributes:
+        stream: File-like object to write to.
+        by_name: Bool whether reports must be written in name order.
+    """
+    by_name = False
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def start(self):
+        """Write anything that precedes the first report."""
+        pass
+
+    def write_report(self, report):
+        """Write one report, then flush it to the stream."""
+        report.sort_items()
+        self._write_report(report)
+        self.stream.flush()
+
+    def _write_report(self, report):
+        pass
+
+    def finish(self):
+        """Write anything that follows the last report."""
+        pass
+
+
+class TextWriter(ReportWriter):
+    """Print reports for people to read (always to stdout)."""
+
+    def _write_report(self, report):
+        report.print_report()
+
+
+class PlistWriter(ReportWriter):
+    """Write a plist of report names to their items and metadata.
+
+    The output is the same structure `report --plist` has always
+    produced, written incrementally.
+    """
+    # Dictionary keys are written sorted.
+    by_name = True
+
+    def start(self):
+        self.stream.write(expat_plist.PLIST_HEADER + "<dict>\n")
+
+    def _write_report(self, report):
+        write = self.stream.write
+        write("\t<key>{}</key>\n\t<dict>\n".format(escape(report.name)))
+        for section in SECTIONS:
+            entries = getattr(report, section)
+            write("\t\t<key>{}</key>\n".format(section))
+            if entries:
+                write("\t\t<array>\n")
+                for entry in entries:
+                    write(expat_plist.write_fragment(entry, 3))
+                write("\t\t</array>\n")
+            else:
+                write("\t\t<array/>\n")
+        write("\t</dict>\n")
+
+    def finish(self):
+        self.stream.write("</dict>\n" + expat_plist.PLIST_FOOTER)
+
+
+class NDJSONWriter(ReportWriter):
+    """Write one JSON object per line for each item and metadata entry.
+
+    Each object has the entry's keys, plus "report" (the report's key)
+    and "section" ("items" or "metadata").
+    """
+
+    def _write_report(self, report):
+        for section in SECTIONS:
+            for entry in getattr(report, section):
+                record = dict(entry)
+                record.update(report=report.key, section=section)
+                self.stream.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+class CSVWriter(ReportWriter):
+    """Write a CSV row for each item and metadata entry."""
+
+    def start(self):
+        self.writer = csv.writer(self.stream)
+        self.writer.writerow(CSV_FIELDS)
+
+    def _write_report(self, report):
+        for section in SECTIONS:
+            for entry in getattr(report, section):
+                row = {"report": report.key, "section": section}
+                details = []
+                for key, value in sorted(entry.items()):
+                    if key in CSV_FIELDS:
+                        row[key] = value
+                    else:
+                        details.append(u"{}={}".format(key, value))
+                row["details"] = u"; ".join(details)
+                self.writer.writerow(
+                    [_encode(row.get(field, "")) for field in CSV_FIELDS])
+
+
+WRITERS = {"text": TextWriter, "plist": PlistWriter, "ndjson": NDJSONWriter,
+           "csv": CSVWriter}
+
+
+def get_writer(output_format, stream=None):
+    """Return a ReportWriter for one of OUTPUT_FORMATS."""
+    return WRITERS[output_format](stream)
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return str(value)
@@ -18,12 +18,30 @@
 """Helper functions for interacting with Munki repos."""
 
 
+import functools
 import imp
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
-import sys
-
-sys.path.append("/usr/local/munki")
-from munkilib import FoundationPlist
+import stat
+import tempfile
+import time
+import unicodedata
+
+from cache import CacheMode, PkginfoCache, to_native
+import FoundationPlist
+from robo_print import robo_print, LogLevel
+
+# scandir avoids a stat call per directory entry for type checks. It is
+# in the standard library from Python 3.5; on Python 2, install the
+# 'scandir' package to use it.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 
 IGNORED_FILES = ('.DS_Store',)
@@ -32,6 +50,38 @@ SPRUCE_PREFS = os.path.expanduser(
     "~/Library/Preferences/com.sheagcraig.spruce.plist")
 MUNKIIMPORT_PREFS = os.path.expanduser(
     "~/Library/Preferences/com.googlecode.munki.munkiimport.plist")
+PARSE_MODES = ("serial", "thread", "process")
+# Wait this long (seconds) on pool results; a timeout is required for
+# KeyboardInterrupt to reach the main thread while it waits.
+POOL_TIMEOUT = 60 * 60 * 24
+# Stat calls wait on the file server rather than the CPU, so size
+# installers with more threads than there are CPUs.
+STAT_WORKERS = 16
+# Rewriting plists is mostly waiting on the file server, too.
+WRITE_WORKERS = 8
+
+
+class ParseMode(object):
+    """Manage global pkginfo parse concurrency with a singleton."""
+    mode = "serial"  # Use --parse-mode to choose thread or process pools.
+    workers = None  # Use --workers; None means one per CPU.
+
+    @classmethod
+    def set_mode(cls, value):
+        """Set the class variable for mode."""
+        if value in PARSE_MODES:
+            cls.mode = value
+        else:
+            raise ValueError
+
+    @classmethod
+    def set_workers(cls, value):
+        """Set the class variable for workers."""
+        if value is None or (isinstance(value, int) and value > 0):
+            cls.workers = value
+        else:
+            raise ValueError
+
 
 def get_prefs():
     # If prefs don't exist yet, offer to help create them.
@@ -67,10 +117,16 @@ def build_prefs():
     return prefs
 
 
-def get_manifests():
+def get_manifests(repo=None):
+    """Return a dict of manifest paths to manifest plist dicts.
+
+    Args:
+        repo: String path to the base of a Munki repo. Defaults to the
+            path in the Spruce preferences.
+    """
     # TODO: Add handling similar to pkgsinfo for errors. Add errors
     # to report.
-    manifest_dir = os.path.join(get_repo_path(), "manifests")
+    manifest_dir = os.path.join(repo or get_repo_path(), "manifests")
     manifests = {}
     for dirpath, dirnames, filenames in os.walk(manifest_dir):
         for dirname in dirnames:
@@ -100,11 +156,35 @@ def get_pkgsinfo_path():
     return os.path.join(get_repo_path(), "pkgsinfo")
 
 
-def get_all_catalog():
-    """Return the Munki 'all' catalog as a plist dict."""
-    munki_repo = get_repo_path()
+def get_all_catalog(repo=None, keys=None):
+    """Return the Munki 'all' catalog as a plist dict.
+
+    Args:
+        repo: String path to the base of a Munki repo. Defaults to the
+            path in the Spruce preferences.
+        keys: Optional collection of pkginfo keys to keep. Values of
+            all other keys are skipped while parsing.
+    """
+    munki_repo = repo or get_repo_path()
+    all_path = os.path.join(munki_repo, "catalogs", "all")
+    return FoundationPlist.readPlist(all_path, keys)
+
+
+def iter_all_catalog(repo=None, keys=None):
+    """Yield each pkginfo dict in the Munki 'all' catalog.
+
+    Unlike get_all_catalog, the catalog is parsed incrementally (with
+    the expat backend), so memory use is bounded by the pkginfos the
+    caller keeps rather than by the size of the catalog.
+
+    Args:
+        repo: String path to the base of a Munki repo. Defaults to the
+            path in the Spruce preferences.
+        keys: Optional collection of pkginfo keys to keep.
+    """
+    munki_repo = repo or get_repo_path()
     all_path = os.path.join(munki_repo, "catalogs", "all")
-    return FoundationPlist.readPlist(all_path)
+    return FoundationPlist.iterPlist(all_path, keys)
 
 
 def get_repo_path():
@@ -117,7 +197,7 @@ def get_munkiimport_prefs():
     """Get the current user's munkiimport preferences as plist dict."""
     try:
         prefs = FoundationPlist.readPlist(MUNKIIMPORT_PREFS)
-    except NSPropertyListSerializationException:
+    except FoundationPlist.NSPropertyListSerializationException:
         prefs = {}
     return prefs
 
@@ -141,26 +221,40 @@ def get_unique_names(all_catalog):
     return {pkginfo.get("name", "*NO NAME*") for pkginfo in all_catalog}
 
 
-def build_pkginfo_cache(repo):
+def build_pkginfo_cache(repo, use_cache=None, keys=None):
     """Build a dictionary of pkgsinfo.
 
     Args:
         repo: String path to the base of a Munki repo.
+        use_cache: Bool whether to use the persistent pkginfo cache.
+            Defaults to the global CacheMode setting.
+        keys: Optional collection of pkginfo keys to keep; see
+            build_pkginfo_cache_with_errors.
 
     Returns:
         Dictionary of pkgsinfo with:
             key: path to pkginfo
             val: pkginfo dictionary
     """
-    pkginfos, _ = build_pkginfo_cache_with_errors(repo)
+    pkginfos, _ = build_pkginfo_cache_with_errors(repo, use_cache, keys)
     return pkginfos
 
 
-def build_pkginfo_cache_with_errors(repo):
+def build_pkginfo_cache_with_errors(repo, use_cache=None, keys=None):
     """Build a dictionary of pkgsinfo.
 
+    Unless disabled, results are validated against, and saved to, the
+    persistent pkginfo cache so that only pkginfo files which have
+    changed since the last run are parsed.
+
     Args:
         repo: String path to the base of a Munki repo.
+        use_cache: Bool whether to use the persistent pkginfo cache.
+            Defaults to the global CacheMode setting.
+        keys: Optional collection of pkginfo keys to keep. Values of
+            other keys (installs arrays, scripts, icons...) are skipped
+            while parsing. Projected pkginfos are cached separately
+            from full ones, per set of keys.
 
     Returns:
         Tuple of:
@@ -172,23 +266,312 @@ def build_pkginfo_cache_with_errors(repo):
                 val: Exception message.
 
     """
+    if use_cache is None:
+        use_cache = CacheMode.enabled
+    disk_cache = PkginfoCache(repo, fields=keys) if use_cache else None
+    if disk_cache and not CacheMode.rebuild:
+        disk_cache.load()
+
     pkginfos = {}
     errors = {}
+    seen = set()
+    # List of (path, stat) for pkginfos that need to be parsed.
+    pending = []
     pkginfo_dir = os.path.join(repo, "pkgsinfo")
     for dirpath, _, filenames in os.walk(pkginfo_dir):
         for ifile in filter(is_pkginfo, filenames):
             path = os.path.join(dirpath, ifile)
-            try:
-                pkginfo_file = FoundationPlist.readPlist(path)
-            except FoundationPlist.FoundationPlistException as error:
-                errors[path] = error.message
+            if not disk_cache:
+                pending.append((path, None))
                 continue
 
-            pkginfos[path] = pkginfo_file
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                continue
+            seen.add(path)
+            cached = disk_cache.get(path, file_stat)
+            if cached:
+                store_pkginfo(path, cached, pkginfos, errors)
+            else:
+                pending.append((path, file_stat))
+
+    results = parse_plists([item[0] for item in pending],
+                           native=bool(disk_cache), keys=keys)
+    for (path, file_stat), result in zip(pending, results):
+        if disk_cache:
+            disk_cache.set(path, file_stat, *result)
+        store_pkginfo(path, result, pkginfos, errors)
+
+    if disk_cache:
+        disk_cache.prune(seen)
+        disk_cache.save()
 
     return (pkginfos, errors)
 
 
+def store_pkginfo(path, result, pkginfos, errors):
+    """Sort a (pkginfo, error) result into the pkginfos or errors dict."""
+    pkginfo_file, error = result
+    if error is not None:
+        errors[path] = error
+    else:
+        pkginfos[path] = pkginfo_file
+
+
+def parse_plists(paths, native=False, mode=None, workers=None, keys=None):
+    """Parse a list of plist files, optionally with a worker pool.
+
+    Used for both pkginfos and manifests.
+
+    Args:
+        paths: List of string paths to plist files.
+        native: Bool whether to convert results to plain Python types.
+            Results from the process pool are always converted, as
+            they must be pickled to return to the parent.
+        mode: One of PARSE_MODES. Defaults to the global ParseMode.
+        workers: Int number of pool workers. Defaults to the global
+            ParseMode setting, or the number of CPUs.
+        keys: Optional collection of top level keys to keep.
+
+    Returns:
+        List of (plist, error) tuples in the same order as paths.
+    """
+    mode = mode or ParseMode.mode
+    workers = workers or ParseMode.workers or multiprocessing.cpu_count()
+    if mode == "process":
+        reader = read_plist_native
+    else:
+        reader = read_plist_native if native else read_plist
+    if keys is not None:
+        reader = functools.partial(reader, keys=frozenset(keys))
+
+    if mode == "serial" or workers < 2 or len(paths) < 2:
+        return [reader(path) for path in paths]
+
+    pool_class = ThreadPool if mode == "thread" else multiprocessing.Pool
+    pool = pool_class(workers)
+    try:
+        # Hand out several chunks per worker to balance uneven files
+        # without paying per-file IPC overhead.
+        chunksize = max(1, len(paths) // (workers * 4))
+        results = pool.map_async(reader, paths, chunksize).get(POOL_TIMEOUT)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return results
+
+
+def read_plist(path, keys=None):
+    """Parse one plist file.
+
+    Args:
+        path: String path to a plist file.
+        keys: Optional collection of top level keys to keep.
+
+    Returns:
+        Tuple of (plist, None) on success, or (None, exception
+        message) if the file could not be parsed.
+    """
+    try:
+        return (FoundationPlist.readPlist(path, keys), None)
+    except FoundationPlist.FoundationPlistException as error:
+        return (None, error.message)
+
+
+def read_plist_native(path, keys=None):
+    """Parse one plist file into plain Python types.
+
+    Returns:
+        Tuple as per read_plist.
+    """
+    plist, error = read_plist(path, keys)
+    if plist is not None:
+        plist = to_native(plist)
+    return (plist, error)
+
+
+def get_file_sizes(paths, workers=None):
+    """Return the sizes of a list of files, stat'ing them concurrently.
+
+    Args:
+        paths: List of string paths.
+        workers: Int number of threads. Defaults to the global
+            ParseMode setting, or STAT_WORKERS.
+
+    Returns:
+        List of sizes as per get_file_size, in the same order as paths.
+    """
+    workers = workers or ParseMode.workers or STAT_WORKERS
+    if workers < 2 or len(paths) < 2:
+        return [get_file_size(path) for path in paths]
+
+    pool = ThreadPool(min(workers, len(paths)))
+    try:
+        results = pool.map_async(get_file_size, paths).get(POOL_TIMEOUT)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return results
+
+
+def get_file_size(path):
+    """Return the size in bytes of a file, or None if it is missing.
+
+    Directories (non-flat packages) are sized by their total contents.
+    """
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(file_stat.st_mode):
+        return file_stat.st_size
+
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.stat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def rewrite_plists(paths, edit, workers=None):
+    """Edit plist files concurrently, writing back those that change.
+
+    Args:
+        paths: List of string paths to plist files.
+        edit: Function called as edit(path, plist) in a worker thread.
+            It modifies plist in place and returns a tuple of (bool
+            whether plist changed, list of messages to report).
+        workers: Int number of threads. Defaults to the global
+            ParseMode setting, or WRITE_WORKERS.
+
+    Returns:
+        List of (path, messages, error) tuples in the same order as
+        paths, where error is None or a message saying why the file
+        could not be read or written.
+    """
+    task = functools.partial(rewrite_plist, edit=edit)
+    workers = workers or ParseMode.workers or WRITE_WORKERS
+    if workers < 2 or len(paths) < 2:
+        return [task(path) for path in paths]
+
+    pool = ThreadPool(min(workers, len(paths)))
+    try:
+        results = pool.map_async(task, paths).get(POOL_TIMEOUT)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return results
+
+
+def rewrite_pkginfos(paths, edit, total):
+    """Rewrite pkginfos with rewrite_plists, printing the results.
+
+    Each pkginfo's messages are printed, followed by a summary of how
+    many were changed, how long it took, and how many failed.
+
+    Args:
+        paths: List of string paths to the pkginfos to edit.
+        edit: Function to edit each pkginfo; see rewrite_plists.
+        total: Int number of pkginfos considered, for the summary.
+
+    Returns:
+        Int number of pkginfos changed.
+    """
+    start = time.time()
+    results = rewrite_plists(paths, edit)
+    run_time = time.time() - start
+
+    changed = failed = 0
+    for path, messages, error in results:
+        for message in messages:
+            print message
+        if error:
+            failed += 1
+            robo_print("Failed to update pkginfo '{}' with error '{}'.".format(
+                path, error), LogLevel.WARNING)
+        elif messages:
+            changed += 1
+
+    print ("Changed {} of {} pkginfo(s) in {:.2f} seconds ({:.1f} per "
+           "second); {} failed.".format(
+               changed, total, run_time,
+               changed / run_time if run_time else 0.0, failed))
+    return changed
+
+
+def rewrite_plist(path, edit):
+    """Edit one plist file; see rewrite_plists."""
+    try:
+        plist = FoundationPlist.readPlist(path)
+    except FoundationPlist.FoundationPlistException as error:
+        return (path, [], error.message)
+    changed, messages = edit(path, plist)
+    if changed:
+        try:
+            write_plist_atomically(plist, path)
+        except (IOError, OSError) as error:
+            return (path, messages, str(error))
+        except FoundationPlist.FoundationPlistException as error:
+            return (path, messages, error.message)
+    return (path, messages, None)
+
+
+def write_plist_atomically(plist, path):
+    """Write a plist so readers see either the old file or the new one.
+
+    The plist is written to a hidden temporary file beside path, which
+    is then renamed over it with path's permissions.
+    """
+    data = FoundationPlist.writePlistToString(plist)
+    folder, filename = os.path.split(path)
+    handle, temp_path = tempfile.mkstemp(dir=folder,
+                                         prefix=".{}.".format(filename))
+    try:
+        with os.fdopen(handle, "wb") as ofile:
+            ofile.write(data)
+            ofile.flush()
+            os.fsync(ofile.fileno())
+        try:
+            os.chmod(temp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except OSError:
+            pass
+        os.rename(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def fold_name(name):
+    """Return name as NFC normalized, lowercase unicode.
+
+    Names that differ only in case, or in Unicode normalization (HFS+
+    stores file names decomposed), fold to the same value.
+    """
+    if isinstance(name, str):
+        try:
+            return name.decode("ascii").lower()
+        except UnicodeDecodeError:
+            name = name.decode("utf-8", "replace")
+    return unicodedata.normalize("NFC", name).lower()
+
+
 def is_pkginfo(candidate):
     return os.path.splitext(candidate)[-1].lower() in PKGINFO_EXTENSIONS
 
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Comparable sort keys for Munki version strings.
+
+Munki compares versions with MunkiLooseVersion: a LooseVersion whose
+component lists are padded with zeros to equal length before being
+compared, so "10.8" == "10.8.0". Python 2 compares ints below strs, so
+a numeric component sorts before an alphabetic one.
+
+version_key() reproduces that ordering as a plain tuple. Each string is
+split once and the key memoized, so sorting and comparing versions
+repeatedly costs a dict lookup rather than a LooseVersion parse.
+"""
+
+
+import re
+
+
+# The same component pattern distutils' LooseVersion uses.
+COMPONENT_RE = re.compile(r"(\d+ | [a-z]+ | \.)", re.VERBOSE)
+# Numbers sort before strings, as in Python 2's mixed-type ordering.
+NUMBER = 0
+STRING = 1
+
+_KEYS = {}
+
+
+def version_key(version):
+    """Return a comparable, hashable key for a version string.
+
+    Keys compare the way MunkiLooseVersion compares the versions they
+    were made from. Padding with zeros is the same as dropping
+    trailing zero components, since zero sorts below every other
+    component.
+
+    Args:
+        version: Version string (str or unicode). None is treated as
+            an empty string.
+
+    Returns:
+        Tuple of (NUMBER, int) and (STRING, str) pairs.
+    """
+    try:
+        return _KEYS[version]
+    except KeyError:
+        pass
+
+    text = version if version is not None else ""
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+    else:
+        text = str(text)
+
+    components = []
+    for component in COMPONENT_RE.split(text):
+        if not component or component == ".":
+            continue
+        try:
+            components.append((NUMBER, int(component)))
+        except ValueError:
+            components.append((STRING, component))
+    while components and components[-1] == (NUMBER, 0):
+        components.pop()
+
+    key = tuple(components)
+    _KEYS[version] = key
+    return key
+
+
+def compare_versions(first, second):
+    """Compare two version strings, returning -1, 0, or 1 like cmp."""
+    return cmp(version_key(first), version_key(second))
+
+
+def clear_cache():
+    """Forget all memoized keys."""
+    _KEYS.clear()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from spruce_tools import archiver
+from spruce_tools.archiver import MOVE, REMOVE, Operation
+
+
+class TestArchiver(object):
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.base, "journal", "journal.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def make_file(self, name, contents="contents"):
+        path = os.path.join(self.base, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as ofile:
+            ofile.write(contents)
+        return path
+
+    def read_file(self, name):
+        with open(os.path.join(self.base, name)) as ifile:
+            return ifile.read()
+
+    def test_moves_and_removes(self):
+        moved = self.make_file("repo/pkgs/App.dmg", "app")
+        removed = self.make_file("repo/pkgsinfo/App.plist")
+        archived = os.path.join(self.base, "archive", "pkgs", "App.dmg")
+        failures = archiver.run_operations(
+            [Operation(MOVE, moved, archived),
+             Operation(REMOVE, removed, None)], self.journal_path)
+        assert_equal([], failures)
+        assert_equal("app", self.read_file("archive/pkgs/App.dmg"))
+        assert_false(os.path.exists(moved))
+        assert_false(os.path.exists(removed))
+        # A completed run leaves no journal behind.
+        assert_false(os.path.exists(self.journal_path))
+
+    def test_copy_verified_copies_bundles(self):
+        self.make_file("Bundle.pkg/Contents/Info.plist", "info")
+        os.symlink("Contents/Info.plist",
+                   os.path.join(self.base, "Bundle.pkg", "Link"))
+        archiver.copy_verified(os.path.join(self.base, "Bundle.pkg"),
+                               os.path.join(self.base, "Copy.pkg"))
+        assert_equal("info", self.read_file("Copy.pkg/Contents/Info.plist"))
+        assert_equal("Contents/Info.plist",
+                     os.readlink(os.path.join(self.base, "Copy.pkg/Link")))
+        assert_false(os.path.exists(os.path.join(
+            self.base, "Copy.pkg" + archiver.PARTIAL_SUFFIX)))
+
+    def interrupt(self, finished, unfinished):
+        journal = archiver.Journal(self.journal_path)
+        journal.start(finished + unfinished)
+        for operation in finished:
+            journal.record(operation)
+        journal._file.close()
+
+    def test_resumes_unfinished_operations(self):
+        first = self.make_file("repo/first")
+        second = self.make_file("repo/second")
+        unfinished = Operation(REMOVE, second, None)
+        self.interrupt([Operation(REMOVE, first, None)], [unfinished])
+
+        # Only the interrupted run's unfinished operations are resumed.
+        assert_equal([unfinished],
+                     archiver.get_resumable(self.journal_path))
+        assert_equal([], archiver.run_operations(
+            archiver.get_resumable(self.journal_path), self.journal_path))
+        assert_true(os.path.exists(first))
+        assert_false(os.path.exists(second))
+        assert_false(os.path.exists(self.journal_path))
+
+    def test_unrelated_run_keeps_unfinished_operations(self):
+        unfinished = Operation(REMOVE, self.make_file("repo/left"), None)
+        self.interrupt([], [unfinished])
+        other = self.make_file("repo/other")
+        assert_equal([], archiver.run_operations(
+            [Operation(REMOVE, other, None)], self.journal_path))
+        # The earlier run's operation was neither run nor forgotten.
+        assert_true(os.path.exists(unfinished.source))
+        assert_equal([unfinished],
+                     archiver.get_resumable(self.journal_path))
+
+    def test_impossible_operations_are_dropped(self):
+        missing = os.path.join(self.base, "missing")
+        operation = Operation(MOVE, missing, missing + "-archived")
+        failures = archiver.run_operations([operation], self.journal_path)
+        assert_equal([operation], failures)
+        journal = archiver.Journal(self.journal_path)
+        journal.load()
+        assert_equal([operation], journal.get_unfinished())
+        # With neither source nor destination, it can never succeed.
+        assert_equal([], archiver.get_resumable(self.journal_path))
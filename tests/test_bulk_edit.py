@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+from argparse import Namespace
+
+from nose.tools import *
+
+from fakes import FakeNSArray
+from spruce_tools.bulk_edit import (
+    APPEND, SET, UNSET, apply_edits, get_filters, matches, parse_value)
+
+
+class TestParseValue(object):
+
+    def test_values(self):
+        assert_equal(True, parse_value("TRUE"))
+        assert_equal(False, parse_value("false"))
+        assert_equal(-3, parse_value("-3"))
+        assert_equal(u"10.12", parse_value("10.12"))
+
+
+class TestFilters(object):
+
+    def get_filters(self, **kwargs):
+        args = dict(name=None, category=None, catalog=None, testing=None,
+                    unattended=None)
+        args.update(kwargs)
+        return get_filters(Namespace(**args))
+
+    def test_no_filters(self):
+        assert_equal([], self.get_filters())
+
+    def test_filters_combine(self):
+        filters = self.get_filters(category=["*NO CATEGORY*"], testing=True,
+                                   unattended=False)
+        assert_true(matches({"category": "", "catalogs": ["Testing"]},
+                            filters))
+        assert_false(matches({"catalogs": ["production"]}, filters))
+        assert_false(matches({"catalogs": ["testing"],
+                              "unattended_install": True}, filters))
+
+    def test_name_and_catalog(self):
+        filters = self.get_filters(name=["Chrome"], catalog=["production"])
+        assert_true(matches({"name": u"Chrome", "catalogs": ["production"]},
+                            filters))
+        assert_false(matches({"name": u"Chrome", "catalogs": ["testing"]},
+                             filters))
+
+
+class TestApplyEdits(object):
+
+    def setUp(self):
+        self.blocking = ["Safari.app"]
+        self.pkginfo = {"name": "Chrome", "unattended_install": 1,
+                        "blocking_applications": self.blocking,
+                        "notes": "Old"}
+
+    def test_edits(self):
+        changes = apply_edits(self.pkginfo, [
+            (SET, "unattended_install", True), (UNSET, "notes", None),
+            (APPEND, "blocking_applications", "Chrome.app")])
+        assert_equal(3, len(changes))
+        # An int is not the same as a bool in a plist.
+        assert_true(self.pkginfo["unattended_install"] is True)
+        assert_false("notes" in self.pkginfo)
+        assert_equal(["Safari.app", "Chrome.app"],
+                     self.pkginfo["blocking_applications"])
+        # Arrays are replaced, not changed in place.
+        assert_equal(["Safari.app"], self.blocking)
+
+    def test_append_to_foundation_array(self):
+        self.pkginfo["blocking_applications"] = FakeNSArray(["Safari.app"])
+        changes = apply_edits(self.pkginfo, [
+            (APPEND, "blocking_applications", "Chrome.app")])
+        assert_equal(1, len(changes))
+        assert_equal(["Safari.app", "Chrome.app"],
+                     self.pkginfo["blocking_applications"])
+
+    def test_no_op_edits(self):
+        changes = apply_edits(self.pkginfo, [
+            (SET, "name", "Chrome"), (UNSET, "absent", None),
+            (APPEND, "blocking_applications", "Safari.app"),
+            (APPEND, "name", "Chrome")])
+        assert_equal([], changes)
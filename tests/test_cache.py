@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from spruce_tools import cache
+from spruce_tools import FoundationPlist
+from spruce_tools import tools
+
+
+class TestPkginfoCache(object):
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        self.cache_dir = cache.CACHE_DIR
+        cache.CACHE_DIR = os.path.join(self.repo, "cache")
+        os.makedirs(os.path.join(self.repo, "pkgsinfo", "apps"))
+        self.paths = {}
+        for name in ("Firefox", "Chrome"):
+            self.paths[name] = self.write_pkginfo(name, "1.0")
+        self.broken = os.path.join(
+            self.repo, "pkgsinfo", "apps", "Broken.plist")
+        with open(self.broken, "w") as ofile:
+            ofile.write("<plist><dict><key>name</key>")
+
+        # Record which pkginfos actually get parsed.
+        self.parsed = []
+        self.parse_plists = tools.parse_plists
+
+        def parse_plists(paths, *args, **kwargs):
+            self.parsed.extend(paths)
+            return self.parse_plists(paths, *args, **kwargs)
+
+        tools.parse_plists = parse_plists
+
+    def tearDown(self):
+        tools.parse_plists = self.parse_plists
+        cache.CacheMode.set_rebuild(False)
+        cache.CACHE_DIR = self.cache_dir
+        shutil.rmtree(self.repo)
+
+    def write_pkginfo(self, name, version, mtime=0):
+        path = os.path.join(self.repo, "pkgsinfo", "apps", name + ".plist")
+        FoundationPlist.writePlist({"name": name, "version": version}, path)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def build(self):
+        del self.parsed[:]
+        return tools.build_pkginfo_cache_with_errors(self.repo, True)
+
+    def test_unchanged_files_are_not_reparsed(self):
+        first = self.build()
+        assert_equal(3, len(self.parsed))
+        assert_equal(first, self.build())
+        assert_equal([], self.parsed)
+
+    def test_changed_files_are_reparsed(self):
+        self.build()
+        self.write_pkginfo("Firefox", "2.0", mtime=60)
+        pkginfos, _ = self.build()
+        assert_equal([self.paths["Firefox"]], self.parsed)
+        assert_equal("2.0", pkginfos[self.paths["Firefox"]]["version"])
+        assert_equal("1.0", pkginfos[self.paths["Chrome"]]["version"])
+
+    def test_deleted_files_are_pruned(self):
+        self.build()
+        os.remove(self.paths["Chrome"])
+        pkginfos, _ = self.build()
+        assert_equal([], self.parsed)
+        assert_equal([self.paths["Firefox"]], pkginfos.keys())
+
+        disk_cache = cache.PkginfoCache(self.repo)
+        disk_cache.load()
+        assert_equal({self.paths["Firefox"], self.broken},
+                     set(disk_cache.entries))
+
+    def test_parse_errors_are_cached(self):
+        first = self.build()
+        assert_in(self.broken, first[1])
+        assert_equal(first, self.build())
+        assert_equal([], self.parsed)
+
+    def test_rebuild_reparses_everything(self):
+        first = self.build()
+        cache.CacheMode.set_rebuild(True)
+        assert_equal(first, self.build())
+        assert_equal(3, len(self.parsed))
+
+    def test_projected_pkginfos_are_cached_separately(self):
+        self.build()
+        del self.parsed[:]
+        pkginfos, _ = tools.build_pkginfo_cache_with_errors(
+            self.repo, True, keys=("name",))
+        assert_equal(3, len(self.parsed))
+        assert_equal({"name": "Firefox"}, pkginfos[self.paths["Firefox"]])
+        # The full entries were not evicted.
+        self.build()
+        assert_equal([], self.parsed)
+
+    def test_kinds_are_cached_separately(self):
+        paths = {cache_class(self.repo).path for cache_class in (
+            cache.PkginfoCache, cache.ManifestCache, cache.IconListingCache)}
+        assert_equal(3, len(paths))
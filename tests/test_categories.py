@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from nose.tools import *
+
+from spruce_tools.categories import (
+    NO_CATEGORY, format_counts, get_categories_by_name,
+    get_categories_for_names, merge_empty, set_category)
+
+
+class TestCategoriesByName(object):
+
+    def setUp(self):
+        self.catalog = [
+            {"name": "Chrome", "category": "Browsers"},
+            {"name": "Firefox", "category": "Browsers"},
+            {"name": "Chrome", "category": "Web"},
+            {"name": "Chrome", "category": "Browsers"},
+            {"name": "Slack", "category": ""},
+            {"name": "Slack"}]
+
+    def test_counts_per_name(self):
+        categories = get_categories_by_name(self.catalog)
+        assert_equal({"Browsers": 2, "Web": 1}, categories["Chrome"])
+        assert_equal("Browsers", categories["Chrome"].most_common(1)[0][0])
+        assert_equal({"Browsers": 1}, categories["Firefox"])
+
+    def test_empty_and_missing_are_not_split(self):
+        categories = get_categories_by_name(self.catalog)
+        assert_equal({NO_CATEGORY: 2}, merge_empty(categories["Slack"]))
+
+    def test_format_counts(self):
+        categories = get_categories_by_name(self.catalog)
+        assert_equal("Browsers: 2, Web: 1",
+                     format_counts(categories["Chrome"]))
+
+
+class TestSetCategory(object):
+
+    def setUp(self):
+        self.categories = get_categories_for_names(
+            {"Browsers": ["Chrome", "Firefox"], NO_CATEGORY: ["Slack"],
+             "Web": ["Chrome"]})
+
+    def test_inverted_map(self):
+        # Chrome is listed twice; the first category, sorted, wins.
+        assert_equal({"Chrome": "Browsers", "Firefox": "Browsers",
+                      "Slack": NO_CATEGORY}, self.categories)
+
+    def test_set_category(self):
+        plist = {"name": "Chrome", "category": "Web"}
+        changed, messages = set_category("Chrome.plist", plist,
+                                         self.categories)
+        assert_true(changed)
+        assert_equal("Browsers", plist["category"])
+        assert_equal(["Pkginfo Chrome.plist category set to Browsers."],
+                     messages)
+
+    def test_no_category_is_empty(self):
+        plist = {"name": "Slack"}
+        changed, _ = set_category("Slack.plist", plist, self.categories)
+        assert_true(changed)
+        assert_equal("", plist["category"])
+
+    def test_unchanged(self):
+        for plist in ({"name": "Firefox", "category": "Browsers"},
+                      {"name": "Other", "category": "Web"}):
+            assert_equal((False, []),
+                         set_category("path", plist, self.categories))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import stat
+import tempfile
+
+from nose.tools import *
+
+from spruce_tools import cache
+from spruce_tools import FoundationPlist
+from spruce_tools.context import RepoContext
+from spruce_tools.deprecate import (
+    batch_arguments, get_ancestors, handle_name_removal,
+    remove_names_from_manifest, remove_names_from_manifests)
+
+
+class TestGitBatching(object):
+
+    def test_batches_within_limit(self):
+        # Each argument costs its length plus ARG_OVERHEAD (9) bytes.
+        batches = list(batch_arguments(["aa", "bb", "cc"], 22))
+        assert_equal([["aa", "bb"], ["cc"]], batches)
+
+    def test_oversized_argument_gets_own_batch(self):
+        batches = list(batch_arguments(["a" * 50, "b"], 20))
+        assert_equal([["a" * 50], ["b"]], batches)
+
+    def test_no_arguments(self):
+        assert_equal([], list(batch_arguments([], 20)))
+
+    def test_get_ancestors(self):
+        assert_equal(["pkgs/apps/Foo.pkg", "pkgs/apps", "pkgs"],
+                     get_ancestors("pkgs/apps/Foo.pkg"))
+
+
+class TestManifestRemoval(object):
+
+    def setUp(self):
+        self.manifest = {
+            "managed_installs": ["Firefox", "Chrome", "Firefox-50"],
+            "conditional_items": [{"condition": "machine_type == 'laptop'",
+                                   "optional_installs": ["Chrome"]}]}
+
+    def test_handle_name_removal(self):
+        kept, removed, flagged = handle_name_removal(
+            ["Chrome", "Firefox", "Firefox-50", "Chrome"], {"Chrome"},
+            {"Firefox-50"})
+        assert_equal(["Firefox", "Firefox-50"], kept)
+        assert_equal(["Chrome", "Chrome"], removed)
+        assert_equal(["Firefox-50"], flagged)
+
+    def test_remove_from_sections(self):
+        changed, messages = remove_names_from_manifest(
+            "site", self.manifest, {"Chrome"}, {"Firefox-50"})
+        assert_true(changed)
+        assert_equal(["Firefox", "Firefox-50"],
+                     self.manifest["managed_installs"])
+        assert_equal([], self.manifest["conditional_items"][0][
+            "optional_installs"])
+        # Two removals, and a warning naming the suspect's section.
+        assert_equal(3, len(messages))
+        assert_in("'Firefox-50' from section 'managed_installs'",
+                  messages[1])
+
+    def test_unchanged_manifest(self):
+        changed, messages = remove_names_from_manifest(
+            "site", self.manifest, {"Absent"})
+        assert_false(changed)
+        assert_equal([], messages)
+
+
+class TestRemoveNamesFromManifests(object):
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        self.cache_dir = cache.CACHE_DIR
+        cache.CACHE_DIR = os.path.join(self.repo, "cache")
+        os.makedirs(os.path.join(self.repo, "manifests"))
+        self.paths = {}
+        for name, items in (("site", ["Firefox", "Chrome"]),
+                            ("lab", ["Firefox"])):
+            path = os.path.join(self.repo, "manifests", name)
+            FoundationPlist.writePlist({"managed_installs": items}, path)
+            os.chmod(path, 0644)
+            self.paths[name] = path
+
+    def tearDown(self):
+        cache.CACHE_DIR = self.cache_dir
+        shutil.rmtree(self.repo)
+
+    def test_rewrites_only_affected_manifests(self):
+        os.utime(self.paths["lab"], (0, 0))
+        remove_names_from_manifests({"Chrome"}, RepoContext(self.repo))
+        assert_equal(["Firefox"], FoundationPlist.readPlist(
+            self.paths["site"])["managed_installs"])
+        # The rewrite keeps the manifest's permissions.
+        assert_equal(0644, stat.S_IMODE(os.stat(self.paths["site"]).st_mode))
+        assert_equal(0, os.stat(self.paths["lab"]).st_mtime)
+        # No temporary files are left behind.
+        assert_equal(["lab", "site"], sorted(
+            os.listdir(os.path.join(self.repo, "manifests"))))
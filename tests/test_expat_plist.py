@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import datetime
+import os
+import plistlib
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from spruce_tools import expat_plist
+from spruce_tools import FoundationPlist
+
+
+class TestExpatPlist(object):
+
+    def setUp(self):
+        self.pkginfo = {
+            "name": u"Caf\xe9 & <Friends>",
+            "version": "1.0b3",
+            "installer_item_size": 1024,
+            "rating": 4.5,
+            "unattended_install": True,
+            "uninstallable": False,
+            "force_install_after_date": datetime.datetime(2016, 9, 2, 8),
+            "icon_data": plistlib.Data("\x00\x01binary"),
+            "catalogs": ["testing", "production"],
+            "receipts": [],
+            "installs": [{"path": "/Applications/Cafe.app"}],
+            "notes": ""}
+
+    def test_round_trip(self):
+        data = expat_plist.write_string(self.pkginfo)
+        assert_equal(self.pkginfo, expat_plist.read_string(data))
+
+    def test_matches_plistlib(self):
+        data = plistlib.writePlistToString(self.pkginfo)
+        assert_equal(plistlib.readPlistFromString(data),
+                     expat_plist.read_string(data))
+
+    def test_output_readable_by_plistlib(self):
+        data = expat_plist.write_string(self.pkginfo)
+        assert_equal(self.pkginfo, plistlib.readPlistFromString(data))
+
+    def test_malformed_raises(self):
+        assert_raises(expat_plist.PlistError, expat_plist.read_string,
+                      "<plist><dict><key>name</key>")
+
+    def test_binary_raises(self):
+        assert_raises(expat_plist.PlistError, expat_plist.read_string,
+                      "bplist00")
+
+    def test_none_raises(self):
+        assert_raises(expat_plist.PlistError, expat_plist.write_string,
+                      {"name": None})
+
+    def test_projection_keeps_only_keys(self):
+        data = expat_plist.write_string(self.pkginfo)
+        result = expat_plist.read_string(data, ("name", "catalogs", "missing"))
+        assert_equal({"name": self.pkginfo["name"],
+                      "catalogs": self.pkginfo["catalogs"]}, result)
+
+    def test_projection_applies_to_catalog_records(self):
+        catalog = [self.pkginfo, {"name": "Other", "installs": [{}]}]
+        data = expat_plist.write_string(catalog)
+        result = expat_plist.read_string(data, ("name", "installs"))
+        assert_equal([{"name": self.pkginfo["name"],
+                       "installs": self.pkginfo["installs"]},
+                      {"name": "Other", "installs": [{}]}], result)
+
+    def test_projection_keeps_nested_keys(self):
+        # Only record keys are projected; kept values are built whole.
+        data = expat_plist.write_string(
+            {"installs": [{"path": "/a", "type": "file"}], "notes": "x"})
+        assert_equal({"installs": [{"path": "/a", "type": "file"}]},
+                     expat_plist.read_string(data, ("installs",)))
+
+    def test_projection_key_without_value_raises(self):
+        assert_raises(expat_plist.PlistError, expat_plist.read_string,
+                      "<plist><dict><key>notes</key></dict></plist>",
+                      ("name",))
+
+
+class TestIterFile(object):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.catalog = [{"name": "Product%d" % index,
+                         "version": "1.%d" % index,
+                         "installs": [{"path": "/Applications/App.app"}]}
+                        for index in xrange(50)]
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, data):
+        with open(self.path, "wb") as ofile:
+            ofile.write(data)
+
+    def test_yields_each_item(self):
+        self.write(expat_plist.write_string(self.catalog))
+        # A small chunk size splits items across chunks.
+        assert_equal(self.catalog,
+                     list(expat_plist.iter_file(self.path, chunk_size=64)))
+
+    def test_yields_scalars_and_nested_arrays(self):
+        catalog = ["a", 1, [2, [3]], {}]
+        self.write(expat_plist.write_string(catalog))
+        assert_equal(catalog, list(expat_plist.iter_file(self.path)))
+
+    def test_projection(self):
+        self.write(expat_plist.write_string(self.catalog))
+        result = list(expat_plist.iter_file(self.path, ("name",)))
+        assert_equal([{"name": item["name"]} for item in self.catalog],
+                     result)
+
+    def test_dict_root_raises(self):
+        self.write(expat_plist.write_string({"name": "Product"}))
+        assert_raises(expat_plist.PlistError, list,
+                      expat_plist.iter_file(self.path))
+
+    def test_empty_file_raises(self):
+        assert_raises(expat_plist.PlistError, list,
+                      expat_plist.iter_file(self.path))
+
+
+class TestExpatWritePlist(object):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_failed_write_removes_temp_file(self):
+        # A plist can't replace a directory, so the rename fails.
+        path = os.path.join(self.folder, "target")
+        os.mkdir(path)
+        assert_raises(FoundationPlist.NSPropertyListWriteException,
+                      FoundationPlist._expat_writePlist, {"a": 1}, path)
+        assert_equal(["target"], os.listdir(self.folder))
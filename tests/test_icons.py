@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import os
+import shutil
+import tempfile
+import unicodedata
+
+from nose.tools import *
+
+from spruce_tools import cache
+from spruce_tools.icons import (
+    IconInventory, get_icon_key, get_icon_name, get_unused_icons)
+
+
+class TestIconNames(object):
+
+    def test_icon_name(self):
+        assert_equal("Chrome.png", get_icon_name({"name": "Chrome"}))
+        assert_equal("Chrome.png", get_icon_name({"name": "Chrome",
+                                                  "icon_name": ""}))
+        assert_equal("apps/Web.jpg", get_icon_name(
+            {"name": "Chrome", "icon_name": "apps/Web.jpg"}))
+        assert_equal("Web.png", get_icon_name({"icon_name": "Web"}))
+
+    def test_icon_key(self):
+        composed = u"Caf\u00e9.png"
+        decomposed = unicodedata.normalize("NFD", composed).encode("utf-8")
+        assert_equal(get_icon_key(composed), get_icon_key(decomposed))
+        assert_equal(get_icon_key("apps/chrome.PNG"),
+                     get_icon_key("/apps//Chrome.png"))
+
+
+class TestIconInventory(object):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_dir = cache.CACHE_DIR
+        cache.CACHE_DIR = os.path.join(self.root, "cache")
+        self.icons_path = os.path.join(self.root, "icons")
+        for path in ("Chrome.png", "firefox.PNG", "stale.png", ".DS_Store",
+                     "_icon_hashes.plist", "apps/Web.jpg", "apps/old.png",
+                     "apps/deep/older.png"):
+            self.add_icon(path)
+        # Listings of directories changed in the last moments are not
+        # cached, so age them.
+        for folder in ("", "apps", "apps/deep"):
+            os.utime(os.path.join(self.icons_path, folder), (0, 0))
+        self.pkginfos = {
+            "a": {"name": "Chrome"},
+            "b": {"name": "Firefox"},
+            "c": {"name": "Other", "icon_name": "apps/Web.jpg"}}
+
+    def tearDown(self):
+        cache.CACHE_DIR = self.cache_dir
+        shutil.rmtree(self.root)
+
+    def add_icon(self, path):
+        path = os.path.join(self.icons_path, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, "w").close()
+
+    def test_unused_icons(self):
+        unused = get_unused_icons(self.icons_path, self.pkginfos)
+        assert_equal({os.path.join(self.icons_path, path) for path in
+                      ("stale.png", "apps/old.png", "apps/deep/older.png")},
+                     unused)
+
+    def test_threaded_walk(self):
+        serial = IconInventory(self.icons_path).build(False, workers=1)
+        threaded = IconInventory(self.icons_path).build(False, workers=4)
+        assert_equal(6, len(serial.icons))
+        assert_equal(serial.icons, threaded.icons)
+        assert_equal(serial.keys, threaded.keys)
+
+    def test_cached_listing(self):
+        first = IconInventory(self.icons_path).build(True)
+        second = IconInventory(self.icons_path).build(True)
+        assert_equal(first.icons, second.icons)
+        # Changing a directory invalidates its cached listing.
+        self.add_icon("apps/new.png")
+        os.utime(os.path.join(self.icons_path, "apps"), (1, 1))
+        third = IconInventory(self.icons_path).build(True)
+        assert_equal(first.icons | {"apps/new.png"}, third.icons)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import os
+import shutil
+import tempfile
+import unicodedata
+
+from nose.tools import *
+
+from spruce_tools.inventory import PkgsInventory
+
+
+class TestPkgsInventory(object):
+
+    def setUp(self):
+        self.pkgs = tempfile.mkdtemp()
+        decomposed = unicodedata.normalize("NFD", u"apps/Caf\u00e9.dmg")
+        files = {"apps/Firefox-1.0.dmg": 10,
+                 decomposed.encode("utf-8"): 7,
+                 "apps/Orphan.dmg": 5,
+                 "Bundles/Tool.pkg/Contents/Info.plist": 20,
+                 "Bundles/Tool.pkg/Contents/Archive.bom": 30}
+        for rel_path, size in files.items():
+            path = os.path.join(self.pkgs, rel_path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "w") as ofile:
+                ofile.write("x" * size)
+        self.inventory = PkgsInventory(self.pkgs)
+
+    def tearDown(self):
+        shutil.rmtree(self.pkgs)
+
+    def test_exists(self):
+        assert_true(self.inventory.exists(u"apps/Firefox-1.0.dmg"))
+        assert_true(self.inventory.exists("Bundles/Tool.pkg"))
+        assert_false(self.inventory.exists("apps/Firefox-2.0.dmg"))
+
+    def test_case_and_normalization_insensitive(self):
+        # As on a case-insensitive, normalization-insensitive volume.
+        assert_true(self.inventory.exists("apps/firefox-1.0.DMG"))
+        assert_equal(10, self.inventory.get_size("apps/firefox-1.0.dmg"))
+        assert_equal(7, self.inventory.get_size(u"apps/Caf\u00e9.dmg"))
+        # The exact path is still reported as a path issue.
+        assert_equal("firefox-1.0.DMG",
+                     self.inventory.get_bad_path("apps/firefox-1.0.DMG"))
+
+    def test_bundle_size_is_total_of_contents(self):
+        assert_equal(50, self.inventory.get_size("Bundles/Tool.pkg"))
+        assert_equal(10, self.inventory.get_size("apps/Firefox-1.0.dmg"))
+        assert_is_none(self.inventory.get_size("apps/Missing.dmg"))
+
+    def test_bad_path(self):
+        assert_equal("bundles",
+                     self.inventory.get_bad_path("bundles/Tool.pkg"))
+        assert_is_none(self.inventory.get_bad_path("Bundles/Tool.pkg"))
+
+    def test_orphans_do_not_include_bundle_contents(self):
+        used = ["apps/firefox-1.0.dmg", "Bundles/Tool.pkg",
+                u"apps/Caf\u00e9.dmg"]
+        assert_equal(["apps/Orphan.dmg"], self.inventory.get_orphans(used))
+
+
+class TestUnicodePkgsPath(object):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.pkgs = os.path.join(self.root, "p\xc3\xa5kgs")
+        os.makedirs(os.path.join(self.pkgs, "apps"))
+        with open(os.path.join(self.pkgs, "apps", "Caf\xc3\xa9.dmg"),
+                  "w") as ofile:
+            ofile.write("x" * 7)
+        # RepoContext gives the inventory a unicode path. Names are
+        # created as UTF-8 bytes, which works under any locale.
+        self.inventory = PkgsInventory(self.pkgs.decode("utf-8"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_non_ascii_installer(self):
+        for installer in (u"apps/Caf\u00e9.dmg", "apps/Caf\xc3\xa9.dmg"):
+            assert_true(self.inventory.exists(installer))
+            assert_equal(7, self.inventory.get_size(installer))
+            assert_is_none(self.inventory.get_bad_path(installer))
+        assert_equal([], self.inventory.get_orphans([u"apps/Caf\u00e9.dmg"]))
+        assert_equal(os.path.join(self.pkgs, "apps/Caf\xc3\xa9.dmg"),
+                     self.inventory.get_full_path(u"apps/Caf\u00e9.dmg"))
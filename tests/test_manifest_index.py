@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from fakes import FakeNSArray
+from spruce_tools import cache
+from spruce_tools import expat_plist
+from spruce_tools.manifest_index import ManifestIndex, summarize
+
+
+class TestSummarize(object):
+
+    def test_foundation_conditional_items(self):
+        manifest = {
+            "managed_installs": FakeNSArray(["Firefox"]),
+            "conditional_items": FakeNSArray([
+                {"condition": "machine_type == 'laptop'",
+                 "managed_installs": FakeNSArray(["Chrome"]),
+                 "included_manifests": FakeNSArray(["laptops"])}])}
+        items, includes = summarize(manifest)
+        assert_equal(frozenset(["Firefox", "Chrome"]), items)
+        assert_equal(("laptops",), includes)
+
+
+class TestManifestIndex(object):
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        self.cache_dir = cache.CACHE_DIR
+        cache.CACHE_DIR = os.path.join(self.repo, "cache")
+        self.write("site_default", {"managed_installs": ["Firefox"]})
+        self.write("groups/lab", {
+            "included_manifests": ["site_default"],
+            "optional_installs": ["Chrome"],
+            "conditional_items": [{"condition": "arch == 'x86_64'",
+                                   "managed_updates": ["Flash"]}]})
+        self.write("machines/lab-01", {
+            "included_manifests": ["groups/lab", "missing"],
+            "managed_installs": ["Firefox"]})
+        # A cycle: each includes the other.
+        self.write("cycle_a", {"included_manifests": ["cycle_b"],
+                               "managed_installs": ["A"]})
+        self.write("cycle_b", {"included_manifests": ["cycle_a"],
+                               "managed_installs": ["B"]})
+
+    def tearDown(self):
+        cache.CACHE_DIR = self.cache_dir
+        shutil.rmtree(self.repo)
+
+    def write(self, name, manifest):
+        path = os.path.join(self.repo, "manifests", name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as ofile:
+            ofile.write(expat_plist.write_string(manifest))
+
+    def test_items(self):
+        index = ManifestIndex(self.repo).build(use_cache=False)
+        assert_equal({"Firefox", "Chrome", "Flash", "A", "B"},
+                     index.get_all_items())
+        assert_equal({"site_default", "machines/lab-01"},
+                     index.get_referencing_manifests("Firefox"))
+        assert_equal(set(), index.get_referencing_manifests("Absent"))
+
+    def test_effective_items_follow_includes(self):
+        index = ManifestIndex(self.repo).build(use_cache=False)
+        assert_equal({"Firefox", "Chrome", "Flash"},
+                     index.get_effective_items("machines/lab-01"))
+        assert_equal({"groups/lab", "machines/lab-01"},
+                     index.get_including_manifests("site_default"))
+
+    def test_missing_include_is_an_error(self):
+        index = ManifestIndex(self.repo).build(use_cache=False)
+        assert_equal(["Included manifest 'missing' does not exist"],
+                     index.errors["machines/lab-01"])
+
+    def test_cycle_is_broken(self):
+        index = ManifestIndex(self.repo).build(use_cache=False)
+        assert_equal({"A", "B"}, index.get_effective_items("cycle_a"))
+        assert_equal(1, len(index.errors["cycle_b"]))
+
+    def test_cache_picks_up_changes(self):
+        ManifestIndex(self.repo).build(use_cache=True)
+        self.write("site_default", {"managed_installs": ["Firefox", "Slack"]})
+        index = ManifestIndex(self.repo).build(use_cache=True)
+        assert_equal({"Firefox", "Slack"}, index.items["site_default"])
+        assert_equal({"Chrome", "Flash"}, index.items["groups/lab"])
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from spruce_tools import repo as repo_module
+from spruce_tools.context import RepoContext
+from spruce_tools.repo import Application, ApplicationVersion, Repo
+
+
+def make_pkginfo(name, version, **kwargs):
+    pkginfo = {"name": name, "version": version, "catalogs": ["production"],
+               "installer_item_location": "{}-{}.dmg".format(name, version),
+               "installer_item_size": 1}
+    pkginfo.update(kwargs)
+    return pkginfo
+
+
+class TestRetentionRanks(object):
+
+    def setUp(self):
+        pkginfos = [
+            make_pkginfo("Firefox", "1.0"),
+            make_pkginfo("Firefox", "2.0"),
+            make_pkginfo("Firefox", "3.0", catalogs=["testing"]),
+            make_pkginfo("Firefox", "2.5", minimum_os_version="10.99"),
+            make_pkginfo("Core", "1", requires=["Library-1"]),
+            make_pkginfo("Core", "2"),
+            make_pkginfo("Plugin", "1", update_for=["Firefox"]),
+            make_pkginfo("Library", "1"),
+            make_pkginfo("Library", "2")]
+        pkginfos[0]["requires"] = ["Core"]
+        self.repo = Repo(
+            {"{}-{}".format(pkginfo["name"], pkginfo["version"]): pkginfo for
+             pkginfo in pkginfos}, RepoContext("/tmp/spruce-test"))
+
+    def get_ranks(self, manifest_items, catalogs=("production",)):
+        ranks = self.repo.get_retention_ranks(manifest_items, catalogs)
+        return {"{}-{}".format(item.name, item.version): rank for
+                item, rank in ranks.items()}
+
+    def test_ranks(self):
+        assert_equal({"Firefox-2.0": 1, "Firefox-1.0": 2, "Core-2": 2,
+                      "Core-1": 2, "Library-2": 2, "Library-1": 2,
+                      "Plugin-1": 1},
+                     self.get_ranks(["Firefox"]))
+
+    def test_used_items_match_ranks(self):
+        for keep in (1, 2):
+            used = self.repo.get_used_items(["Firefox"], keep, ("production",))
+            assert_equal(
+                {name for name, rank in self.get_ranks(["Firefox"]).items() if
+                 rank <= keep},
+                {"{}-{}".format(item.name, item.version) for item in used})
+
+    def test_os_range_above_default(self):
+        # Items without a maximum_os_version have no upper bound.
+        ranks = self.repo.get_retention_ranks(
+            ["Firefox"], ("production",), ("10.13", "10.14"))
+        assert_equal(
+            self.get_ranks(["Firefox"]),
+            {"{}-{}".format(item.name, item.version): rank for
+             item, rank in ranks.items()})
+
+    def test_maximum_os_version_excludes(self):
+        repo = Repo({"old": make_pkginfo("App", "1.0"),
+                     "new": make_pkginfo("App", "2.0",
+                                         maximum_os_version="10.12.6")},
+                    RepoContext("/tmp/spruce-test"))
+        for os_range, version in ((("10.11", "10.12.6"), "2.0"),
+                                  (("10.13", "10.14"), "1.0")):
+            used = repo.get_used_items(["App"], 1, ("production",), os_range)
+            assert_equal([version], [item.version for item in used])
+
+    def test_missing_manifest_item(self):
+        assert_equal({}, self.get_ranks(["Nope"]))
+        assert_in("Nope", self.repo.missing_items)
+
+    def test_deep_dependency_chain(self):
+        pkginfos = {}
+        for index in xrange(3000):
+            pkginfo = make_pkginfo("P{}".format(index), "1")
+            pkginfo["requires"] = ["P{}".format(index + 1)]
+            pkginfos[index] = pkginfo
+        del pkginfos[index]["requires"]
+        repo = Repo(pkginfos, RepoContext("/tmp/spruce-test"))
+        assert_equal(3000, len(repo.get_used_items(["P0"], 1)))
+
+    def test_ranks_are_memoized(self):
+        ranks = self.repo.get_retention_ranks(["Firefox"], ("production",))
+        ranks.clear()
+        assert_equal(self.get_ranks(["Firefox"]),
+                     self.get_ranks(set(["Firefox"])))
+        assert_equal(7, len(self.get_ranks(["Firefox"])))
+
+    def test_records_share_strings(self):
+        first = self.repo["Firefox"]["1.0"]
+        second = self.repo["Firefox"]["2.0"]
+        assert_false(hasattr(first, "__dict__"))
+        assert_true(first.catalogs is second.catalogs)
+        assert_equal(("production",), first.catalogs)
+
+
+class TestApplication(object):
+
+    def setUp(self):
+        self.warnings = []
+        self.robo_print = repo_module.robo_print
+        repo_module.robo_print = lambda message, *args: (
+            self.warnings.append(message))
+
+    def tearDown(self):
+        repo_module.robo_print = self.robo_print
+
+    def test_duplicate_version_detected_on_add(self):
+        first = ApplicationVersion("first", make_pkginfo("App", "1.0"))
+        app = Application("App", (first,))
+        assert_equal([], self.warnings)
+        app.add(ApplicationVersion("newer", make_pkginfo("App", "2.0")))
+        assert_equal([], self.warnings)
+        app.add(ApplicationVersion("second", make_pkginfo("App", "1.0")))
+        assert_equal(1, len(self.warnings))
+        assert_in("version '1.0' of 'App'! Using 'first'", self.warnings[0])
+        # The first pkginfo added wins lookups; both are kept, newest
+        # first, with duplicates in the order they were added.
+        assert_true(app["1.0"] is first)
+        assert_equal(["newer", "first", "second"],
+                     [item.pkginfo_path for item in app])
+
+
+class TestResolveSizes(object):
+
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.repo_path, "pkgs"))
+        with open(os.path.join(self.repo_path, "pkgs", "App-1.0.dmg"),
+                  "w") as ofile:
+            ofile.write("x" * 10)
+        self.context = RepoContext(self.repo_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.repo_path)
+
+    def make_repo(self, verify=False):
+        pkginfos = {"present": make_pkginfo("App", "1.0"),
+                    "missing": make_pkginfo("App", "2.0")}
+        for pkginfo in pkginfos.values():
+            del pkginfo["installer_item_size"]
+        pkginfos["sized"] = make_pkginfo("Other", "1.0")
+        repo = Repo(pkginfos, self.context)
+        repo.resolve_sizes(verify=verify)
+        return repo
+
+    def test_missing_installers_are_errors(self):
+        repo = self.make_repo()
+        assert_equal(10, repo["App"]["1.0"].size)
+        missing = repo["App"]["2.0"]
+        assert_equal(0, missing.size)
+        error = "'App-2.0' installer 'App-2.0.dmg' does not exist."
+        assert_equal([error], missing.errors)
+        assert_equal({error}, repo.errors)
+        # Sized from its pkginfo, in KiB, without touching the disk.
+        assert_equal(1024, repo["Other"]["1.0"].size)
+
+    def test_verify_sizes_from_disk(self):
+        repo = self.make_repo(verify=True)
+        assert_equal(10, repo["App"]["1.0"].size)
+        assert_equal(0, repo["Other"]["1.0"].size)
+        assert_in("'Other-1.0' installer 'Other-1.0.dmg' does not exist.",
+                  repo.errors)
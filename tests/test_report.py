@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from spruce_tools import cache
+from spruce_tools import FoundationPlist
+from spruce_tools.context import RepoContext
+from spruce_tools.report import (
+    REPORTS, NoUsageReport, PkgsinfoWithErrorsReport, ReportData,
+    UnattendedProdReport, build_reports)
+
+
+class TestReports(object):
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        self.cache_dir = cache.CACHE_DIR
+        cache.CACHE_DIR = os.path.join(self.repo, "cache")
+        for folder in ("pkgs/apps", "pkgsinfo/apps", "manifests"):
+            os.makedirs(os.path.join(self.repo, folder))
+        for index in xrange(12):
+            for catalog in ("production", "testing"):
+                pkginfo = {
+                    "name": "App{}".format(index % 4),
+                    "version": "{}.{}".format(index, catalog == "testing"),
+                    "catalogs": [catalog],
+                    "installer_item_location": "apps/App-{}-{}.dmg".format(
+                        index, catalog),
+                    "unattended_install": bool(index % 3)}
+                if index % 5 == 0:
+                    pkginfo["force_install_after_date"] = "2016-01-01"
+                self.write("pkgsinfo/apps/App-{}-{}.plist".format(
+                    index, catalog), pkginfo)
+                # Every third installer is missing.
+                if index % 3:
+                    self.write(os.path.join(
+                        "pkgs", pkginfo["installer_item_location"]), {})
+        self.write("pkgs/apps/Orphan.dmg", {})
+        with open(os.path.join(self.repo, "pkgsinfo", "Broken.plist"),
+                  "w") as ofile:
+            ofile.write("<plist><dict><key>name</key>")
+        self.write("manifests/site_default",
+                   {"managed_installs": ["App0", "App1"]})
+        self.context = RepoContext(self.repo)
+
+    def tearDown(self):
+        cache.CACHE_DIR = self.cache_dir
+        shutil.rmtree(self.repo)
+
+    def write(self, path, data):
+        FoundationPlist.writePlist(data, os.path.join(self.repo, path))
+
+    def test_builds_only_required_inputs(self):
+        repo_data = ReportData(self.context)
+        repo_data.build(PkgsinfoWithErrorsReport.requires)
+        assert_in("errors", repo_data)
+        for key in ("pkgs_inventory", "manifest_index", "manifest_items",
+                    "repo_data"):
+            assert_false(key in repo_data)
+
+        repo_data.build(UnattendedProdReport.requires)
+        repo_data.build(NoUsageReport.requires)
+        assert_in("repo_data", repo_data)
+        assert_in("manifest_items", repo_data)
+        assert_false("pkgs_inventory" in repo_data)
+
+    def test_unknown_input(self):
+        assert_raises(KeyError, ReportData(self.context).__getitem__, "nope")
+
+    def run_reports(self, mode):
+        repo_data = ReportData(self.context)
+        repo_data.build({key for report_class in REPORTS for key in
+                         report_class.requires})
+        return [(report.__class__, report.as_dict()) for report in
+                build_reports(REPORTS, repo_data, mode, workers=3)]
+
+    def test_report_modes_match_serial(self):
+        serial = self.run_reports("serial")
+        assert_equal(list(REPORTS), [report_class for report_class, _ in
+                                     serial])
+        assert_true(any(report["items"] for _, report in serial))
+        assert_equal(serial, self.run_reports("serial"))
+        for mode in ("thread", "process"):
+            for _ in xrange(3):
+                assert_equal(serial, self.run_reports(mode))
+
+    def test_thread_mode_reads_finished_data(self):
+        serial = self.run_reports("serial")
+        # iter_reports builds every required input before the pool
+        # starts, even when the caller has not.
+        repo_data = ReportData(self.context)
+        reports = build_reports(REPORTS, repo_data, "thread", workers=3)
+        assert_equal(serial, [(report.__class__, report.as_dict()) for
+                              report in reports])
+
+        # Running the reports again only reads the shared data.
+        repo = repo_data["repo_data"]
+
+        def snapshot():
+            return (sorted(repo_data._data), len(repo._ranks),
+                    len(repo._os_indexes), len(repo._dependency_names),
+                    sorted(repo.errors), sorted(repo.missing_items))
+
+        before = snapshot()
+        build_reports(REPORTS, repo_data, "thread", workers=3)
+        assert_equal(before, snapshot())
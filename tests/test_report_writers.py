@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import json
+import plistlib
+from StringIO import StringIO
+
+from nose.tools import *
+
+from spruce_tools import report, report_writers
+
+
+class TestReportWriters(object):
+
+    def setUp(self):
+        self.report = report.Report({})
+        self.report.key = "example"
+        self.report.items_keys = (("name", False),)
+        self.report.items = [
+            {"name": u"Caf\xe9", "version": "2.0", "path": "b.plist",
+             "error": "bad <key>"},
+            {"name": "Alpha", "version": "1.0", "path": "a.plist"}]
+        self.report.metadata = [{"total": "1 item"}]
+        self.stream = StringIO()
+
+    def write(self, output_format):
+        writer = report_writers.get_writer(output_format, self.stream)
+        writer.start()
+        writer.write_report(self.report)
+        writer.finish()
+        return self.stream.getvalue()
+
+    def test_plist_matches_as_dict(self):
+        output = plistlib.readPlistFromString(self.write("plist"))
+        assert_equal({self.report.name: self.report.as_dict()}, output)
+
+    def test_ndjson(self):
+        lines = [json.loads(line) for line in
+                 self.write("ndjson").splitlines()]
+        assert_equal(["Alpha", u"Caf\xe9", None],
+                     [line.get("name") for line in lines])
+        assert_equal(["items", "items", "metadata"],
+                     [line["section"] for line in lines])
+        assert_equal("example", lines[0]["report"])
+
+    def test_csv_details(self):
+        rows = self.write("csv").splitlines()
+        assert_equal(4, len(rows))
+        assert_equal("example,items,Caf\xc3\xa9,2.0,b.plist,,error=bad <key>",
+                     rows[2])
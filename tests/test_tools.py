@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import os
+import shutil
+import tempfile
+
+from nose.tools import *
+
+from spruce_tools import FoundationPlist
+from spruce_tools import tools
+
+
+class TestParseModes(object):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.paths = []
+        for index in xrange(40):
+            path = os.path.join(self.folder, "Item-{}.plist".format(index))
+            FoundationPlist.writePlist(
+                {"name": "Item", "version": str(index),
+                 "catalogs": ["production"],
+                 "installs": [{"path": "/Applications/Item.app"}]}, path)
+            self.paths.append(path)
+        broken = os.path.join(self.folder, "broken.plist")
+        with open(broken, "w") as ofile:
+            ofile.write("<plist><dict><key>name</key>")
+        self.paths.insert(20, broken)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_pools_match_serial(self):
+        for keys in (None, ("name", "version")):
+            serial = tools.parse_plists(
+                self.paths, native=True, mode="serial", keys=keys)
+            assert_is_none(serial[0][1])
+            assert_is_none(serial[20][0])
+            for mode in ("thread", "process"):
+                assert_equal(serial, tools.parse_plists(
+                    self.paths, native=True, mode=mode, workers=3,
+                    keys=keys))
+
+    def test_workers_must_be_positive(self):
+        for value in (0, -2, "3"):
+            assert_raises(ValueError, tools.ParseMode.set_workers, value)
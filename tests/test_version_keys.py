@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# Copyright 2016 Shea G. Craig
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+#
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from nose.tools import *
+
+from spruce_tools.version_keys import compare_versions, version_key
+
+
+class TestVersionKeys(object):
+
+    def test_padding_is_equal(self):
+        assert_equal(version_key("10.8"), version_key("10.8.0"))
+        assert_equal(version_key("10.8"), version_key("10.8.0.0"))
+        assert_equal(0, compare_versions("10.8", "10.8.0"))
+
+    def test_numeric_components(self):
+        assert_equal(-1, compare_versions("10.9.5", "10.10"))
+        assert_equal(1, compare_versions("2.0.10", "2.0.9"))
+
+    def test_numbers_sort_before_letters(self):
+        assert_equal(-1, compare_versions("1.0.1", "1.0b1"))
+        assert_equal(-1, compare_versions("1.0", "1.0b1"))
+        assert_equal(-1, compare_versions("1.0b1", "1.0b2"))
+
+    def test_unicode_and_none(self):
+        assert_equal(version_key("1.2"), version_key(u"1.2"))
+        assert_equal((), version_key(None))
+        assert_equal(-1, compare_versions(None, "0.1"))
+
+    def test_sort(self):
+        versions = ["10.0", "1.10", "1.9", "1.9.1", "1.10b1", "2"]
+        assert_equal(["1.9", "1.9.1", "1.10", "1.10b1", "2", "10.0"],
+                     sorted(versions, key=version_key))